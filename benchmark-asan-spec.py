@@ -1,104 +1,262 @@
-import multiprocessing
 import subprocess
 import optparse
-import tempfile
-import shutil
-import time
+import random
+import json
 import sys
 import os
-import re
+
+from harness.buildcache import BuildCache, snapshot, build_inputs, identity_in
+from harness.cpus import RunCPUs, pin_run, reserve_cpus, set_affinity
+from harness.durations import DurationIndex
+from harness.executor import TaskGraph, available_cpus
+from harness.jobserver import Jobserver
+from harness.memory import MemorySampler
+from harness.progress import Progress
+from harness.remote import WorkerPool, parse_address, RETRIES
+from harness.resultdb import ResultDB, build_identity
+from harness.rusage import run_measured, cpu_time
+from harness.stats import mean, median, stdev, confidence_interval, relative_ci_width, \
+                          reject_outliers, runs_needed
+from harness.spec import find_spec_names, make_command
+from harness.workspace import Workspace, workspace_label
 
 CFLAGS = '-O2 -std=gnu89 -faddress-sanitizer'
 CXXFLAGS = CFLAGS
 PYTHON = sys.executable
-PROCESSORS = 1  #multiprocessing.cpu_count()
+PROCESSORS = available_cpus()
 TEMP_DIR = os.getcwd() + '/test-spec-temp'
+BUILD_CACHE_DIR = TEMP_DIR + '/build-cache'
+WORKSPACE_DIR = TEMP_DIR + '/workspaces'
+RESULT_DB = TEMP_DIR + '/results.db'
+CPU_LOCK_DIR = TEMP_DIR + '/cpus'
+DURATION_INDEX = TEMP_DIR + '/durations.json'
 
 USAGE = 'usage: %prog [options] SPEC_PATH CLANG_BIN_DIR'
 
-class WorkerProcess(multiprocessing.Process):
-  def __init__(self, name, Q, spec_path, clang_bin_dir, runs, asan_opt):
-    super(WorkerProcess, self).__init__()
+def asan_flags(asan_opt):
+  return (CFLAGS + (' -mllvm "-asan-opt=%d"' % asan_opt),
+          CXXFLAGS + (' -mllvm "-asan-opt=%d"' % asan_opt))
+
+def asan_label(clang_bin_dir, asan_opt):
+  return workspace_label('asan-opt%d' % asan_opt, os.path.realpath(clang_bin_dir),
+                         *asan_flags(asan_opt))
+
+def remote_build(name, spec_path, clang_bin_dir, asan_opt, identity):
+  """compile_benchmark as the build of a worker job (see harness/remote.py)."""
+  make_args = make_command(clang_bin_dir, *asan_flags(asan_opt))
+  inputs = build_inputs(spec_path + '/' + name + '/src', make_args, clang_bin_dir, identity)
+  return {'benchmark': name, 'label': asan_label(clang_bin_dir, asan_opt), 'make_args': make_args,
+          'clang_bin_dir': clang_bin_dir,
+          'inputs': dict((key, inputs[key]) for key in ['sources', 'compiler', 'files'])}
+
+def compile_benchmark(name, spec_path, clang_bin_dir, asan_opt, cache_dir, workspace_root,
+                      build_cpus):
+  if build_cpus:
+    # make and the compilers inherit it
+    set_affinity(build_cpus)
+  cflags, cxxflags = asan_flags(asan_opt)
+  workspace = Workspace(workspace_root, spec_path, name, asan_label(clang_bin_dir, asan_opt))
+  src_path = workspace.src_path
+  args = make_command(clang_bin_dir, cflags, cxxflags)
+  dev_null = open(os.devnull, 'w')
+  lock = workspace.lock()
+  try:
+    workspace.prepare()
+    workspace.clean()
+    cache = BuildCache(cache_dir) if cache_dir else None
+    if cache:
+      key = cache.key(src_path, args, clang_bin_dir)
+      if cache.restore(key, src_path) is not None:
+        return workspace
+      before = snapshot(src_path)
+    subprocess.check_call(args, stderr=dev_null, stdout=dev_null, cwd=src_path)
+    if cache:
+      cache.store(key, src_path, before)
+  finally:
+    lock.release()
+    dev_null.close()
+  return workspace
+
+def run_once(memory_interval, workspace):
+  run_dir = workspace.acquire_run_dir()
+  try:
+    sampler = MemorySampler(memory_interval) if memory_interval else None
+    return run_measured([run_dir.path + 'run.sh'], run_dir.path, sampler=sampler)
+  finally:
+    run_dir.release()
+
+def run_benchmark(memory_interval, run_cpus, workspace):
+  slot = pin_run(run_cpus)
+  try:
+    return run_once(memory_interval, workspace)
+  finally:
+    if slot:
+      slot.release()
+
+def run_pair(a_first, memory_interval, run_cpus, workspace_a, workspace_b):
+  """Run both variants back to back in this worker, in the given order, on
+  the same reserved CPUs."""
+  slot = pin_run(run_cpus)
+  try:
+    if a_first:
+      a = run_once(memory_interval, workspace_a)
+      b = run_once(memory_interval, workspace_b)
+    else:
+      b = run_once(memory_interval, workspace_b)
+      a = run_once(memory_interval, workspace_a)
+  finally:
+    if slot:
+      slot.release()
+  return {'a': a, 'b': b, 'order': 'AB' if a_first else 'BA'}
+
+def pair_ratio(pair):
+  return cpu_time(pair['b']) / cpu_time(pair['a'])
+
+def pair_wall(pair):
+  return pair['a']['wall'] + pair['b']['wall']
+
+class AdaptiveRuns(object):
+  """Schedules runs of one benchmark until its timing is trustworthy.
+
+  After the warm-up runs, runs are added in batches until the 95% confidence
+  interval of the measured value (outliers excluded) is narrower than the
+  target, or until the run count or time budget is exhausted.  With
+  adaptive=False exactly `runs` runs are made.  cost is the expected seconds
+  of one run.  With remote, the runs are the worker jobs remote(*args())
+  instead of func(*args()), all on the worker of the benchmark's builds.
+  """
+  def __init__(self, graph, name, options, adaptive=True, func=run_benchmark, measure=cpu_time,
+               wall=lambda record: record['wall'], args=lambda: (None, None), cost=0.0,
+               remote=None):
+    self.graph = graph
     self.name = name
-    self.Q = Q
-    self.spec_path = spec_path
-    self.clang_bin_dir = clang_bin_dir
-    self.runs = runs
-    self.asan_opt = asan_opt
-
-  @classmethod
-  def _get_time(cls, output):
-    total = 0
-    lines = output.split('\n')
-
-    user_time = lines[1].split(' ')
-    assert user_time[0] == 'user'
-    total += float(user_time[1])
-
-    sys_time = lines[2].split(' ')
-    assert sys_time[0] == 'sys'
-    total += float(sys_time[1])
-    return total
-
-  def create_links(self):
-    src = self.spec_path + os.sep + self.name
-    dst = self.temp_dir
-    os.symlink(src + os.sep + 'run.sh', dst + os.sep + 'run.sh')
-    for folder in ['src', 'data']:
-      for file in os.listdir(src + os.sep + folder):
-        os.symlink(src + os.sep + folder + os.sep + file, dst + os.sep + folder + os.sep + file)
-
-  def create_temp_dir(self):
-    self.temp_dir = tempfile.mkdtemp()
-    os.makedirs(self.temp_dir + os.sep + 'src')
-    os.makedirs(self.temp_dir + os.sep + 'data')
-    self.create_links()
-
-  def close(self):
-    shutil.rmtree(self.temp_dir)
-
-  def run(self):
-    self.create_temp_dir()
-    name = self.name
-    init_path = self.temp_dir + os.sep
-    src_path = init_path + 'src' + os.sep
-    sys.stderr.write('start %s\n' % name)
+    self.options = options
+    self.adaptive = adaptive
+    self.func = func
+    self.measure = measure
+    self.wall = wall
+    self.args = args
+    self.cost = cost
+    self.remote = remote
+    self.records = []
+    self.outstanding = 0
+    self.started = 0
+    self.spent = 0.0
+    self.failed = False
 
-    try:
-      clang_bin = self.clang_bin_dir + '/clang'
-      args = ['make']
-      args.append('CC=' + self.clang_bin_dir + '/clang')
-      args.append('CXX=' + self.clang_bin_dir + '/clang++')
-      args.append('CFLAGS=' + CFLAGS + (' -mllvm "-asan-opt=%d"' % self.asan_opt))
-      args.append('CXXFLAGS=' + CXXFLAGS + (' -mllvm "-asan-opt=%d"' % self.asan_opt))
-      dev_null = open(os.devnull, 'w')
-      subprocess.check_call(args, stderr=dev_null, stdout=dev_null, cwd=src_path)
-      dev_null.close()
-
-      times = []
-      for _ in xrange(self.runs):
-        out = subprocess.check_output(['time -p bash -c "' + init_path + 'run.sh' + ' > /dev/null 2> /dev/null"'], stderr=subprocess.STDOUT, shell=True, cwd=init_path)
-        times.append(self._get_time(out))
-
-      self.Q.put_nowait((name, times))
-    except:
-      self.Q.put_nowait((name, None))
-      sys.stderr.write('fail %s\n' % name)
-      self.close()
-      raise
-    sys.stderr.write('end %s\n' % name)
-    self.close()
-
-def find_spec_names(path):
-  res = []
-  for entry in os.listdir(path):
-    prefix = path + '/' + entry
-    if not os.path.exists(prefix + '/src'):
-      continue
-    if not os.path.exists(prefix + '/run.sh'):
-      continue
-    res.append(entry)
-  return sorted(res)
+  def start(self, deps):
+    self.deps = deps
+    self.warming_up = self.adaptive and self.options.warmup > 0
+    if self.warming_up:
+      self._add_runs(self.options.warmup, 'warmup')
+    else:
+      self._add_runs(self.options.min_runs if self.adaptive else self.options.runs, 'run')
+
+  def _add_runs(self, count, kind):
+    for _ in xrange(count):
+      key = '%s:%s%d' % (self.name, kind, self.started)
+      if self.remote is not None:
+        self.graph.add_remote(key, self.remote(*self.args()), deps=self.deps,
+                              cores=self.options.run_cores, cost=self.cost, affinity=self.name)
+      else:
+        self.graph.add(key, self.func, self.args(), deps=self.deps, cores=self.options.run_cores,
+                       cost=self.cost)
+      self.started += 1
+      self.outstanding += 1
+
+  def values(self):
+    return [self.measure(record) for record in self.records]
+
+  def done(self, ok, record):
+    self.outstanding -= 1
+    if not ok:
+      self.failed = True
+    elif not self.warming_up:
+      self.records.append(record)
+      self.spent += self.wall(record)
+    if self.outstanding or self.failed or not self.adaptive:
+      return
+
+    if self.warming_up:
+      self.warming_up = False
+      self._add_runs(self.options.min_runs, 'run')
+      return
+
+    values, _ = reject_outliers(self.values())
+    target = self.options.ci_width / 100.0
+    if len(values) >= self.options.min_runs and relative_ci_width(values) <= target:
+      return
+    remaining = self.options.max_runs - len(self.records)
+    budget = self.options.time_budget - self.spent
+    if remaining <= 0 or budget <= 0:
+      return
+    count = max(1, runs_needed(values, target) - len(values))
+    count = min(count, remaining, int(budget / (self.spent / len(self.records))) or 1)
+    self._add_runs(count, 'run')
+
+def memory_stats(records):
+  """(peak RSS, average RSS, peak VSZ, peak mappings) of the sampled records
+  in MB, or None without samples."""
+  memory = [record['memory'] for record in records if 'memory' in record]
+  if not memory:
+    return None
+  return (max(m['peak_rss_kb'] for m in memory) / 1024.0,
+          mean([m['avg_rss_kb'] for m in memory]) / 1024.0,
+          max(m['peak_vsz_kb'] for m in memory) / 1024.0,
+          max(m['peak_mappings'] for m in memory))
+
+def write_memory_columns(records):
+  stats = memory_stats(records)
+  if stats is not None:
+    sys.stderr.write('        PEAKMEM %.1fMB        AVGMEM %.1fMB        PEAKVSZ %.1fMB'
+                     '        MAPS %d' % stats)
+
+def write_adaptive_report(name, runs):
+  sys.stderr.write(name)
+  if runs.failed or not runs.records:
+    sys.stderr.write('        fail\n')
+    return
+  times, outliers = reject_outliers(runs.values())
+  low, high = confidence_interval(times)
+  sys.stderr.write('        n=%d' % len(runs.records))
+  sys.stderr.write('        MEDIAN %.3f' % median(times))
+  sys.stderr.write('        MEAN %.3f' % mean(times))
+  sys.stderr.write('        SD %.3f' % stdev(times))
+  sys.stderr.write('        CI95 %.3f-%.3f (+-%.1f%%)' % (low, high, 100 * relative_ci_width(times)))
+  sys.stderr.write('        OUTLIERS %d' % len(outliers))
+  max_rss = max(record['max_rss_kb'] for record in runs.records)
+  sys.stderr.write('        MAXRSS %.1fMB' % (max_rss / 1024.0))
+  write_memory_columns(runs.records)
+  sys.stderr.write('\n')
+
+def write_compare_report(name, runs):
+  sys.stderr.write(name)
+  if runs.failed or not runs.records:
+    sys.stderr.write('        fail\n')
+    return
+  ratios, outliers = reject_outliers(runs.values())
+  low, high = confidence_interval(ratios)
+  sys.stderr.write('        n=%d' % len(runs.records))
+  sys.stderr.write('        OPT0 %.3f' % median([cpu_time(pair['a']) for pair in runs.records]))
+  sys.stderr.write('        OPT1 %.3f' % median([cpu_time(pair['b']) for pair in runs.records]))
+  sys.stderr.write('        RATIO %.4f' % mean(ratios))
+  sys.stderr.write('        CI95 %.4f-%.4f' % (low, high))
+  if high < 1.0 or low > 1.0:
+    sys.stderr.write(' *')
+  sys.stderr.write('        OUTLIERS %d' % len(outliers))
+  max_rss_a = max(pair['a']['max_rss_kb'] for pair in runs.records)
+  max_rss_b = max(pair['b']['max_rss_kb'] for pair in runs.records)
+  sys.stderr.write('        MAXRSS %.1fMB/%.1fMB' % (max_rss_a / 1024.0, max_rss_b / 1024.0))
+  memory_a = memory_stats([pair['a'] for pair in runs.records])
+  memory_b = memory_stats([pair['b'] for pair in runs.records])
+  if memory_a is not None and memory_b is not None:
+    sys.stderr.write('        PEAKMEM %.1fMB/%.1fMB' % (memory_a[0], memory_b[0]))
+    sys.stderr.write('        AVGMEM %.1fMB/%.1fMB' % (memory_a[1], memory_b[1]))
+    sys.stderr.write('        PEAKVSZ %.1fMB/%.1fMB' % (memory_a[2], memory_b[2]))
+    sys.stderr.write('        MAPS %d/%d' % (memory_a[3], memory_b[3]))
+    if memory_a[0]:
+      sys.stderr.write('        MEMRATIO %.4f' % (memory_b[0] / memory_a[0]))
+  sys.stderr.write('\n')
 
 if __name__ == '__main__':
   parser = optparse.OptionParser(usage=USAGE)
@@ -106,10 +264,78 @@ if __name__ == '__main__':
                     help="Use ASan optimizations")
   parser.add_option("-r", "--runs", dest="runs", type="int", default=1,
                     help="Number of runs", metavar="RUNS")
+  parser.add_option("-j", "--jobs", dest="jobs", type="int", default=PROCESSORS,
+                    help="Number of cores used by tasks and their make jobs together", metavar="JOBS")
+  parser.add_option("--no-jobserver", action="store_false", dest="jobserver", default=True,
+                    help="Run make serially instead of sharing the cores with it")
+  parser.add_option("--run-cores", dest="run_cores", type="int", default=1,
+                    help="Cores reserved for every timed run in the jobs budget, e.g. 2 to keep " +
+                         "SMT siblings idle; the runs are only pinned to them with --run-cpus",
+                    metavar="CORES")
+  parser.add_option("--run-cpus", dest="run_cpus", default=None,
+                    help="Pin every timed run to its own slot of --run-cores consecutive CPUs " +
+                         "of LIST (e.g. 2-7, or 2,10,3,11 for SMT siblings) and the builds " +
+                         "to the other CPUs", metavar="LIST")
+  parser.add_option("--build-cache", dest="build_cache", default=BUILD_CACHE_DIR,
+                    help="Directory of cached builds", metavar="DIR")
+  parser.add_option("--no-build-cache", action="store_const", const=None, dest="build_cache",
+                    help="Always rebuild the benchmarks")
+  parser.add_option("--workspaces", dest="workspaces", default=WORKSPACE_DIR,
+                    help="Directory of the build and run workspaces, e.g. on tmpfs", metavar="DIR")
+  parser.add_option("-C", "--compare", action="store_true", dest="compare", default=False,
+                    help="Build with -asan-opt=0 and -asan-opt=1 and run them in interleaved pairs")
+  parser.add_option("--seed", dest="seed", type="int", default=None,
+                    help="Seed for the order of the runs in a pair", metavar="SEED")
+  parser.add_option("-a", "--adaptive", action="store_true", dest="adaptive", default=False,
+                    help="Run each benchmark until its confidence interval is narrow enough")
+  parser.add_option("--warmup", dest="warmup", type="int", default=1,
+                    help="Number of discarded warm-up runs in adaptive mode", metavar="RUNS")
+  parser.add_option("--ci-width", dest="ci_width", type="float", default=2.0,
+                    help="Target half-width of the 95% confidence interval in percent of the mean",
+                    metavar="PERCENT")
+  parser.add_option("--min-runs", dest="min_runs", type="int", default=3,
+                    help="Minimum number of runs in adaptive mode", metavar="RUNS")
+  parser.add_option("--max-runs", dest="max_runs", type="int", default=30,
+                    help="Maximum number of runs in adaptive mode", metavar="RUNS")
+  parser.add_option("--time-budget", dest="time_budget", type="float", default=600.0,
+                    help="Wall-clock seconds of runs allowed per benchmark in adaptive mode",
+                    metavar="SECONDS")
+  parser.add_option("--memory", dest="memory", type="float", default=None,
+                    help="Sample the memory of every run's process tree every SECONDS",
+                    metavar="SECONDS")
+  parser.add_option("--db", dest="db", default=RESULT_DB,
+                    help="Add the timings to the SQLite database PATH (see query-results.py)",
+                    metavar="PATH")
+  parser.add_option("--no-db", action="store_const", const=None, dest="db",
+                    help="Do not record the timings")
+  parser.add_option("--label", dest="label", default=None,
+                    help="Label of the timings in the database, e.g. the LLVM revision")
+  parser.add_option("--workers", dest="workers", action="append", default=[],
+                    help="Build and run on the spec-worker.py daemons at HOST:PORT,... " +
+                         "(repeatable); every benchmark is timed on one of them",
+                    metavar="ADDRESSES")
+  parser.add_option("--retries", dest="retries", type="int", default=RETRIES,
+                    help="Times a task lost with its worker is sent to another one",
+                    metavar="TIMES")
   (options, args) = parser.parse_args()
   if len(args) < 2:
     parser.print_help()
     exit()
+  try:
+    addresses = [parse_address(address) for addresses in options.workers
+                 for address in addresses.split(',') if address]
+  except ValueError as e:
+    parser.error(str(e))
+
+  run_cpus = build_cpus = None
+  if options.run_cpus:
+    if addresses:
+      parser.error('--run-cpus pins local runs, not those of --workers')
+    try:
+      cpus, build_cpus = reserve_cpus(options.run_cpus, options.run_cores)
+    except ValueError as e:
+      parser.error('--run-cpus: %s' % e)
+    run_cpus = RunCPUs(cpus, options.run_cores, CPU_LOCK_DIR)
 
   spec_path = args[0]
   clang_bin_dir = args[1]
@@ -128,41 +354,140 @@ if __name__ == '__main__':
   if not os.path.exists(TEMP_DIR):
     os.makedirs(TEMP_DIR)
 
-  handles = []
-  Q = multiprocessing.Queue()
-  for i in xrange(len(names)):
-    p = WorkerProcess(names[i], Q, spec_path, clang_bin_dir, options.runs, 1 if options.opt else 0)
-    handles.append(p)
-
-  pos = 0
-  while pos < len(names):
-    working = pos - Q.qsize()
-    if working < PROCESSORS:
-      handles[pos].start()
-      pos += 1
+  pool = None
+  if addresses:
+    pool = WorkerPool(addresses, options.retries)
+    if not pool.connect():
+      parser.error('no worker reachable')
+    identity = identity_in(options.build_cache)
+  graph = TaskGraph(Jobserver(options.jobs) if options.jobserver else None, Progress(), pool)
+  # the longest benchmarks start first, by the durations of earlier runs
+  durations = DurationIndex(DURATION_INDEX)
+  asan_opts = [0, 1] if options.compare else [1 if options.opt else 0]
+  order = random.Random(options.seed)
+  controllers = {}
+  compile_keys = {}
+  for name in names:
+    compile_keys[name] = []
+    builds = {}
+    for asan_opt in asan_opts:
+      key = '%s:compile-opt%d' % (name, asan_opt)
+      cost = durations.cost(name, 'asan-opt%d' % asan_opt, 'compile')
+      if pool:
+        builds[asan_opt] = remote_build(name, spec_path, clang_bin_dir, asan_opt, identity)
+        graph.add_remote(key, {'kind': 'build', 'build': builds[asan_opt]}, cost=cost,
+                         affinity=name)
+      else:
+        graph.add(key, compile_benchmark, (name, spec_path, clang_bin_dir, asan_opt,
+                                           options.build_cache, options.workspaces, build_cpus),
+                  cost=cost)
+      compile_keys[name].append(key)
+    cost = sum(durations.cost(name, 'asan-opt%d' % asan_opt, 'run') for asan_opt in asan_opts)
+    if options.compare:
+      # randomize which variant goes first in every pair to cancel order effects
+      remote = None
+      if pool:
+        # runs on workers are never pinned, run_cpus is None
+        remote = lambda a_first, memory, run_cpus, builds=builds: \
+                   {'kind': 'pair', 'a': builds[0], 'b': builds[1], 'a_first': a_first,
+                    'memory': memory}
+      controllers[name] = AdaptiveRuns(graph, name, options, options.adaptive, run_pair,
+                                       pair_ratio, pair_wall,
+                                       lambda: (order.random() < 0.5, options.memory, run_cpus),
+                                       cost, remote)
     else:
-      time.sleep(0.01)
+      remote = None
+      if pool:
+        remote = lambda memory, run_cpus, build=builds[asan_opts[0]]: \
+                   {'kind': 'time', 'build': build, 'memory': memory}
+      controllers[name] = AdaptiveRuns(graph, name, options, options.adaptive,
+                                       args=lambda: (options.memory, run_cpus), cost=cost,
+                                       remote=remote)
+    if not options.adaptive:
+      controllers[name].start(compile_keys[name])
 
-  all_times = {}
-  for i in xrange(len(handles)):
-    name, times = Q.get()
-    if name not in times:
-      all_times[name] = []
-    all_times[name].extend(times)
+  def on_done(key, ok, result):
+    name, task = key.split(':', 1)
+    if task.startswith('compile'):
+      deps = compile_keys[name]
+      if options.adaptive and ok and all(dep in graph.results for dep in deps):
+        controllers[name].start(deps)
+    else:
+      controllers[name].done(ok, result)
+
+  graph.run(options.jobs, on_done)
+  if pool:
+    pool.close()
+
+  all_runs = {}
+  for name in names:
+    all_runs[name] = controllers[name].records
+    if pool:
+      # durations on the workers' machines would skew the local estimates
+      continue
+    for index, asan_opt in enumerate(asan_opts):
+      key = '%s:compile-opt%d' % (name, asan_opt)
+      if key in graph.results:
+        durations.record(name, 'asan-opt%d' % asan_opt, 'compile', graph.durations[key])
+      if options.compare:
+        walls = [pair['ab'[index]]['wall'] for pair in all_runs[name]]
+      else:
+        walls = [record['wall'] for record in all_runs[name]]
+      if walls:
+        durations.record(name, 'asan-opt%d' % asan_opt, 'run', mean(walls))
+  durations.save()
+  if options.compare:
+    runs_path = TEMP_DIR + '/asan-compare-runs.json'
+  else:
+    runs_path = TEMP_DIR + '/asan-opt%d-runs.json' % asan_opts[0]
+  file = open(runs_path, 'w')
+  json.dump(all_runs, file, indent=1, sort_keys=True)
+  file.close()
+
+  if options.db:
+    db = ResultDB(options.db)
+    identity = identity_in(options.build_cache)
+    for name in names:
+      if controllers[name].failed or not all_runs[name]:
+        continue
+      for index, asan_opt in enumerate(asan_opts):
+        if options.compare:
+          samples = [pair['ab'[index]] for pair in all_runs[name]]
+        else:
+          samples = all_runs[name]
+        inputs = build_inputs(spec_path + '/' + name + '/src',
+                              make_command(clang_bin_dir, *asan_flags(asan_opt)),
+                              clang_bin_dir, identity)
+        db.add_run('benchmark-asan-spec', name, 'asan-opt%d' % asan_opt, build_identity(inputs),
+                   options.label, samples)
+    db.close()
 
-  for name, time_list in all_times.iteritems():
+  for name in names:
+    if options.compare:
+      write_compare_report(name, controllers[name])
+      continue
+    if options.adaptive:
+      write_adaptive_report(name, controllers[name])
+      continue
+    records = all_runs[name] if not controllers[name].failed else []
+    records = records or [None]
     sys.stderr.write(name)
     total = 0
     num = 0
-    for time in time_list:
-      if time is None:
+    max_rss = 0
+    for record in records:
+      if record is None:
         sys.stderr.write('        fail')
       else:
+        time = cpu_time(record)
         sys.stderr.write('        %.3f' % time)
         total += time
         num += 1
+        max_rss = max(max_rss, record['max_rss_kb'])
     if num:
       sys.stderr.write('        AVG %.3f' % (total / num))
+      sys.stderr.write('        MAXRSS %.1fMB' % (max_rss / 1024.0))
+      write_memory_columns([record for record in records if record is not None])
     else:
       sys.stderr.write('        AVG NaN')
     sys.stderr.write('\n')
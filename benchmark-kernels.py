@@ -0,0 +1,259 @@
+import subprocess
+import optparse
+import json
+import sys
+import os
+from cStringIO import StringIO
+
+from harness.buildcache import build_inputs, identity_in
+from harness.cpus import RunCPUs, pin_run, reserve_cpus, set_affinity
+from harness.executor import TaskGraph, available_cpus
+from harness.kernels import CATALOGS, generate_kernels, write_kernel
+from harness.progress import Progress
+from harness.reports import Parser
+from harness.resultdb import ResultDB, build_identity
+from harness.rusage import run_measured, cpu_time
+from harness.stats import median
+
+COUNT_CFLAGS = '-O2 -std=gnu89 -fmemory-access-instrumentation'
+COUNT_CFLAGS += ' ' + os.getcwd() + '/rtccounter/librtccounter.a'
+ASAN_CFLAGS = '-O2 -std=gnu89 -faddress-sanitizer'
+PLAIN_CFLAGS = '-O2 -std=gnu89'
+PROCESSORS = available_cpus()
+TEMP_DIR = os.getcwd() + '/test-spec-temp'
+KERNEL_DIR = TEMP_DIR + '/kernels'
+RESULT_DB = TEMP_DIR + '/results.db'
+CPU_LOCK_DIR = TEMP_DIR + '/cpus'
+CATALOG_DIR = os.path.dirname(os.path.abspath(__file__)) + '/test-partitions'
+
+# every kernel is built once per variant: rtccounter counts the checks of the
+# count builds, and the ASan builds are timed against the plain build
+VARIANTS = [('plain', PLAIN_CFLAGS, False)]
+for asan_opt in [0, 1]:
+  VARIANTS.append(('count-opt%d' % asan_opt,
+                   COUNT_CFLAGS + ' -mllvm "-asan-opt=%d"' % asan_opt, True))
+  VARIANTS.append(('asan-opt%d' % asan_opt,
+                   ASAN_CFLAGS + ' -mllvm "-asan-opt=%d"' % asan_opt, False))
+
+USAGE = 'usage: %prog [options] CLANG_BIN_DIR'
+DESCRIPTION = 'Generates a C kernel for every cell of the test-partitions catalogs ' + \
+              '(see harness/kernels.py), builds the kernels with and without -asan-opt, ' + \
+              'counts their run-time checks with rtccounter and times them. The table ' + \
+              'shows the checks per kernel call and the ASan overhead per check, i.e. ' + \
+              'the CPU time over the plain build divided by the checks.'
+
+def compile_command(clang_bin_dir, cflags, src_path, out_path):
+  """Compile and link like the SPEC makefiles do: CC $(CFLAGS) -c, then link."""
+  cc = clang_bin_dir + '/clang'
+  return 'cd %s && %s %s -c kernel.c -o %s.o && %s %s.o %s -o %s' % \
+         (src_path, cc, cflags, out_path, cc, out_path, cflags, out_path)
+
+def build_kernel(clang_bin_dir, cflags, src_path, out_path, build_cpus):
+  """Build a kernel, on build_cpus if given, and return the build log."""
+  if build_cpus:
+    # the compilers inherit it
+    set_affinity(build_cpus)
+  log = open(out_path + '-build.txt', 'w')
+  try:
+    subprocess.check_call(compile_command(clang_bin_dir, cflags, src_path, out_path),
+                          shell=True, stdout=log, stderr=subprocess.STDOUT)
+  finally:
+    log.close()
+  return open(out_path + '-build.txt').read()
+
+def count_checks(out_path, calls, build_cpus, build_log):
+  """Count the checks of a count build, on build_cpus if given.
+
+  The run is paired with one of 0 calls, whose checks (process startup,
+  main) are subtracted."""
+  if build_cpus:
+    set_affinity(build_cpus)
+  cwd = os.path.dirname(out_path)
+  reports = []
+  for count in [calls, 0]:
+    report = open(out_path + '-report.txt', 'w')
+    run_measured([out_path, str(count)], cwd, stderr=report)
+    report.close()
+    reports.append(open(out_path + '-report.txt').read())
+  return {'build_log': build_log, 'report': reports[0],
+          'checks': Parser(StringIO(reports[0])).runtime.get_total_ls_checks() -
+                    Parser(StringIO(reports[1])).runtime.get_total_ls_checks()}
+
+def time_kernel(out_path, calls, runs, run_cpus, build_log):
+  """Time a build, on a slot of run_cpus if given.
+
+  Every run is paired with one of 0 calls, whose time (process startup,
+  main) is subtracted."""
+  res = {'build_log': build_log, 'records': [], 'base_records': []}
+  cwd = os.path.dirname(out_path)
+  slot = pin_run(run_cpus)
+  try:
+    for _ in xrange(runs):
+      res['records'].append(run_measured([out_path, str(calls)], cwd))
+      res['base_records'].append(run_measured([out_path, '0'], cwd))
+  finally:
+    if slot:
+      slot.release()
+  return res
+
+def kernel_time(result):
+  """Median CPU seconds of the kernel calls of a timed variant."""
+  return median([cpu_time(record) for record in result['records']]) - \
+         median([cpu_time(record) for record in result['base_records']])
+
+def write_table(rows, out):
+  lengths = [max(len(row[i]) for row in rows) for i in xrange(len(rows[0]))]
+  for row in rows:
+    out.write(' | '.join(field.ljust(length) for field, length in zip(row, lengths)).rstrip() + '\n')
+
+if __name__ == '__main__':
+  parser = optparse.OptionParser(usage=USAGE, description=DESCRIPTION)
+  parser.add_option("-o", "--out", dest="out", default=KERNEL_DIR,
+                    help="Directory of the kernel sources, builds and results", metavar="DIR")
+  parser.add_option("--catalogs", dest="catalogs", default=CATALOG_DIR,
+                    help="Directory of the test-partitions catalogs", metavar="DIR")
+  parser.add_option("-k", "--cell", dest="cells", action="append", default=None,
+                    help="Only the cells matching PATTERN, e.g. 'exact-check-1.*' (repeatable)",
+                    metavar="PATTERN")
+  parser.add_option("-g", "--generate-only", action="store_true", dest="generate_only",
+                    default=False, help="Write the kernel sources and exit")
+  parser.add_option("-r", "--runs", dest="runs", type="int", default=3,
+                    help="Number of timed runs per kernel and variant", metavar="RUNS")
+  parser.add_option("--accesses", dest="accesses", type="int", default=20000000,
+                    help="Memory accesses per run; the kernel calls are scaled to match",
+                    metavar="N")
+  parser.add_option("-j", "--jobs", dest="jobs", type="int", default=PROCESSORS,
+                    help="Number of parallel builds and counting runs", metavar="JOBS")
+  parser.add_option("--run-cpus", dest="run_cpus", default=None,
+                    help="Time every kernel on its own CPU of LIST (e.g. 2-7) while the " +
+                         "builds and counting runs use the other CPUs; otherwise the " +
+                         "kernels are timed one at a time after all builds", metavar="LIST")
+  parser.add_option("--db", dest="db", default=RESULT_DB,
+                    help="Add the results to the SQLite database PATH (see query-results.py)",
+                    metavar="PATH")
+  parser.add_option("--no-db", action="store_const", const=None, dest="db",
+                    help="Do not record the results")
+  parser.add_option("--label", dest="label", default=None,
+                    help="Label of the results in the database, e.g. the LLVM revision")
+  (options, args) = parser.parse_args()
+  if len(args) < 1 and not options.generate_only:
+    parser.print_help()
+    exit()
+  clang_bin_dir = os.path.abspath(args[0]) if args else None
+  run_cpus = build_cpus = None
+  if options.run_cpus:
+    try:
+      cpus, build_cpus = reserve_cpus(options.run_cpus, 1)
+    except ValueError as e:
+      parser.error('--run-cpus: %s' % e)
+    run_cpus = RunCPUs(cpus, 1, CPU_LOCK_DIR)
+
+  try:
+    kernels = generate_kernels(options.catalogs, CATALOGS, options.cells)
+  except (ValueError, IOError) as e:
+    parser.error(str(e))
+  if not kernels:
+    parser.error('no cells match')
+  src_paths = {}
+  for kernel in kernels:
+    src_paths[kernel.name] = os.path.join(options.out, 'src', kernel.name)
+    write_kernel(kernel, src_paths[kernel.name])
+  sys.stderr.write('%d kernels for %d cells in %s\n' %
+                   (len(kernels), sum(len(kernel.cells) for kernel in kernels), options.out))
+  if options.generate_only:
+    exit()
+
+  # the timed runs never share a CPU with the builds: they run on their own
+  # CPUs with --run-cpus, otherwise serially once everything else is done
+  graph = TaskGraph(None, Progress())
+  timed = []
+  for kernel in kernels:
+    calls = max(1, options.accesses // kernel.accesses_per_call())
+    for variant, cflags, counted in VARIANTS:
+      build_path = os.path.join(options.out, variant)
+      if not os.path.isdir(build_path):
+        os.makedirs(build_path)
+      key = '%s:%s' % (kernel.name, variant)
+      out_path = os.path.join(build_path, kernel.name)
+      build = graph.add(key + ':build', build_kernel,
+                        (clang_bin_dir, cflags, src_paths[kernel.name], out_path, build_cpus))
+      if counted:
+        graph.add(key, count_checks, (out_path, calls, build_cpus), deps=[build])
+      else:
+        timed.append((key, (out_path, calls, options.runs, run_cpus), build))
+  if run_cpus:
+    for key, run_args, build in timed:
+      graph.add(key, time_kernel, run_args, deps=[build])
+    results = graph.run(options.jobs + len(run_cpus.slots))
+  else:
+    graph.run(options.jobs)
+    for key, run_args, build in timed:
+      graph.add(key, time_kernel, run_args, deps=[build])
+    results = graph.run(1)
+
+  # checks and nanoseconds per check of every kernel, with and without -asan-opt
+  summary = {}
+  for kernel in kernels:
+    calls = max(1, options.accesses // kernel.accesses_per_call())
+    entry = {'cells': [cell.name for cell in kernel.cells], 'calls': calls}
+    plain = results.get('%s:plain' % kernel.name)
+    for asan_opt in [0, 1]:
+      counted = results.get('%s:count-opt%d' % (kernel.name, asan_opt))
+      timed = results.get('%s:asan-opt%d' % (kernel.name, asan_opt))
+      if counted is not None:
+        entry['checks-opt%d' % asan_opt] = counted['checks']
+      if timed is not None and plain is not None:
+        overhead = kernel_time(timed) - kernel_time(plain)
+        entry['overhead-opt%d' % asan_opt] = overhead
+        if counted is not None and counted['checks']:
+          entry['ns-per-check-opt%d' % asan_opt] = 1e9 * overhead / counted['checks']
+    summary[kernel.name] = entry
+  file = open(os.path.join(options.out, 'results.json'), 'w')
+  json.dump(summary, file, indent=1, sort_keys=True)
+  file.close()
+
+  def checks_per_call(entry, asan_opt):
+    checks = entry.get('checks-opt%d' % asan_opt)
+    return '%.2f' % (float(checks) / entry['calls']) if checks is not None else 'fail'
+  def ns_per_check(entry, asan_opt):
+    ns = entry.get('ns-per-check-opt%d' % asan_opt)
+    return '%.2f' % ns if ns is not None else 'n/a'
+
+  for catalog in CATALOGS:
+    cells = []
+    for kernel in kernels:
+      entry = summary[kernel.name]
+      removed = 'n/a'
+      if entry.get('checks-opt0') and entry.get('checks-opt1') is not None:
+        removed = '%.0f%%' % (100.0 * (entry['checks-opt0'] - entry['checks-opt1']) /
+                              entry['checks-opt0'])
+      for cell in kernel.cells:
+        if cell.catalog == catalog:
+          cells.append((map(int, cell.number.split('.')),
+                        ['%s %s: %s' % (cell.number, cell.dimension, cell.option),
+                         checks_per_call(entry, 0), checks_per_call(entry, 1), removed,
+                         ns_per_check(entry, 0), ns_per_check(entry, 1)]))
+    rows = [['cell', 'checks/call opt0', 'checks/call opt1', 'removed by opt1',
+             'ns/check opt0', 'ns/check opt1']]
+    rows.extend(row for _, row in sorted(cells))
+    if len(rows) > 1:
+      sys.stdout.write('%s\n' % catalog)
+      write_table(rows, sys.stdout)
+      sys.stdout.write('\n')
+
+  if options.db:
+    db = ResultDB(options.db)
+    identity = identity_in(None)
+    for kernel in kernels:
+      for variant, cflags, counted in VARIANTS:
+        result = results.get('%s:%s' % (kernel.name, variant))
+        if result is None:
+          continue
+        inputs = build_inputs(src_paths[kernel.name], ['CFLAGS=' + cflags], clang_bin_dir,
+                              identity)
+        report_set = None
+        if counted:
+          report_set = Parser(StringIO(result['build_log'] + result['report']))
+        db.add_run('benchmark-kernels', kernel.name, variant, build_identity(inputs),
+                   options.label, result.get('records', []), report_set)
+    db.close()
@@ -0,0 +1,100 @@
+import optparse
+import tempfile
+import random
+import time
+import sys
+import os
+
+from harness.reports import Parser, report_prefix, runtime_report_prefix
+
+USAGE = 'usage: %prog [options]'
+DESCRIPTION = 'Measures the throughput of the MSCC report parser on a synthetic raw log ' + \
+              'that mimics a verbose instrumented build followed by a run.'
+
+NOISE = [
+  '/opt/llvm/bin/clang -c -O2 -std=gnu89 -fmemory-access-instrumentation -DSPEC_CPU -DNDEBUG -I. spec%d.c\n',
+  'spec%d.c:%d:%d: warning: implicit declaration of function \'foo\' is invalid in C99 [-Wimplicit-function-declaration]\n',
+  '  return foo(bar, baz) + qux[i];\n',
+  '         ^\n',
+  'In file included from spec%d.c:%d:\n',
+  '1 warning generated.\n',
+  '  %d functions visited by pass %d\n',
+]
+TITLES = ['initial', 'final'] + ['opt_progress_%d' % i for i in xrange(1, 13)]
+COUNTS = [('generic load checks', 'load_checks'),
+          ('generic store checks', 'store_checks'),
+          ('fast load checks', 'fast_load_checks'),
+          ('fast store checks', 'fast_store_checks'),
+          ('global registration calls', 'global_registrations'),
+          ('stack registration calls', 'stack_registrations')]
+
+def generate(path, size, seed):
+  """Write a synthetic log of about `size` bytes and return the expected totals."""
+  rng = random.Random(seed)
+  expected = {}
+  out = open(path, 'w')
+  written = 0
+  while written < size:
+    chunk = []
+    for _ in xrange(200):
+      line = rng.choice(NOISE)
+      chunk.append(line % tuple(rng.randint(1, 5000) for _ in xrange(line.count('%d'))))
+    title = rng.choice(TITLES)
+    chunk.append('%s (%s): 0 calls\n' % (report_prefix, title))
+    for text, field in COUNTS:
+      amount = rng.randint(0, 100000)
+      expected[(title, field)] = expected.get((title, field), 0) + amount
+      chunk.append('  %d %s\n' % (amount, text))
+    data = ''.join(chunk)
+    out.write(data)
+    written += len(data)
+  out.write('%s: 0 calls\n' % runtime_report_prefix)
+  out.write('  123456789 fast load checks\n')
+  expected[('runtime', 'fast_load_checks')] = 123456789
+  out.close()
+  return expected
+
+def summary_for(parser, title):
+  if title == 'initial':
+    return parser.initial
+  if title == 'final':
+    return parser.final
+  if title == 'runtime':
+    return parser.runtime
+  return parser.opt_progress[int(title[len('opt_progress_'):])]
+
+def check(parser, expected):
+  for (title, field), amount in expected.items():
+    got = getattr(summary_for(parser, title), field)
+    if got != amount:
+      raise AssertionError('%s %s: expected %d, parsed %d' % (title, field, amount, got))
+
+if __name__ == '__main__':
+  parser = optparse.OptionParser(usage=USAGE, description=DESCRIPTION)
+  parser.add_option("-s", "--size", dest="size", type="int", default=64,
+                    help="Size of the synthetic log in MB", metavar="MB")
+  parser.add_option("-r", "--repeat", dest="repeat", type="int", default=3,
+                    help="Number of measurements per mode, the best one is reported", metavar="N")
+  parser.add_option("--seed", dest="seed", type="int", default=0,
+                    help="Seed of the synthetic log", metavar="SEED")
+  (options, args) = parser.parse_args()
+
+  handle, path = tempfile.mkstemp(suffix='-raw.txt')
+  os.close(handle)
+  try:
+    expected = generate(path, options.size * 1024 * 1024, options.seed)
+    size = os.path.getsize(path)
+    sys.stdout.write('synthetic log: %.1f MB\n' % (size / 1024.0 / 1024.0))
+    for mode, use_mmap in [('stream', False), ('mmap', True)]:
+      best = None
+      for _ in xrange(options.repeat):
+        stream = open(path)
+        start = time.time()
+        result = Parser(stream, use_mmap=use_mmap)
+        elapsed = time.time() - start
+        stream.close()
+        check(result, expected)
+        best = elapsed if best is None else min(best, elapsed)
+      sys.stdout.write('%-8s %8.3f s %10.1f MB/s\n' % (mode, best, size / 1024.0 / 1024.0 / best))
+  finally:
+    os.remove(path)
@@ -0,0 +1,172 @@
+import subprocess
+import optparse
+import tempfile
+import shutil
+import signal
+import socket
+import time
+import sys
+import os
+
+from harness.buildcache import BuildCache, build_inputs
+from harness.executor import TaskGraph
+from harness.remote import WorkerPool
+from harness.spec import make_command
+
+USAGE = 'usage: %prog [options]'
+DESCRIPTION = 'Self-check of the --workers machinery (harness/remote.py): starts two ' + \
+              'spec-worker.py daemons on 127.0.0.1 with a made-up SPEC tree, runs a ' + \
+              'TaskGraph of counted builds and runs through a WorkerPool, kills one ' + \
+              'worker while it runs tasks and checks that they are retried on the other ' + \
+              'and that every task succeeds.  Exits with 1 on failure.'
+
+MAKEFILE = 'all:\n\t@echo built $(CFLAGS)\n'
+RUN_SH = '#!/bin/sh\nsleep %s\necho ran >&2\n'
+
+class Log(object):
+  """The pool's messages, with the time each arrived."""
+  def __init__(self):
+    self.lines = []
+
+  def write(self, text):
+    self.lines.append((time.time(), text))
+    sys.stderr.write(text)
+
+  def find(self, text):
+    return [(when, line) for when, line in self.lines if text in line]
+
+def make_spec_tree(path, names, seconds):
+  for name in names:
+    for folder in ['src', 'data']:
+      os.makedirs(os.path.join(path, name, folder))
+    file = open(os.path.join(path, name, 'src', 'Makefile'), 'w')
+    file.write(MAKEFILE)
+    file.close()
+    run_path = os.path.join(path, name, 'run.sh')
+    file = open(run_path, 'w')
+    file.write(RUN_SH % seconds)
+    file.close()
+    os.chmod(run_path, 0o755)
+
+def free_port():
+  sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  sock.bind(('127.0.0.1', 0))
+  port = sock.getsockname()[1]
+  sock.close()
+  return port
+
+def start_worker(temp_dir, spec_path, name, port, slots):
+  log = open(os.path.join(temp_dir, name + '.log'), 'w')
+  process = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(__file__) or '.',
+                                                           'spec-worker.py'),
+                              '-l', '127.0.0.1:%d' % port, '-j', str(slots), '--name', name,
+                              '--workspaces', os.path.join(temp_dir, name, 'workspaces'),
+                              '--build-cache', os.path.join(temp_dir, name, 'build-cache'),
+                              spec_path], stderr=log)
+  deadline = time.time() + 10
+  while True:
+    try:
+      socket.create_connection(('127.0.0.1', port), 1.0).close()
+      return process
+    except socket.error:
+      if time.time() > deadline or process.poll() is not None:
+        raise RuntimeError('worker %s did not start, see %s.log' % (name, name))
+      time.sleep(0.1)
+
+def check(temp_dir, tasks, seconds, slots):
+  spec_path = os.path.join(temp_dir, 'spec')
+  clang_bin_dir = os.path.join(temp_dir, 'bin')
+  os.makedirs(clang_bin_dir)
+  names = ['bench%d' % i for i in range(tasks)]
+  make_spec_tree(spec_path, names, seconds)
+  make_args = make_command(clang_bin_dir, '-O2', '-O2')
+  cache = BuildCache(os.path.join(temp_dir, 'build-cache'))
+
+  ports = [free_port(), free_port()]
+  workers = [start_worker(temp_dir, spec_path, 'w%d' % i, port, slots)
+             for i, port in enumerate(ports)]
+  log = Log()
+  pool = WorkerPool([('127.0.0.1', port) for port in ports], retries=2, timeout=60.0, out=log)
+  try:
+    if pool.connect() != 2:
+      return ['the workers did not greet the pool']
+    graph = TaskGraph(pool=pool)
+    graph.verbose = False
+    for name in names:
+      inputs = build_inputs(os.path.join(spec_path, name, 'src'), make_args, clang_bin_dir,
+                            cache.file_identity)
+      job = {'kind': 'count', 'execute': True, 'env': {},
+             'build': {'benchmark': name, 'label': 'check', 'make_args': make_args,
+                       'clang_bin_dir': clang_bin_dir,
+                       'inputs': dict((key, inputs[key])
+                                      for key in ['sources', 'compiler', 'files'])}}
+      graph.add_remote(name, job)
+
+    # the graph polls the pool at least every second: kill the first worker
+    # halfway through the first runs it got
+    victim = pool.workers[0]
+    kill = {'at': None, 'done': None}
+    dispatch = pool.dispatch
+    def dispatch_and_kill():
+      dispatch()
+      now = time.time()
+      if kill['at'] is None and victim.entries:
+        kill['at'] = now + seconds / 2.0
+      elif kill['done'] is None and kill['at'] is not None and now >= kill['at']:
+        os.kill(workers[0].pid, signal.SIGKILL)
+        kill['done'] = now
+    pool.dispatch = dispatch_and_kill
+    start = time.time()
+    results = graph.run(2 * slots)
+    elapsed = time.time() - start
+  finally:
+    pool.close()
+    for worker in workers:
+      if worker.poll() is None:
+        worker.terminate()
+      worker.wait()
+
+  errors = []
+  if kill['done'] is None:
+    return ['the first worker was not killed while running tasks']
+  if graph.failed:
+    errors.append('failed tasks: %s' % ', '.join(sorted(graph.failed)))
+  for name in names:
+    result = results.get(name)
+    if result is not None and ('built' not in result['build_log'] or 'ran' not in result['log']):
+      errors.append('%s: unexpected result %r' % (name, result))
+  lost = log.find('lost worker')
+  if not lost or 'retrying' not in lost[0][1]:
+    errors.append('the tasks of the killed worker were not retried')
+  elif lost[0][0] - kill['done'] > seconds / 4.0:
+    # its jobs still run, so only closed sockets tell the pool it is gone
+    errors.append('the killed worker was noticed after %.1f seconds' %
+                  (lost[0][0] - kill['done']))
+  sys.stderr.write('%d tasks in %.1f seconds\n' % (len(results), elapsed))
+  return errors
+
+if __name__ == '__main__':
+  parser = optparse.OptionParser(usage=USAGE, description=DESCRIPTION)
+  parser.add_option("-n", "--tasks", dest="tasks", type="int", default=8,
+                    help="Number of benchmarks to build and run", metavar="N")
+  parser.add_option("-s", "--seconds", dest="seconds", type="float", default=4.0,
+                    help="Duration of every run", metavar="SECONDS")
+  parser.add_option("-j", "--slots", dest="slots", type="int", default=2,
+                    help="Slots of every worker", metavar="N")
+  parser.add_option("--keep", action="store_true", dest="keep", default=False,
+                    help="Keep the temporary directory with the workers' logs")
+  (options, args) = parser.parse_args()
+
+  temp_dir = tempfile.mkdtemp(prefix='check-workers-')
+  try:
+    errors = check(temp_dir, options.tasks, options.seconds, options.slots)
+  finally:
+    if options.keep:
+      sys.stderr.write('kept %s\n' % temp_dir)
+    else:
+      shutil.rmtree(temp_dir, ignore_errors=True)
+  for error in errors:
+    sys.stderr.write('FAIL: %s\n' % error)
+  if errors:
+    sys.exit(1)
+  sys.stderr.write('OK\n')
@@ -0,0 +1 @@
+"""Shared building blocks for the SPEC harness scripts in this repository."""
@@ -0,0 +1,187 @@
+"""Content-addressed cache of instrumented benchmark builds.
+
+A build is identified by a hash of the benchmark sources, the complete make
+command line (compiler paths and flags) and the identity of the compilers
+and of any files named in the flags, such as librtccounter.a.  An entry holds
+every file the build created or changed in the source directory plus the
+build log, which carries the compile-time counter reports.
+"""
+import hashlib
+import json
+import shutil
+import stat
+import os
+
+from harness.spec import is_build_product
+
+LOG_NAME = 'build.log'
+FILES_DIR = 'files'
+IDENTITIES_DIR = 'identities'
+
+_identities = {}
+
+def _hash_file(path, h):
+  f = open(path, 'rb')
+  try:
+    while True:
+      block = f.read(1 << 20)
+      if not block:
+        break
+      h.update(block)
+  finally:
+    f.close()
+
+def hash_sources(src_dir):
+  """Hash all source files below src_dir, following symlinks.
+
+  Objects, archives and executables left behind by earlier builds are not
+  sources and are skipped.
+  """
+  h = hashlib.sha1()
+  for root, dirs, files in os.walk(src_dir):
+    dirs.sort()
+    for file in sorted(files):
+      path = os.path.join(root, file)
+      if not os.path.isfile(path) or is_build_product(path):
+        continue
+      h.update(os.path.relpath(path, src_dir) + '\0')
+      _hash_file(path, h)
+  return h.hexdigest()
+
+def snapshot(src_dir):
+  """Return {relative path: (mtime, size)} for the regular files in src_dir."""
+  res = {}
+  for root, dirs, files in os.walk(src_dir):
+    for file in files:
+      path = os.path.join(root, file)
+      st = os.lstat(path)
+      if stat.S_ISREG(st.st_mode):
+        res[os.path.relpath(path, src_dir)] = (st.st_mtime, st.st_size)
+  return res
+
+def write_atomic(path, data):
+  if not os.path.exists(os.path.dirname(path)):
+    try:
+      os.makedirs(os.path.dirname(path))
+    except OSError:
+      pass
+  temp_path = '%s.%d.tmp' % (path, os.getpid())
+  f = open(temp_path, 'w')
+  f.write(data)
+  f.close()
+  os.rename(temp_path, path)
+
+def file_identity(path, memo_dir=None):
+  """Return a content hash of path, memoized in memo_dir on its inode metadata
+  (without memo_dir, only in this process)."""
+  path = os.path.realpath(path)
+  st = os.stat(path)
+  stamp = hashlib.sha1('%s:%d:%d:%r' % (path, st.st_ino, st.st_size, st.st_mtime)).hexdigest()
+  if stamp in _identities:
+    return _identities[stamp]
+  memo = os.path.join(memo_dir, stamp) if memo_dir else None
+  if memo and os.path.exists(memo):
+    identity = open(memo).read().strip()
+  else:
+    h = hashlib.sha1()
+    _hash_file(path, h)
+    identity = h.hexdigest()
+    if memo:
+      write_atomic(memo, identity + '\n')
+  _identities[stamp] = identity
+  return identity
+
+def identity_in(cache_dir):
+  """file_identity memoized in the build cache at cache_dir, if any, without
+  creating the cache itself (e.g. for --no-build-cache)."""
+  memo_dir = os.path.join(cache_dir, IDENTITIES_DIR) if cache_dir else None
+  return lambda path: file_identity(path, memo_dir)
+
+def build_inputs(src_dir, make_args, clang_bin_dir, identity):
+  """Describe everything a build depends on as a JSON-friendly dict.
+
+  `identity` maps a file path to a content hash.
+  """
+  inputs = {'sources': hash_sources(src_dir), 'flags': list(make_args),
+            'compiler': {}, 'files': {}}
+  for tool in ['clang', 'clang++']:
+    path = os.path.join(clang_bin_dir, tool)
+    if os.path.exists(path):
+      inputs['compiler'][tool] = identity(path)
+  # files named in the flags (librtccounter.a) are part of the build too
+  for arg in make_args:
+    for word in arg.split('=', 1)[-1].split():
+      if os.path.isabs(word) and os.path.isfile(word):
+        inputs['files'][word] = identity(word)
+  return inputs
+
+def hash_inputs(inputs):
+  return hashlib.sha1(json.dumps(inputs, sort_keys=True)).hexdigest()
+
+class BuildCache(object):
+  def __init__(self, path):
+    self.path = path
+    if not os.path.exists(path):
+      try:
+        os.makedirs(path)
+      except OSError:
+        if not os.path.isdir(path):
+          raise
+
+  def file_identity(self, path):
+    return file_identity(path, os.path.join(self.path, IDENTITIES_DIR))
+
+  def key(self, src_dir, make_args, clang_bin_dir):
+    return hash_inputs(build_inputs(src_dir, make_args, clang_bin_dir, self.file_identity))
+
+  def entry_path(self, key):
+    return os.path.join(self.path, key[:2], key)
+
+  def restore(self, key, src_dir):
+    """Copy the cached outputs into src_dir and return the build log.
+
+    Returns None on a cache miss.
+    """
+    entry = self.entry_path(key)
+    if not os.path.exists(entry):
+      return None
+    files = os.path.join(entry, FILES_DIR)
+    for root, dirs, names in os.walk(files):
+      for name in names:
+        path = os.path.join(root, name)
+        dst = os.path.join(src_dir, os.path.relpath(path, files))
+        if os.path.lexists(dst):
+          os.remove(dst)
+        elif not os.path.exists(os.path.dirname(dst)):
+          os.makedirs(os.path.dirname(dst))
+        shutil.copy2(path, dst)
+    # remember when the entry was last used
+    os.utime(entry, None)
+    return open(os.path.join(entry, LOG_NAME)).read()
+
+  def store(self, key, src_dir, before, log_path=None):
+    """Store the files that changed in src_dir since the `before` snapshot."""
+    after = snapshot(src_dir)
+    outputs = [path for path, info in after.items() if before.get(path) != info]
+    if not outputs:
+      return False
+
+    entry = self.entry_path(key)
+    if os.path.exists(entry):
+      return True
+    temp_entry = '%s.%d.tmp' % (entry, os.getpid())
+    for path in outputs:
+      dst = os.path.join(temp_entry, FILES_DIR, path)
+      if not os.path.exists(os.path.dirname(dst)):
+        os.makedirs(os.path.dirname(dst))
+      shutil.copy2(os.path.join(src_dir, path), dst)
+    log = open(log_path).read() if log_path else ''
+    f = open(os.path.join(temp_entry, LOG_NAME), 'w')
+    f.write(log)
+    f.close()
+    try:
+      os.rename(temp_entry, entry)
+    except OSError:
+      # another worker stored the same build first
+      shutil.rmtree(temp_entry, ignore_errors=True)
+    return True
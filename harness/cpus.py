@@ -0,0 +1,124 @@
+"""CPU sets for the timed runs.
+
+Reserving cores for a timed run in the jobserver budget only keeps other
+tasks from being started; the kernel may still schedule the run next to a
+compile.  With a reserved CPU set, the timed runs are pinned to slots of
+that set and the builds to the other CPUs, so neither ever shares a core
+with the other.  A slot is leased with a lock file, so concurrent runs (also
+of other invocations sharing the lock directory) never share one either.
+"""
+import multiprocessing
+import ctypes.util
+import ctypes
+import os
+
+from harness.workspace import Lock
+
+CPU_SETSIZE = 1024
+_ULONG_BITS = 8 * ctypes.sizeof(ctypes.c_ulong)
+
+def parse_cpu_list(text):
+  """Return the CPUs of a list like "0-3,8,10-11" in list order, so that
+  e.g. "2,10,3,11" keeps SMT siblings together; raises ValueError."""
+  cpus = []
+  for part in text.strip().split(','):
+    if not part:
+      continue
+    bounds = part.split('-')
+    if len(bounds) > 2 or int(bounds[0]) > int(bounds[-1]):
+      raise ValueError('bad CPU list %s' % text)
+    for cpu in range(int(bounds[0]), int(bounds[-1]) + 1):
+      if cpu not in cpus:
+        cpus.append(cpu)
+  return cpus
+
+def allowed_cpus():
+  """Return the CPUs this process is allowed to run on."""
+  if hasattr(os, 'sched_getaffinity'):
+    return sorted(os.sched_getaffinity(0))
+  try:
+    for line in open('/proc/self/status'):
+      if line.startswith('Cpus_allowed_list:'):
+        return parse_cpu_list(line.split(':', 1)[1])
+  except (IOError, ValueError):
+    pass
+  return range(multiprocessing.cpu_count())
+
+_libc = None
+
+def set_affinity(cpus, pid=0):
+  """Restrict pid (0: this process) and the children it starts to cpus."""
+  global _libc
+  if hasattr(os, 'sched_setaffinity'):
+    os.sched_setaffinity(pid, cpus)
+    return
+  if _libc is None:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+  mask = (ctypes.c_ulong * (CPU_SETSIZE // _ULONG_BITS))()
+  for cpu in cpus:
+    mask[cpu // _ULONG_BITS] |= 1 << (cpu % _ULONG_BITS)
+  if _libc.sched_setaffinity(pid, ctypes.sizeof(mask), ctypes.byref(mask)):
+    errno = ctypes.get_errno()
+    raise OSError(errno, os.strerror(errno))
+
+def reserve_cpus(text, cores):
+  """Split the allowed CPUs into the reserved CPUs of the list text, in list
+  order, and the others for the builds; raises ValueError."""
+  cpus = parse_cpu_list(text)
+  allowed = allowed_cpus()
+  if [cpu for cpu in cpus if cpu not in allowed]:
+    raise ValueError('%s is not a subset of the allowed CPUs' % text)
+  if len(cpus) < cores:
+    raise ValueError('%s has fewer CPUs than cores per run' % text)
+  build_cpus = [cpu for cpu in allowed if cpu not in cpus]
+  if not build_cpus:
+    raise ValueError('%s leaves no CPUs for the builds' % text)
+  return cpus, build_cpus
+
+class CPUSlot(object):
+  """A leased slot of a RunCPUs; release() hands it back."""
+  def __init__(self, cpus, lock):
+    self.cpus = cpus
+    self.lock = lock
+
+  def release(self):
+    self.lock.release()
+
+class RunCPUs(object):
+  """The reserved CPUs, split into slots of `cores` CPUs."""
+  def __init__(self, cpus, cores, lock_dir):
+    self.slots = [cpus[i:i + cores] for i in range(0, len(cpus) - cores + 1, cores)]
+    self.lock_dir = lock_dir
+    assert self.slots, 'fewer reserved CPUs than cores per run'
+
+  def _lock_path(self, cpus):
+    return os.path.join(self.lock_dir, 'cpus-%s.lock' % '-'.join(str(cpu) for cpu in cpus))
+
+  def acquire(self):
+    """Lease a free slot, waiting for one if all are busy."""
+    if not os.path.isdir(self.lock_dir):
+      try:
+        os.makedirs(self.lock_dir)
+      except OSError:
+        if not os.path.isdir(self.lock_dir):
+          raise
+    for cpus in self.slots:
+      try:
+        return CPUSlot(cpus, Lock(self._lock_path(cpus), blocking=False))
+      except IOError:
+        continue
+    cpus = self.slots[os.getpid() % len(self.slots)]
+    return CPUSlot(cpus, Lock(self._lock_path(cpus)))
+
+def pin_run(run_cpus):
+  """Lease a slot of the reserved CPUs (a RunCPUs) and move this process, and
+  so the runs it starts, onto it; None without reserved CPUs."""
+  if run_cpus is None:
+    return None
+  slot = run_cpus.acquire()
+  try:
+    set_affinity(slot.cpus)
+  except:
+    slot.release()
+    raise
+  return slot
@@ -0,0 +1,70 @@
+"""Index of past task durations, for scheduling and progress estimates.
+
+For every benchmark, configuration and kind of task (compile, run, parse)
+the index keeps a moving average of the wall-clock seconds it took.  The
+harness scripts give these estimates to the task graph as task costs, so
+the longest benchmarks start first and the progress line can show an ETA.
+"""
+import fcntl
+import json
+import os
+
+from harness.buildcache import write_atomic
+from harness.stats import median
+
+# weight of a new measurement in the moving average
+WEIGHT = 0.5
+
+class DurationIndex(object):
+  def __init__(self, path):
+    self.path = path
+    self.index = self._load()
+    self.measured = []
+
+  def _load(self):
+    try:
+      return json.load(open(self.path))
+    except (IOError, ValueError):
+      # an unreadable index only costs us the estimates
+      return {}
+
+  def estimate(self, name, configuration, kind):
+    """Return the expected seconds of a task, or None if nothing is known.
+
+    Benchmarks without a record of their own get the median of the others,
+    preferably of the same configuration."""
+    known = self.index.get(name, {}).get(configuration, {}).get(kind)
+    if known is not None:
+      return known
+    for same_configuration in [True, False]:
+      values = [kinds[kind] for configurations in self.index.values()
+                for config, kinds in configurations.items()
+                if kind in kinds and (config == configuration or not same_configuration)]
+      if values:
+        return median(values)
+    return None
+
+  def cost(self, name, configuration, kind):
+    """estimate() for TaskGraph.add, where 0 means unknown."""
+    return self.estimate(name, configuration, kind) or 0.0
+
+  def record(self, name, configuration, kind, seconds):
+    self.measured.append((name, configuration, kind, seconds))
+
+  def save(self):
+    """Merge the recorded durations into the index file."""
+    if not self.measured:
+      return
+    lock = open(self.path + '.lock', 'w')
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    try:
+      # another invocation may have saved since we loaded
+      self.index = self._load()
+      for name, configuration, kind, seconds in self.measured:
+        kinds = self.index.setdefault(name, {}).setdefault(configuration, {})
+        old = kinds.get(kind)
+        kinds[kind] = seconds if old is None else (1 - WEIGHT) * old + WEIGHT * seconds
+      write_atomic(self.path, json.dumps(self.index, indent=1, sort_keys=True))
+      self.measured = []
+    finally:
+      lock.close()
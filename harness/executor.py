@@ -0,0 +1,259 @@
+"""Task-graph executor used by the SPEC harness scripts.
+
+Every benchmark is split into small tasks (compile, run, parse) with
+dependencies between them.  Ready tasks are started on a bounded set of
+worker processes and each worker reports back through its own pipe, so the
+main process simply blocks in select() until a task completes or its worker
+dies.  With a Jobserver, every task also holds jobserver tokens while it
+runs, and the makes it starts share the rest of the budget.
+
+Tasks may carry a cost, their expected seconds (see harness/durations.py).
+Ready tasks start longest-first: by their cost plus that of the longest
+chain of tasks depending on them, so long benchmarks do not start last and
+stretch the whole run.
+
+With a WorkerPool (harness/remote.py), tasks added with add_remote() run on
+worker daemons on other machines instead; the pool's sockets are polled in
+the same select().
+"""
+import multiprocessing
+import traceback
+import select
+import heapq
+import time
+import sys
+import os
+
+from harness.cpus import allowed_cpus
+
+def available_cpus():
+  """Return the number of CPUs this process is allowed to run on."""
+  return len(allowed_cpus())
+
+class Task(object):
+  def __init__(self, key, func, args, deps, index, cores, cost):
+    self.key = key
+    self.func = func
+    self.args = args
+    self.deps = deps
+    self.index = index
+    self.cores = cores
+    self.cost = cost
+    self.tokens = 0
+    self.started = None
+    self.job = None
+    self.affinity = None
+    self.waiting = set(deps)
+    self.dependents = []
+
+def _task_main(conn, func, args, env):
+  os.environ.update(env)
+  try:
+    result = (True, func(*args))
+  except:
+    result = (False, traceback.format_exc())
+  conn.send(result)
+  conn.close()
+
+class TaskGraph(object):
+  """A set of tasks with dependencies between them.
+
+  A task is called with its own arguments followed by the results of its
+  dependencies, in the order the dependencies were given.  Results must be
+  picklable.  When a task fails, all tasks depending on it are skipped.
+
+  Tasks may also be added from the on_done callback of run(), which lets the
+  caller decide how much work to schedule based on earlier results.
+
+  With a jobserver, a task only starts once it holds `cores` tokens, which
+  it keeps until it ends; a timing run can ask for more than one to keep
+  other work off the cores it runs on.  Tasks start in order, so a task
+  waiting for its tokens is not overtaken by smaller ones.
+
+  With a Progress, a progress line replaces the start and end lines on
+  stderr.  The wall-clock seconds of every finished task are kept in
+  durations.
+
+  With a WorkerPool, remote tasks are sent to the workers in the same
+  longest-first order; they neither take jobserver tokens nor count against
+  `processes`.
+  """
+  def __init__(self, jobserver=None, progress=None, pool=None):
+    self.tasks = {}
+    self.results = {}
+    self.failed = set()
+    self.durations = {}
+    self.verbose = True
+    self.ready = None
+    self.jobserver = jobserver
+    self.progress = progress
+    self.pool = pool
+    if pool is not None:
+      pool.progress = progress
+
+  def add(self, key, func, args=(), deps=(), cores=1, cost=0.0):
+    return self._add(Task(key, func, tuple(args), list(deps), len(self.tasks), cores, cost))
+
+  def add_remote(self, key, job, deps=(), cores=1, cost=0.0, affinity=None):
+    """Add a task that runs `job` (a JSON-friendly dict, see harness/remote.py)
+    on a worker.  Its result is the worker's record; unlike local tasks, it
+    is not given the results of its dependencies.  Tasks of equal affinity
+    run on the same worker."""
+    assert self.pool is not None, 'remote task %s without a worker pool' % key
+    task = Task(key, None, (), list(deps), len(self.tasks), cores, cost)
+    task.job = job
+    task.affinity = affinity
+    return self._add(task)
+
+  def _add(self, task):
+    key = task.key
+    assert key not in self.tasks, 'duplicate task %s' % key
+    for dep in task.deps:
+      assert dep in self.tasks, 'unknown dependency %s of %s' % (dep, key)
+    self.tasks[key] = task
+    for dep in task.deps:
+      self.tasks[dep].dependents.append(task)
+      if dep in self.results:
+        task.waiting.discard(dep)
+      elif dep in self.failed:
+        self.failed.add(key)
+    if self.ready is not None and not task.waiting and key not in self.failed:
+      self._make_ready(task)
+    return key
+
+  def _make_ready(self, task):
+    if task.job is not None:
+      self.pool.submit(task, self._priority(task))
+    else:
+      heapq.heappush(self.ready, (self._priority(task), task))
+
+  def rank(self, task):
+    """The cost of task plus that of its longest chain of dependents."""
+    return task.cost + max([self.rank(dependent) for dependent in task.dependents] or [0.0])
+
+  def _priority(self, task):
+    return (-self.rank(task), task.index)
+
+  def _log(self, what, task):
+    if not self.verbose:
+      return
+    if self.progress is None:
+      sys.stderr.write('%s %s\n' % (what, task.key))
+    elif what not in ['start', 'end']:
+      self.progress.message('%s %s\n' % (what, task.key))
+
+  def _start(self, task):
+    args = task.args + tuple(self.results[dep] for dep in task.deps)
+    reader, writer = multiprocessing.Pipe(False)
+    env = {'MAKEFLAGS': self.jobserver.makeflags()} if self.jobserver else {}
+    process = multiprocessing.Process(target=_task_main,
+                                      args=(writer, task.func, args, env))
+    process.start()
+    # only the child may hold the write end, so that we see EOF if it dies
+    writer.close()
+    task.started = time.time()
+    self._log('start', task)
+    return reader, process
+
+  def _skip(self, task):
+    for dependent in task.dependents:
+      if dependent.key not in self.failed:
+        self.failed.add(dependent.key)
+        self._log('skip', dependent)
+        self._skip(dependent)
+
+  def _finish(self, task, ok, result):
+    if not ok:
+      self.failed.add(task.key)
+      self._log('fail', task)
+      if self.progress is not None:
+        self.progress.message(result)
+      else:
+        sys.stderr.write(result)
+      self._skip(task)
+      return
+
+    self.results[task.key] = result
+    self._log('end', task)
+    for dependent in task.dependents:
+      dependent.waiting.discard(task.key)
+      if not dependent.waiting and dependent.key not in self.failed:
+        self._make_ready(dependent)
+
+  def run(self, processes=None, on_done=None):
+    """Run all tasks on at most `processes` workers and return the results.
+
+    on_done(key, ok, result) is called in this process after every task.
+    """
+    if not processes:
+      processes = self.jobserver.tokens if self.jobserver else available_cpus()
+    self.ready = ready = []
+    for task in sorted(self.tasks.values(), key=lambda task: task.index):
+      if not task.waiting and task.key not in self.failed and task.key not in self.results:
+        self._make_ready(task)
+    running = {}
+    jobserver = self.jobserver
+    pool = self.pool
+    # the progress line counts the workers' slots too
+    capacity = processes + (pool.capacity() if pool else 0)
+    held = 0
+    while ready or running or (pool and pool.busy()):
+      while ready and len(running) < processes:
+        task = ready[0][1]
+        if jobserver:
+          # a task cannot ask for more than the whole budget
+          need = min(task.cores, jobserver.tokens)
+          if held < need:
+            held += jobserver.acquire(need - held)
+          if held < need:
+            break
+          task.tokens, held = held, 0
+        heapq.heappop(ready)
+        reader, process = self._start(task)
+        running[reader.fileno()] = (task, reader, process)
+
+      waiting = list(running)
+      if jobserver and ready and len(running) < processes:
+        waiting.append(jobserver.fileno())
+      if pool:
+        pool.dispatch()
+        waiting.extend(pool.filenos())
+        capacity = processes + pool.capacity()
+      progress = self.progress
+      if progress is not None:
+        progress.update(self, capacity)
+      # the progress line is redrawn and the workers are checked every second
+      timeout = 1.0 if pool or (progress is not None and progress.tty) else None
+      readable = select.select(waiting, [], [], timeout)[0]
+      finished = []
+      for fd in readable:
+        if fd not in running:
+          continue
+        task, reader, process = running.pop(fd)
+        try:
+          ok, result = reader.recv()
+        except EOFError:
+          ok, result = False, None
+        reader.close()
+        process.join()
+        if jobserver:
+          jobserver.release(task.tokens)
+        if result is None and not ok:
+          result = 'worker exited with code %s\n' % process.exitcode
+        finished.append((task, ok, result))
+      if pool:
+        finished.extend(pool.poll(readable))
+      for task, ok, result in finished:
+        # remote tasks that never reached a worker did not start
+        self.durations[task.key] = time.time() - (task.started or time.time())
+        self._finish(task, ok, result)
+        if on_done is not None:
+          on_done(task.key, ok, result)
+        if progress is not None:
+          progress.update(self, capacity, finished=task.key)
+    if held:
+      jobserver.release(held)
+    if self.progress is not None:
+      self.progress.close()
+    self.ready = None
+    return self.results
@@ -0,0 +1,53 @@
+"""A GNU make jobserver that shares one core budget between harness tasks
+and the make processes they start.
+
+The jobserver is a pipe holding one byte (token) per free core.  The task
+graph takes a token for every task it starts, and a make started by a task
+runs its first job on that token and takes one more for every job it runs
+in parallel.  So compiles of big benchmarks use whatever cores the other
+tasks leave idle, while the total stays within the budget.
+"""
+import errno
+import os
+
+TOKEN = '+'
+
+class Jobserver(object):
+  def __init__(self, tokens):
+    self.tokens = tokens
+    self.read_fd, self.write_fd = os.pipe()
+    # the graph polls through an open file description of its own: make
+    # clients inherit read_fd and expect blocking reads on it
+    self.reader = os.open('/proc/self/fd/%d' % self.read_fd, os.O_RDONLY | os.O_NONBLOCK)
+    self.release(tokens)
+
+  def fileno(self):
+    """Readable when tokens are available."""
+    return self.reader
+
+  def acquire(self, count):
+    """Take up to count tokens without blocking; return how many were taken."""
+    try:
+      return len(os.read(self.reader, count))
+    except OSError as e:
+      if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+        return 0
+      raise
+
+  def release(self, count):
+    while count:
+      count -= os.write(self.write_fd, TOKEN * count)
+
+  def makeflags(self):
+    """MAKEFLAGS that turn make into a client of this jobserver.
+
+    make before 4.2 only knows --jobserver-fds, later versions prefer
+    --jobserver-auth.  Output is synchronized per target, so that the
+    counter reports of parallel compiles do not interleave in the log.
+    """
+    fds = '%d,%d' % (self.read_fd, self.write_fd)
+    return '-j --jobserver-fds=%s --jobserver-auth=%s --output-sync=target' % (fds, fds)
+
+  def close(self):
+    for fd in [self.reader, self.read_fd, self.write_fd]:
+      os.close(fd)
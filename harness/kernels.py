@@ -0,0 +1,321 @@
+"""C micro-benchmark kernels generated from the test-partitions catalogs.
+
+A catalog lists the dimensions along which load/store checks get harder to
+optimize, each with numbered options:
+
+  1. index problem
+  1.1. none
+  1.2. access starts before the object
+
+Every cell (an option of a dimension) becomes a kernel: the catalog's
+baseline, where every dimension has its first option, with that one
+dimension changed.  Cells that come out the same (the first options) share
+the baseline kernel.  A kernel does a store and a load through pointers
+whose provenance, index, surrounding loops and control flow follow the
+cell, and main() calls it as often as its first argument says.
+
+Values the optimizer must not know are passed through opaque functions:
+`zero` is 0 at run time, so "possibly freed" objects are never freed and
+"possibly out of bounds" indexes are always in bounds.
+"""
+import fnmatch
+import re
+import os
+
+CATALOGS = ['always-valid', 'exact-check', 'implication']
+LEN = 64
+
+DIMENSION_PATTERN = re.compile(r'^([0-9]+)\.\s+(.*?)\s*$')
+OPTION_PATTERN = re.compile(r'^([0-9]+)\.([0-9]+)\.\s+(.*?)\s*$')
+
+# how the options of the catalogs shape a kernel, by (dimension, option);
+# the text in parentheses of an option does not count
+KNOBS = {
+  ('index problem', 'none'): {'index': 'none'},
+  ('index problem', 'access starts before the object'): {'index': 'before'},
+  ('index problem', 'access ends after the object'): {'index': 'after'},
+  ('index problem', 'off in the same direction'): {'index': 'same'},
+  ('index problem', 'off in different directions'): {'index': 'different'},
+  ('allocation problem', 'none'): {},
+  ('allocation problem', 'possibly freed'): {'freed': 'both'},
+  ('allocation problem', 'unknown allocation'): {'alloc': 'unknown'},
+  ('allocation problem', "possible to override global variable's size"): {'override': True},
+  ('allocation problem', 'first check on a possibly freed object'): {'freed': 'first'},
+  ('allocation problem', 'last check on a possibly freed object'): {'freed': 'last'},
+  ('allocation problem', 'both checks on a possibly freed object'): {'freed': 'both'},
+  ('allocation type', 'regular stack'): {'alloc': 'stack'},
+  ('allocation type', 'scoped alloca'): {'alloc': 'alloca'},
+  ('allocation type', 'global'): {'alloc': 'global'},
+  ('allocation type', 'heap'): {'alloc': 'heap'},
+  ('allocation type', 'mixed'): {'alloc': 'mixed'},
+  ('allocation type', 'unknown'): {'alloc': 'unknown'},
+  ('object size type', 'constant'): {'size': 'constant'},
+  ('object size type', 'variable'): {'size': 'variable'},
+  ('object size type', 'unknown'): {'size': 'unknown'},
+  ('number of objects', 'single object'): {'objects': 1},
+  ('number of objects', 'multiple objects'): {'objects': 2},
+  ('number of object types', 'one type'): {},
+  ('number of object types', 'two or more types'): {'types': 2},
+  ('number of object sizes', 'one size'): {},
+  ('number of object sizes', 'two or more sizes'): {'sizes': 2},
+  ('reason for multiple objects', 'n/a: one object'): {},
+  ('reason for multiple objects', 'select'): {'multi': 'select'},
+  ('reason for multiple objects', 'phi'): {'multi': 'phi'},
+  ('reason for multiple objects', 'mixed'): {'multi': 'mixed'},
+  ('loop structure', 'none'): {'loops': 'none'},
+  ('loop structure', 'single loop'): {'loops': 'single'},
+  ('loop structure', 'multiple loops'): {'loops': 'multiple'},
+  ('loop structure', 'checks in the same loop'): {'loops': 'single'},
+  ('loop structure', 'checks in different loops / one not in a loop'): {'loops': 'split'},
+  ('cfg structure', 'same basic block'): {'cfg': 'same'},
+  ('cfg structure', 'single connecting path'): {'cfg': 'path'},
+  ('cfg structure', 'multiple connecting paths'): {'cfg': 'paths'},
+  ('boundary expression type', 'constant'): {'bound': 'constant'},
+  ('boundary expression type', 'simple expression'): {'bound': 'simple'},
+  ('boundary expression type', 'unknown'): {'bound': 'unknown'},
+  ('boundary expression type', 'anything else'): {'bound': 'other'},
+  ('number of memory object sets', 'one'): {'sets': 1},
+  ('number of memory object sets', 'two'): {'sets': 2},
+}
+
+DEFAULTS = {'alloc': 'stack', 'freed': None, 'override': False, 'size': 'constant',
+            'objects': 1, 'types': 1, 'sizes': 1, 'multi': None, 'loops': 'none',
+            'cfg': 'same', 'index': 'none', 'bound': 'simple', 'sets': 1}
+
+class Cell(object):
+  def __init__(self, catalog, number, dimension, option):
+    self.catalog = catalog
+    self.number = number
+    self.dimension = dimension
+    self.option = option
+    self.name = '%s-%s' % (catalog, number)
+
+  def title(self):
+    return '%s %s %s: %s' % (self.catalog, self.number, self.dimension, self.option)
+
+class Kernel(object):
+  """A generated kernel and the cells it stands for."""
+  def __init__(self, name, spec, source, cells):
+    self.name = name
+    self.spec = spec
+    self.source = source
+    self.cells = cells
+
+  def accesses_per_call(self):
+    per_loop = LEN - 2
+    return {'none': 2, 'single': 2 * per_loop, 'multiple': 2 * per_loop,
+            'split': per_loop + 1}[self.spec['loops']]
+
+def _normalize(text):
+  return re.sub(r'\s*\(.*\)\s*$', '', text).strip().lower()
+
+def parse_catalog(path):
+  """Return [(number, dimension, [(number, option)])] of a catalog file."""
+  dimensions = []
+  for line in open(path):
+    option = OPTION_PATTERN.match(line)
+    if option:
+      if not dimensions or dimensions[-1][0] != option.group(1):
+        raise ValueError('%s: option %s.%s outside its dimension' %
+                         (path, option.group(1), option.group(2)))
+      dimensions[-1][2].append(('%s.%s' % (option.group(1), option.group(2)), option.group(3)))
+      continue
+    dimension = DIMENSION_PATTERN.match(line)
+    if dimension:
+      dimensions.append((dimension.group(1), dimension.group(2), []))
+  return dimensions
+
+def _knobs(path, dimension, option):
+  key = (_normalize(dimension), _normalize(option))
+  if key not in KNOBS:
+    raise ValueError('%s: no kernel for %s: %s' % (path, dimension, option))
+  return KNOBS[key]
+
+def _resolve(spec):
+  """Make the knobs of a cell consistent with each other."""
+  if spec['multi'] or spec['types'] == 2 or spec['sizes'] == 2 or spec['sets'] == 2 or \
+     spec['alloc'] == 'mixed':
+    spec['objects'] = 2
+  if spec['objects'] == 2 and not spec['multi']:
+    spec['multi'] = 'select'
+  if spec['override']:
+    spec['alloc'] = 'global'
+  if spec['freed'] and spec['alloc'] != 'heap':
+    spec['alloc'] = 'heap'
+  if spec['size'] == 'unknown' and spec['alloc'] != 'mixed':
+    spec['alloc'] = 'unknown'
+  if spec['alloc'] == 'global':
+    # globals have a constant size
+    spec['size'] = 'constant'
+  return spec
+
+def generate_kernels(catalog_dir, catalogs=CATALOGS, patterns=None):
+  """Return the kernels of the catalogs; patterns (fnmatch, e.g.
+  'exact-check-1.*') restrict the cells."""
+  kernels = []
+  for catalog in catalogs:
+    path = os.path.join(catalog_dir, catalog + '.txt')
+    dimensions = parse_catalog(path)
+    baseline = dict(DEFAULTS)
+    for _, dimension, options in dimensions:
+      baseline.update(_knobs(path, dimension, options[0][1]))
+
+    by_source = {}
+    for _, dimension, options in dimensions:
+      for number, option in options:
+        cell = Cell(catalog, number, dimension, option)
+        if patterns and not any(fnmatch.fnmatch(cell.name, pattern) for pattern in patterns):
+          continue
+        spec = dict(baseline)
+        spec.update(_knobs(path, dimension, option))
+        spec = _resolve(spec)
+        source = kernel_source(spec)
+        if source not in by_source:
+          name = '%s-baseline' % catalog if spec == _resolve(dict(baseline)) else cell.name
+          by_source[source] = Kernel(name, spec, source, [])
+          kernels.append(by_source[source])
+        by_source[source].cells.append(cell)
+  return kernels
+
+def write_kernel(kernel, src_dir):
+  """Write kernel.c of a kernel into src_dir, unless it is up to date."""
+  if not os.path.isdir(src_dir):
+    os.makedirs(src_dir)
+  path = os.path.join(src_dir, 'kernel.c')
+  text = ''.join('/* %s */\n' % cell.title() for cell in kernel.cells) + kernel.source
+  # an unchanged file keeps its mtime, and with it the build cache identity
+  if not os.path.exists(path) or open(path).read() != text:
+    file = open(path, 'w')
+    file.write(text)
+    file.close()
+  return path
+
+PRELUDE = '''#include <stdlib.h>
+
+#define LEN %d
+#define LEN2 (2 * LEN)
+
+struct pair { int x, y; };
+
+volatile long sink;
+
+/* the optimizer cannot see through these */
+__attribute__((noinline)) void *opaque(void *p) { __asm__ volatile("" : "+r"(p)); return p; }
+__attribute__((noinline)) long opaque_long(long v) { __asm__ volatile("" : "+r"(v)); return v; }
+''' % LEN
+
+MAIN = '''
+int main(int argc, char **argv) {
+  long calls = argc > 1 ? atol(argv[1]) : 1;
+  /* 0 at run time */
+  long zero = opaque_long(argc > 2);
+  long n = opaque_long(LEN);
+  long k, sum = 0;
+  for (k = 0; k < calls; k++)
+    sum += kernel(n, k, zero);
+  sink = sum;
+  return 0;
+}
+'''
+
+def _objects(spec):
+  """Return [(name, allocation, C type, length expression)] of the objects."""
+  length = 'LEN' if spec['size'] == 'constant' else 'n'
+  objects = [('a', spec['alloc'] if spec['alloc'] != 'mixed' else 'stack', 'int', length)]
+  if spec['objects'] == 2:
+    b_length = length if spec['sizes'] == 1 else \
+               ('LEN2' if spec['size'] == 'constant' else '2 * n')
+    b_type = 'int'
+    if spec['types'] == 2:
+      b_type = 'struct pair'
+      b_length = '(%s) / 2' % b_length
+    objects.append(('b', spec['alloc'] if spec['alloc'] != 'mixed' else 'heap',
+                    b_type, b_length))
+  return objects
+
+def kernel_source(spec):
+  out = [PRELUDE]
+  objects = _objects(spec)
+  body = []
+  decls = []
+  cleanup = []
+
+  for name, alloc, type, length in objects:
+    if alloc == 'global':
+      weak = '__attribute__((weak)) ' if spec['override'] else 'static '
+      out.append('%s%s g_%s[%s];\n' % (weak, type, name, length))
+      decls.append('%s *%s = g_%s;' % (type, name, name))
+    elif alloc == 'unknown':
+      out.append('static %s s_%s[LEN2];\n' % (type, name))
+      decls.append('%s *%s = opaque(s_%s);' % (type, name, name))
+    elif alloc == 'heap':
+      decls.append('%s *%s = malloc((%s) * sizeof(%s));' % (type, name, length, type))
+      cleanup.append('free(%s);' % name)
+    elif alloc == 'stack':
+      decls.append('%s %s[%s];' % (type, name, length))
+    else:
+      # a VLA in an inner block is a scoped alloca (stacksave/stackrestore)
+      decls.append('%s %s[%s + zero];' % (type, name, length))
+
+  # the pointers of the two checks
+  if spec['objects'] == 1:
+    body.append('p = (int *)a;')
+  elif spec['multi'] == 'select':
+    body.append('p = (k & 1) ? (int *)a : (int *)b;')
+  else:
+    # volatile stores keep the branches from becoming a select
+    body.append('if (k & 1) { sink = 1; p = (int *)a; } else { sink = 2; p = (int *)b; }')
+    if spec['multi'] == 'mixed':
+      body.append('q = (k & 2) ? (int *)a : (int *)b;')
+      body.append('if (k & 4) { sink = 3; p = q; }')
+  p1 = 'p'
+  p2 = 'p' if spec['sets'] == 1 else '((int *)a)'
+  if spec['freed'] in ['both', 'first']:
+    body.append('if (zero) free(a);')
+
+  bound = 'LEN' if spec['size'] == 'constant' else 'n'
+  base = {'constant': '3', 'simple': 'j', 'unknown': 'opaque_long(j)',
+          'other': '(1 + (j * j) % (LEN - 2))'}[spec['bound']]
+  index1, index2 = {'none': (base, base),
+                    'before': (base + ' - zero', base + ' - zero'),
+                    'after': (base + ' + zero', base + ' + zero'),
+                    'same': (base, base + ' + 1'),
+                    'different': (base + ' - 1', base + ' + 1')}[spec['index']]
+  first = '%s[%s] = (int)k;' % (p1, index1)
+  second = 'sum += %s[%s];' % (p2, index2)
+  between = []
+  if spec['freed'] == 'last':
+    between.append('if (zero) free(a);')
+  elif spec['freed'] == 'first':
+    between.append('if (zero) p = malloc(LEN * sizeof(int));')
+  if spec['cfg'] == 'path':
+    between.append('if (zero) goto out;')
+  elif spec['cfg'] == 'paths':
+    between.append('if (k & 8) sink = 1; else sink = 2;')
+
+  loop = 'for (j = 1; j < %s - 1; j++)' % bound
+  if spec['loops'] == 'none':
+    body.append('j = 1 + (k & (LEN / 2 - 1));')
+    body.extend([first] + between + [second])
+  elif spec['loops'] == 'single':
+    body.append(loop + ' {')
+    body.extend('  ' + line for line in [first] + between + [second])
+    body.append('}')
+  elif spec['loops'] == 'multiple':
+    body.extend([loop, '  ' + first] + between + [loop, '  ' + second])
+  else:
+    body.extend([loop, '  ' + first] + between + ['j = %s - 2;' % bound, second])
+
+  out.append('\n__attribute__((noinline)) long kernel(long n, long k, long zero) {\n')
+  out.append('  long sum = 0;\n  long j;\n  int *p, *q;\n')
+  if spec['alloc'] == 'alloca':
+    out.append('  {\n')
+    out.extend('    %s\n' % line for line in decls + body)
+    out.append('  }\n')
+  else:
+    out.extend('  %s\n' % line for line in decls + body)
+  out.append('out:\n')
+  out.extend('  %s\n' % line for line in cleanup)
+  out.append('  return sum;\n}\n')
+  out.append(MAIN)
+  return ''.join(out)
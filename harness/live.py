@@ -0,0 +1,118 @@
+"""Sampling the live counter files rtccounter keeps with RTCC_LIVE=path.
+
+A benchmark run may start several instrumented processes, so the harness
+points RTCC_LIVE at a directory with a %p pattern and sums all files in it.
+"""
+import struct
+import mmap
+import time
+import os
+
+from harness.reports import Summary, HISTOGRAMS, SUMMARY_FIELDS
+from harness.rusage import start_process
+
+MAGIC = 'RTCCLIVE'
+VERSION = 2
+HEADER = struct.Struct('=8sIIIIIIiI')
+# the counters at the start of every slot, SUMMARY_FIELDS in the order of
+# CounterBlock
+COUNTERS = struct.Struct('=8q')
+# followed by the log2 size histograms, in the order of HISTOGRAMS
+BUCKETS = 65
+HISTOGRAM = struct.Struct('=%dq' % BUCKETS)
+STATES = ['running', 'exited', 'failed']
+FILE_PATTERN = 'rtcc-%p.live'
+
+def read_file(path):
+  """Return (state, pid, unmapped threads, Summary) of one live file, or None
+  if the process has not initialized it yet."""
+  f = open(path, 'rb')
+  try:
+    if os.fstat(f.fileno()).st_size < HEADER.size:
+      return None
+    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+  finally:
+    f.close()
+  try:
+    magic, version, header_size, slot_size, slots, used, unmapped, pid, state = \
+        HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+      return None
+    if version != VERSION:
+      raise ValueError('%s: unsupported live counter version %d' % (path, version))
+    summary = Summary('runtime')
+    for slot in xrange(min(used, slots)):
+      offset = header_size + slot * slot_size
+      values = COUNTERS.unpack_from(data, offset)
+      for field, value in zip(SUMMARY_FIELDS, values):
+        setattr(summary, field, getattr(summary, field) + value)
+      offset += COUNTERS.size
+      for _, field in HISTOGRAMS:
+        for bucket, count in enumerate(HISTOGRAM.unpack_from(data, offset)):
+          if count:
+            summary.add_histogram(field, 1 << (bucket - 1) if bucket else 0, count)
+        offset += HISTOGRAM.size
+  finally:
+    data.close()
+  return STATES[state] if state < len(STATES) else 'unknown', pid, unmapped, summary
+
+def read_dir(live_dir):
+  """Return [(state, pid, unmapped threads, Summary)] of all files of a run."""
+  res = []
+  for name in sorted(os.listdir(live_dir)):
+    if name.endswith('.live'):
+      counters = read_file(os.path.join(live_dir, name))
+      if counters is not None:
+        res.append(counters)
+  return res
+
+def add_summaries(summaries):
+  total = Summary('runtime')
+  for summary in summaries:
+    for field in SUMMARY_FIELDS:
+      setattr(total, field, getattr(total, field) + getattr(summary, field))
+    for _, field in HISTOGRAMS:
+      for low, count in getattr(summary, field).items():
+        total.add_histogram(field, low, count)
+  return total
+
+def rates(series):
+  """Turn [(seconds, total calls)] into [(seconds, calls per second)]."""
+  res = []
+  for (t0, c0), (t1, c1) in zip(series, series[1:]):
+    if t1 > t0:
+      res.append((t1, (c1 - c0) / (t1 - t0)))
+  return res
+
+def stable_since(series, window=5, tolerance=0.05):
+  """Return the time from which on the check rate stayed within `tolerance`
+  (relative) of the mean of `window` consecutive samples, or None.  A run
+  that is stable early could be stopped there without changing its rates."""
+  values = rates(series)
+  for end in xrange(window, len(values) + 1):
+    recent = [rate for _, rate in values[end - window:end]]
+    m = sum(recent) / len(recent)
+    if m and max(abs(rate - m) for rate in recent) <= tolerance * m:
+      return values[end - window][0]
+  return None
+
+def run_sampled(args, cwd, live_dir, interval, env=None, stderr=None, stdout=None):
+  """Run a command with live counters in live_dir, sampling every `interval`
+  seconds.  Returns (exit status, [(seconds, total calls)], the final
+  read_dir of live_dir)."""
+  if not os.path.exists(live_dir):
+    os.makedirs(live_dir)
+  for name in os.listdir(live_dir):
+    os.remove(os.path.join(live_dir, name))
+  env = dict(env or os.environ, RTCC_LIVE=os.path.join(os.path.abspath(live_dir), FILE_PATTERN))
+  start = time.time()
+  process = start_process(args, cwd=cwd, env=env, stderr=stderr, stdout=stdout)
+  series = []
+  while True:
+    status = process.poll()
+    files = read_dir(live_dir)
+    total = add_summaries(summary for _, _, _, summary in files)
+    series.append((time.time() - start, total.get_total()))
+    if status is not None:
+      return status, series, files
+    time.sleep(interval)
@@ -0,0 +1,67 @@
+"""Memory time series of a benchmark's process tree, sampled from /proc.
+
+The rusage max_rss_kb of a run is the peak of its largest single process.
+The sampler instead sums the resident and virtual size and the number of
+mapped regions over the whole process tree (run.sh and everything it
+started), so shadow memory and redzones show up as they grow.
+"""
+import os
+
+PAGE_KB = os.sysconf('SC_PAGE_SIZE') // 1024
+FIELDS = ['rss_kb', 'vsz_kb', 'mappings']
+
+def process_tree(root):
+  """Return the pids of root and all of its descendants."""
+  children = {}
+  for entry in os.listdir('/proc'):
+    if not entry.isdigit():
+      continue
+    try:
+      stat = open('/proc/%s/stat' % entry).read()
+    except IOError:
+      continue
+    # the command name may hold spaces and parentheses
+    ppid = int(stat[stat.rindex(')') + 2:].split()[1])
+    children.setdefault(ppid, []).append(int(entry))
+  pids = [root]
+  for pid in pids:
+    pids.extend(children.get(pid, []))
+  return pids
+
+def sample_process(pid):
+  """Return (rss_kb, vsz_kb, mappings) of pid, or None if it is gone."""
+  try:
+    size, resident = open('/proc/%d/statm' % pid).read().split()[:2]
+    mappings = sum(1 for _ in open('/proc/%d/maps' % pid))
+  except (IOError, ValueError):
+    return None
+  return int(resident) * PAGE_KB, int(size) * PAGE_KB, mappings
+
+class MemorySampler(object):
+  """Collects a [seconds, rss_kb, vsz_kb, mappings] series of a process tree.
+
+  run_measured() calls sample() every `interval` seconds while the run
+  lasts."""
+  def __init__(self, interval):
+    self.interval = interval
+    self.series = []
+    self.start = None
+
+  def sample(self, pid, now):
+    if self.start is None:
+      self.start = now
+    total = [0, 0, 0]
+    for member in process_tree(pid):
+      values = sample_process(member)
+      if values is not None:
+        total = [a + b for a, b in zip(total, values)]
+    self.series.append([now - self.start] + total)
+
+  def summary(self):
+    """Peak and average of every field over the series."""
+    summary = {'samples': len(self.series), 'interval': self.interval}
+    for index, field in enumerate(FIELDS):
+      values = [sample[index + 1] for sample in self.series]
+      summary['peak_' + field] = max(values) if values else 0
+      summary['avg_' + field] = float(sum(values)) / len(values) if values else 0.0
+    return summary
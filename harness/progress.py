@@ -0,0 +1,83 @@
+"""A live progress line for TaskGraph runs.
+
+On a terminal the line is redrawn in place every second; otherwise (a
+nightly log) it is written once per finished task.  The ETA is based on the
+task costs, corrected by how long the finished tasks took compared to their
+costs, and is the larger of the remaining work spread over the workers and
+the longest remaining chain of dependent tasks.
+"""
+import time
+import sys
+
+def format_seconds(seconds):
+  seconds = int(seconds + 0.5)
+  if seconds >= 3600:
+    return '%d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+  return '%d:%02d' % (seconds // 60, seconds % 60)
+
+class Progress(object):
+  def __init__(self, out=None):
+    self.out = out or sys.stderr
+    self.tty = self.out.isatty()
+    self.start = time.time()
+    self.shown = False
+
+  def eta(self, graph, now, processes):
+    """Seconds until the graph is done, or None without task costs."""
+    estimated = sum(task.cost for task in graph.tasks.values()
+                    if task.key in graph.durations)
+    taken = sum(graph.durations[task.key] for task in graph.tasks.values()
+                if task.key in graph.durations and task.cost)
+    factor = taken / estimated if estimated and taken else 1.0
+    work = 0.0
+    chain = 0.0
+    remaining = False
+    costed = False
+    for task in graph.tasks.values():
+      if task.key in graph.results or task.key in graph.failed:
+        continue
+      remaining = True
+      costed = costed or task.cost > 0
+      elapsed = now - task.started if task.started is not None else 0.0
+      work += max(task.cost * factor - elapsed, 0.0)
+      chain = max(chain, graph.rank(task) * factor - elapsed)
+    if not remaining:
+      return 0.0
+    if not costed:
+      return None
+    return max(work / processes, chain)
+
+  def line(self, graph, processes):
+    now = time.time()
+    done = len(graph.results)
+    running = len([task for task in graph.tasks.values()
+                   if task.started is not None and task.key not in graph.durations])
+    line = '[%d/%d done, %d running' % (done, len(graph.tasks), running)
+    if graph.failed:
+      line += ', %d failed' % len(graph.failed)
+    line += '] %s elapsed' % format_seconds(now - self.start)
+    eta = self.eta(graph, now, processes)
+    line += ', ETA %s' % (format_seconds(eta) if eta is not None else '?')
+    return line
+
+  def update(self, graph, processes, finished=None):
+    """Redraw the line; on a terminal at any time, otherwise per finished task
+    (the key of which is given in finished)."""
+    if self.tty:
+      self.out.write('\r%s\x1b[K' % self.line(graph, processes))
+      self.shown = True
+    elif finished is not None:
+      self.out.write('%s %s\n' % (self.line(graph, processes), finished))
+    self.out.flush()
+
+  def message(self, text):
+    """Write text (whole lines) without garbling the progress line."""
+    if self.shown:
+      self.out.write('\r\x1b[K')
+    self.out.write(text)
+    self.shown = False
+
+  def close(self):
+    if self.shown:
+      self.out.write('\n')
+      self.shown = False
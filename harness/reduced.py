@@ -0,0 +1,123 @@
+"""Reduced-input counting: run-time counts of the reference inputs,
+extrapolated from runs on smaller input sets.
+
+A benchmark offers a reduced input set SIZE (such as SPEC's test or train
+inputs) with a run-SIZE.sh script next to its run.sh.  A full run that
+also ran the reduced inputs calibrates the benchmark under its
+configuration: it records how every run-time counter grows from each
+reduced input to the reference input.  Later builds of that configuration
+then only run the reduced inputs, and every reduced input gives an estimate
+of the reference counts (its counts times the calibrated growth).
+
+The estimates of the different inputs only agree when the counter ratios
+between this build and the calibration run are the same at every input
+size.  Their relative difference is the error estimate of the
+extrapolation.  The estimate from the largest reduced input is used when
+that error is within the tolerance; otherwise the benchmark gets a full run,
+which also recalibrates it.
+"""
+import fcntl
+import json
+import time
+import os
+
+from harness.buildcache import write_atomic
+from harness.reports import HISTOGRAMS, SUMMARY_FIELDS, Summary
+
+REF = 'ref'
+
+def script_name(size):
+  return 'run-%s.sh' % size
+
+def reduced_sizes(spec_dir, sizes):
+  """The sizes (smallest first) of which spec_dir has a run script."""
+  return [size for size in sizes if os.path.exists(os.path.join(spec_dir, script_name(size)))]
+
+def runtime_counts(summary):
+  return dict((field, getattr(summary, field)) for field in SUMMARY_FIELDS)
+
+def scaled_summary(summary, counts):
+  """A copy of the run-time Summary with the given counts; the histograms
+  grow with the total."""
+  scaled = Summary(summary.title)
+  for field in SUMMARY_FIELDS:
+    setattr(scaled, field, int(round(counts[field])))
+  factor = float(scaled.get_total()) / summary.get_total() if summary.get_total() else 0.0
+  for _, field in HISTOGRAMS:
+    setattr(scaled, field, dict((low, int(round(count * factor)))
+                                for low, count in getattr(summary, field).items()))
+  return scaled
+
+def extrapolate(counts, calibration):
+  """Estimate the reference counts from the counts of every reduced input.
+
+  counts and calibration map a size to {field: count}; calibration also
+  holds the reference counts under REF.  A field the calibration never saw
+  at some size grows like the total."""
+  ref = calibration[REF]
+  estimates = {}
+  for size, fields in counts.items():
+    base = calibration[size]
+    total_growth = float(sum(ref.values())) / sum(base.values()) if sum(base.values()) else 0.0
+    estimates[size] = dict((field, fields[field] * (float(ref[field]) / base[field]
+                                                    if base[field] else total_growth))
+                           for field in SUMMARY_FIELDS)
+  return estimates
+
+def estimate_error(estimates, sizes):
+  """The largest relative (L1) difference between the estimate of the
+  largest size and those of the others."""
+  best = estimates[sizes[-1]]
+  total = sum(best.values())
+  error = 0.0
+  for size in sizes[:-1]:
+    difference = sum(abs(best[field] - estimates[size][field]) for field in SUMMARY_FIELDS)
+    if difference:
+      error = max(error, difference / total if total else float('inf'))
+  return error
+
+def decide(counts, sizes, calibration, tolerance):
+  """Return (estimate, error, reason): the extrapolated reference counts and
+  their relative error, or estimate None and the reason for a full run.
+  calibration is that of InputScales.lookup."""
+  if len(sizes) < 2:
+    return None, None, 'fewer than two reduced inputs'
+  if calibration is None:
+    return None, None, 'not calibrated'
+  estimates = extrapolate(counts, calibration)
+  error = estimate_error(estimates, sizes)
+  if error > tolerance:
+    return None, error, 'the inputs disagree by %.1f%%' % (100 * error)
+  return estimates[sizes[-1]], error, None
+
+class InputScales(object):
+  """The counts of the calibration runs, by benchmark and configuration."""
+  def __init__(self, path):
+    self.path = path
+
+  def _load(self):
+    try:
+      return json.load(open(self.path))
+    except (IOError, ValueError):
+      # a lost index only costs us full runs
+      return {}
+
+  def lookup(self, name, configuration, sizes):
+    """Return {size: counts} of the calibration of name under configuration
+    covering sizes, or None.  The counters of other configurations (e.g.
+    unoptimized ones) need not grow alike, so they are never used."""
+    run = self._load().get(name, {}).get(configuration)
+    if run is None or not all(size in run['counts'] for size in list(sizes) + [REF]):
+      return None
+    return run['counts']
+
+  def record(self, name, configuration, counts):
+    """Store the counts ({size: counts}, with REF) of a calibration run."""
+    lock = open(self.path + '.lock', 'w')
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    try:
+      index = self._load()
+      index.setdefault(name, {})[configuration] = {'time': time.time(), 'counts': counts}
+      write_atomic(self.path, json.dumps(index, indent=1, sort_keys=True))
+    finally:
+      lock.close()
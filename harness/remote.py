@@ -0,0 +1,619 @@
+"""Coordinator/worker protocol for running harness tasks on other machines.
+
+A worker daemon (spec-worker.py) runs on every node.  It accepts compile
+and run tasks over TCP, executes them against its own SPEC tree, compiler
+and workspaces, and sends back structured records: build logs, run logs and
+the rusage records of harness/rusage.py.  The harness scripts talk to the
+workers through a WorkerPool, which the TaskGraph uses for the tasks added
+with add_remote().
+
+Messages are JSON objects preceded by their length (a 32-bit big-endian
+integer).  The worker greets every connection with
+
+  {"type": "hello", "version": 1, "name": ..., "slots": N}
+
+and then sends "heartbeat" messages every HEARTBEAT seconds, a "result"
+message ({"id", "ok", "result" or "error"}) for every task it ran and a
+"refused" message ({"id", "reason"}) for a task it cannot run faithfully,
+e.g. because its compiler differs from the coordinator's.  The coordinator
+sends "task" messages ({"id", "job", "cores"}); a job names its kind (see
+JOBS) and carries everything the worker needs, so it can run on any worker.
+
+The pool keeps every worker busy up to its slots, least-loaded first, and
+tasks with an affinity stay on the worker that took the first of them (the
+builds and timed runs of one benchmark run on one machine).  A worker that
+disconnects or stays silent for `timeout` seconds is lost: its tasks go back
+to the queue, up to `retries` times each, and the pool keeps reconnecting.
+A worker that loses its coordinator kills the tasks it was running for it.
+
+Workers execute whatever make command they are sent, so they must only
+listen on trusted networks.
+
+check-workers.py exercises all of this with two workers on localhost.
+"""
+import multiprocessing
+import subprocess
+import traceback
+import tempfile
+import socket
+import select
+import signal
+import struct
+import errno
+import json
+import time
+import sys
+import os
+
+from harness.buildcache import BuildCache, build_inputs, hash_inputs, snapshot
+from harness.memory import MemorySampler
+from harness.rusage import run_measured
+from harness.workspace import Workspace
+
+PORT = 7807
+VERSION = 1
+HEARTBEAT = 5.0
+TIMEOUT = 30.0
+RECONNECT = 10.0
+RETRIES = 2
+LENGTH = struct.Struct('!I')
+BUILT_NAME = '.built'
+BUILD_LOG_NAME = 'build.log'
+
+def parse_address(text, default_host='localhost'):
+  """Return (host, port) of "host:port", "host" or ":port"."""
+  host, _, port = text.rpartition(':') if ':' in text else (text, '', '')
+  try:
+    return host or default_host, int(port) if port else PORT
+  except ValueError:
+    raise ValueError('bad address %s' % text)
+
+def native(value):
+  """Turn the unicode strings of a decoded message into UTF-8 strs."""
+  if isinstance(value, unicode):
+    return value.encode('utf-8')
+  if isinstance(value, list):
+    return [native(item) for item in value]
+  if isinstance(value, dict):
+    return dict((native(key), native(item)) for key, item in value.items())
+  return value
+
+def _text(data):
+  """Logs may hold anything, messages only UTF-8."""
+  return data.decode('utf-8', 'replace')
+
+def send_message(sock, message):
+  data = json.dumps(message)
+  sock.sendall(LENGTH.pack(len(data)) + data)
+
+class MessageReader(object):
+  """Splits what arrives on a socket into messages."""
+  def __init__(self, sock):
+    self.sock = sock
+    self.buffer = ''
+
+  def read(self):
+    """Read what is available and return the complete messages.
+
+    Raises EOFError when the peer closed the connection and socket.error
+    when it broke."""
+    data = self.sock.recv(1 << 16)
+    if not data:
+      raise EOFError
+    self.buffer += data
+    messages = []
+    while len(self.buffer) >= LENGTH.size:
+      length = LENGTH.unpack(self.buffer[:LENGTH.size])[0]
+      if len(self.buffer) < LENGTH.size + length:
+        break
+      messages.append(json.loads(self.buffer[LENGTH.size:LENGTH.size + length]))
+      self.buffer = self.buffer[LENGTH.size + length:]
+    return messages
+
+# The worker side: jobs and the daemon
+
+class Refused(Exception):
+  """The worker cannot run a job as the coordinator would."""
+
+class WorkerContext(object):
+  """The local SPEC tree, workspaces and build cache of a worker.
+
+  maps are (coordinator prefix, worker prefix) pairs for the paths in the
+  jobs, such as the compiler directory and librtccounter.a."""
+  def __init__(self, spec_path, workspace_root, cache_dir, maps=()):
+    self.spec_path = spec_path
+    self.workspace_root = workspace_root
+    self.cache_dir = cache_dir
+    self.maps = list(maps)
+
+  def map(self, value):
+    value = native(value)
+    if isinstance(value, str):
+      for old, new in self.maps:
+        value = value.replace(old, new)
+      return value
+    if isinstance(value, list):
+      return [self.map(item) for item in value]
+    if isinstance(value, dict):
+      return dict((key, self.map(item)) for key, item in value.items())
+    return value
+
+def _check(expected, inputs):
+  if expected['sources'] != inputs['sources']:
+    raise Refused('the benchmark sources differ')
+  if expected['compiler'] != inputs['compiler']:
+    raise Refused('the compiler differs')
+  # the paths of the files named in the flags are the worker's own
+  if sorted(expected['files'].values()) != sorted(inputs['files'].values()):
+    raise Refused('the files named in the flags differ')
+
+def _build(context, build):
+  """Make sure the workspace of build holds it and return (workspace, build log).
+
+  A workspace remembers its last build, so the runs of a build that are sent
+  after it do not rebuild."""
+  args = context.map(build['make_args'])
+  workspace = Workspace(context.workspace_root, context.spec_path, native(build['benchmark']),
+                        native(build['label']))
+  cache = BuildCache(context.cache_dir)
+  inputs = build_inputs(os.path.join(workspace.spec_dir, 'src'), args,
+                        context.map(build['clang_bin_dir']), cache.file_identity)
+  _check(build['inputs'], inputs)
+  key = hash_inputs(inputs)
+  built_path = os.path.join(workspace.path, BUILT_NAME)
+  log_path = os.path.join(workspace.path, BUILD_LOG_NAME)
+  lock = workspace.lock()
+  try:
+    workspace.prepare()
+    if os.path.exists(built_path) and open(built_path).read() == key:
+      return workspace, open(log_path).read()
+    if os.path.exists(built_path):
+      os.remove(built_path)
+    workspace.clean()
+    log = cache.restore(key, workspace.src_path)
+    if log is None:
+      before = snapshot(workspace.src_path)
+      subprocess.check_call(args, stderr=subprocess.STDOUT, stdout=open(log_path, 'w'),
+                            cwd=workspace.src_path)
+      cache.store(key, workspace.src_path, before, log_path)
+      log = open(log_path).read()
+    else:
+      file = open(log_path, 'w')
+      file.write(log)
+      file.close()
+    file = open(built_path, 'w')
+    file.write(key)
+    file.close()
+  finally:
+    lock.release()
+  return workspace, log
+
+def _run(workspace, env=None, stderr=None, memory=None):
+  run_dir = workspace.acquire_run_dir()
+  try:
+    sampler = MemorySampler(memory) if memory else None
+    return run_measured([run_dir.path + 'run.sh'], run_dir.path, stderr=stderr, env=env,
+                        sampler=sampler)
+  finally:
+    run_dir.release()
+
+def build_job(context, job):
+  """{"build"} -> {"build_log"}"""
+  return {'build_log': _text(_build(context, job['build'])[1])}
+
+def count_job(context, job):
+  """{"build", "execute", "env"} -> {"build_log", "log", "rusage"}: a counted
+  build and, with execute, its run with stderr (the counter report) kept."""
+  workspace, build_log = _build(context, job['build'])
+  res = {'build_log': _text(build_log)}
+  if job['execute']:
+    env = dict(os.environ, **context.map(job['env'])) if job.get('env') else None
+    log = tempfile.TemporaryFile()
+    try:
+      res['rusage'] = _run(workspace, env, stderr=log)
+      log.seek(0)
+      res['log'] = _text(log.read())
+    finally:
+      log.close()
+  return res
+
+def time_job(context, job):
+  """{"build", "memory"} -> the rusage record of a run"""
+  workspace = _build(context, job['build'])[0]
+  return _run(workspace, memory=job.get('memory'))
+
+def pair_job(context, job):
+  """{"a", "b", "a_first", "memory"} -> {"a", "b", "order"}: the runs of two
+  builds back to back, as benchmark-asan-spec.py's run_pair"""
+  workspace_a = _build(context, job['a'])[0]
+  workspace_b = _build(context, job['b'])[0]
+  if job['a_first']:
+    a = _run(workspace_a, memory=job.get('memory'))
+    b = _run(workspace_b, memory=job.get('memory'))
+  else:
+    b = _run(workspace_b, memory=job.get('memory'))
+    a = _run(workspace_a, memory=job.get('memory'))
+  return {'a': a, 'b': b, 'order': 'AB' if job['a_first'] else 'BA'}
+
+JOBS = {'build': build_job, 'count': count_job, 'time': time_job, 'pair': pair_job}
+
+def _job_main(conn, context, job, inherited):
+  # a process group of its own, so that a cancelled job takes make and the
+  # benchmark with it
+  os.setpgrp()
+  # the daemon's sockets: a job that outlives its daemon must neither keep
+  # the port nor hide the daemon's death from the coordinators
+  for fd in inherited:
+    try:
+      os.close(fd)
+    except OSError:
+      pass
+  try:
+    result = ('ok', JOBS[job['kind']](context, job))
+  except Refused as e:
+    result = ('refused', str(e))
+  except:
+    result = ('failed', traceback.format_exc())
+  conn.send(result)
+  conn.close()
+
+def _kill(process):
+  try:
+    os.killpg(process.pid, signal.SIGKILL)
+  except OSError:
+    # it may not have made its process group yet
+    process.terminate()
+
+class _Client(object):
+  def __init__(self, sock, address):
+    self.sock = sock
+    self.reader = MessageReader(sock)
+    self.name = '%s:%d' % address[:2]
+
+class WorkerServer(object):
+  """The worker daemon: runs the tasks of its coordinators on `slots` cores."""
+  def __init__(self, context, address, slots, name=None, out=None):
+    self.context = context
+    self.slots = slots
+    self.name = name or socket.gethostname()
+    self.out = out or sys.stderr
+    self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self.listener.bind(address)
+    self.listener.listen(16)
+    self.address = self.listener.getsockname()
+    self.clients = {}
+    self.queue = []
+    self.running = {}
+    self.used = 0
+
+  def _drop(self, client, reason):
+    self.out.write('coordinator %s gone (%s)\n' % (client.name, reason))
+    del self.clients[client.sock.fileno()]
+    client.sock.close()
+    self.queue = [entry for entry in self.queue if entry[0] is not client]
+    for fd, (owner, id, cores, reader, process) in self.running.items():
+      if owner is client:
+        _kill(process)
+        # the job died with its output unsent; its slot frees when its pipe closes
+        self.running[fd] = (None, id, cores, reader, process)
+
+  def _send(self, client, message):
+    try:
+      send_message(client.sock, message)
+    except socket.error as e:
+      self._drop(client, e)
+
+  def _start_jobs(self):
+    while self.queue:
+      client, id, job, cores = self.queue[0]
+      cores = min(cores, self.slots)
+      if self.used + cores > self.slots:
+        return
+      self.queue.pop(0)
+      reader, writer = multiprocessing.Pipe(False)
+      sockets = [self.listener.fileno()] + list(self.clients)
+      process = multiprocessing.Process(target=_job_main,
+                                        args=(writer, self.context, job, sockets))
+      process.start()
+      writer.close()
+      self.used += cores
+      self.running[reader.fileno()] = (client, id, cores, reader, process)
+
+  def _finish(self, fd):
+    client, id, cores, reader, process = self.running.pop(fd)
+    try:
+      status, result = reader.recv()
+    except EOFError:
+      status, result = 'failed', None
+    reader.close()
+    process.join()
+    self.used -= cores
+    if client is None:
+      # its coordinator is gone
+      return
+    if status == 'failed':
+      if result is None:
+        result = 'job exited with code %s\n' % process.exitcode
+      self.out.write('%s failed\n' % id)
+      self._send(client, {'type': 'result', 'id': id, 'ok': False, 'error': _text(result)})
+    elif status == 'refused':
+      self.out.write('%s refused: %s\n' % (id, result))
+      self._send(client, {'type': 'refused', 'id': id, 'reason': result})
+    else:
+      self._send(client, {'type': 'result', 'id': id, 'ok': True, 'result': result})
+
+  def serve(self):
+    """Serve until interrupted; the running jobs are killed on the way out."""
+    self.out.write('worker %s listening on %s:%d with %d slots\n' %
+                   ((self.name,) + self.address[:2] + (self.slots,)))
+    try:
+      self._serve()
+    finally:
+      for _, _, _, _, process in self.running.values():
+        _kill(process)
+      self.listener.close()
+
+  def _serve(self):
+    next_heartbeat = time.time() + HEARTBEAT
+    while True:
+      self._start_jobs()
+      waiting = [self.listener.fileno()] + list(self.clients) + list(self.running)
+      timeout = max(next_heartbeat - time.time(), 0.0)
+      try:
+        readable = select.select(waiting, [], [], timeout)[0]
+      except select.error as e:
+        if e.args[0] != errno.EINTR:
+          raise
+        continue
+      for fd in readable:
+        if fd == self.listener.fileno():
+          sock, address = self.listener.accept()
+          client = _Client(sock, address)
+          self.clients[sock.fileno()] = client
+          self.out.write('coordinator %s connected\n' % client.name)
+          self._send(client, {'type': 'hello', 'version': VERSION, 'name': self.name,
+                              'slots': self.slots})
+        elif fd in self.running:
+          self._finish(fd)
+        elif fd in self.clients:
+          client = self.clients[fd]
+          try:
+            messages = client.reader.read()
+          except (EOFError, socket.error) as e:
+            self._drop(client, str(e) or 'closed')
+            continue
+          for message in messages:
+            if message.get('type') == 'task':
+              self.queue.append((client, message['id'], message['job'],
+                                 message.get('cores', 1)))
+      if time.time() >= next_heartbeat:
+        next_heartbeat = time.time() + HEARTBEAT
+        for client in self.clients.values():
+          self._send(client, {'type': 'heartbeat', 'running': len(self.running),
+                              'queued': len(self.queue)})
+
+# The coordinator side
+
+class _Entry(object):
+  def __init__(self, task, priority):
+    self.task = task
+    self.priority = priority
+    self.cores = 0
+    self.attempts = 0
+    self.lost = []
+    self.refused = {}
+
+class RemoteWorker(object):
+  def __init__(self, address):
+    self.address = address
+    self.name = '%s:%d' % address
+    self.sock = None
+    self.reader = None
+    self.slots = 0
+    self.used = 0
+    self.entries = {}
+    self.heard = None
+    self.retry_at = 0.0
+    self.unreachable = False
+
+  def ready(self):
+    """Connected and greeted."""
+    return self.sock is not None and self.slots > 0
+
+class WorkerPool(object):
+  """The workers of a coordinator; see the module docstring."""
+  def __init__(self, addresses, retries=RETRIES, timeout=TIMEOUT, out=None):
+    self.workers = [RemoteWorker(address) for address in addresses]
+    self.retries = retries
+    self.timeout = timeout
+    self.out = out or sys.stderr
+    self.pending = []
+    self.pins = {}
+    self.finished = []
+    self.down_since = None
+    # set by the TaskGraph, so that messages do not garble its progress line
+    self.progress = None
+
+  def _message(self, text):
+    if self.progress is not None:
+      self.progress.message(text)
+    else:
+      self.out.write(text)
+
+  def connect(self):
+    """Try to reach every worker now; return how many answered."""
+    for worker in self.workers:
+      if worker.sock is None:
+        self._connect(worker, time.time())
+    deadline = time.time() + self.timeout
+    while any(worker.sock is not None and not worker.slots for worker in self.workers) and \
+          time.time() < deadline:
+      self._read([worker.sock.fileno() for worker in self.workers if worker.sock is not None],
+                 deadline - time.time())
+    return len([worker for worker in self.workers if worker.ready()])
+
+  def _connect(self, worker, now):
+    try:
+      sock = socket.create_connection(worker.address, 5.0)
+      sock.settimeout(None)
+    except socket.error as e:
+      if not worker.unreachable:
+        self._message('cannot reach worker %s (%s)\n' % (worker.name, e))
+      worker.unreachable = True
+      worker.retry_at = now + RECONNECT
+      return
+    worker.sock = sock
+    worker.reader = MessageReader(sock)
+    worker.heard = now
+    worker.unreachable = False
+
+  def _lose(self, worker, reason, now):
+    if worker.entries:
+      self._message('lost worker %s (%s), retrying its %d tasks\n' %
+                    (worker.name, reason, len(worker.entries)))
+    else:
+      self._message('lost worker %s (%s)\n' % (worker.name, reason))
+    worker.sock.close()
+    worker.sock = worker.reader = None
+    worker.slots = worker.used = 0
+    worker.retry_at = now + RECONNECT
+    for affinity, pinned in self.pins.items():
+      if pinned is worker:
+        del self.pins[affinity]
+    for entry in worker.entries.values():
+      entry.task.started = None
+      entry.attempts += 1
+      entry.lost.append(worker.name)
+      if entry.attempts > self.retries:
+        self.finished.append((entry.task, False, 'lost on workers %s\n' % ', '.join(entry.lost)))
+      else:
+        self.pending.append(entry)
+    worker.entries = {}
+
+  def submit(self, task, priority):
+    """Queue a task of the graph (with task.job, task.cores and task.affinity)."""
+    self.pending.append(_Entry(task, priority))
+
+  def busy(self):
+    return bool(self.pending or any(worker.entries for worker in self.workers))
+
+  def capacity(self):
+    return sum(worker.slots for worker in self.workers)
+
+  def filenos(self):
+    return [worker.sock.fileno() for worker in self.workers if worker.sock is not None]
+
+  def _handle(self, worker, message, now):
+    kind = message.get('type')
+    if kind == 'hello':
+      if message.get('version') != VERSION:
+        self._message('worker %s speaks version %s, not %d\n' %
+                      (worker.name, message.get('version'), VERSION))
+        worker.sock.close()
+        worker.sock = worker.reader = None
+        worker.retry_at = float('inf')
+        return
+      worker.slots = message['slots']
+      worker.name = '%s (%s:%d)' % ((message['name'],) + worker.address)
+    elif kind in ['result', 'refused']:
+      entry = worker.entries.pop(message['id'], None)
+      if entry is None:
+        return
+      worker.used -= entry.cores
+      if kind == 'refused':
+        # another worker may well have the right compiler
+        entry.refused[worker.name] = message['reason']
+        if self.pins.get(entry.task.affinity) is worker:
+          del self.pins[entry.task.affinity]
+        self.pending.append(entry)
+      elif message['ok']:
+        self.finished.append((entry.task, True, native(message['result'])))
+      else:
+        self.finished.append((entry.task, False,
+                              'on worker %s:\n%s' % (worker.name, native(message['error']))))
+
+  def _read(self, fds, timeout=0.0):
+    by_fd = dict((worker.sock.fileno(), worker) for worker in self.workers
+                 if worker.sock is not None)
+    if timeout:
+      fds = select.select(fds, [], [], timeout)[0]
+    now = time.time()
+    for fd in fds:
+      worker = by_fd.get(fd)
+      if worker is None or worker.sock is None:
+        continue
+      try:
+        messages = worker.reader.read()
+      except (EOFError, socket.error) as e:
+        self._lose(worker, str(e) or 'connection closed', now)
+        continue
+      worker.heard = now
+      for message in messages:
+        self._handle(worker, message, now)
+
+  def dispatch(self):
+    """Send the pending tasks, by priority, to workers with free slots."""
+    self.pending.sort(key=lambda entry: entry.priority)
+    now = time.time()
+    for entry in list(self.pending):
+      task = entry.task
+      candidates = [worker for worker in self.workers
+                    if worker.ready() and worker.name not in entry.refused]
+      if not candidates:
+        if entry.refused and all(worker.name in entry.refused or worker.sock is None
+                                 for worker in self.workers):
+          self.pending.remove(entry)
+          self.finished.append((task, False, ''.join('refused by %s: %s\n' % item
+                                                     for item in sorted(entry.refused.items()))))
+        continue
+      pinned = self.pins.get(task.affinity)
+      if pinned in candidates:
+        candidates = [pinned]
+      candidates = [worker for worker in candidates
+                    if worker.slots - worker.used >= min(task.cores, worker.slots)]
+      if not candidates:
+        continue
+      worker = min(candidates, key=lambda worker: (float(worker.used) / worker.slots,
+                                                   -worker.slots))
+      try:
+        send_message(worker.sock, {'type': 'task', 'id': task.key, 'job': task.job,
+                                   'cores': task.cores})
+      except socket.error as e:
+        self._lose(worker, e, now)
+        continue
+      self.pending.remove(entry)
+      worker.entries[task.key] = entry
+      entry.cores = min(task.cores, worker.slots)
+      worker.used += entry.cores
+      if task.affinity is not None:
+        self.pins[task.affinity] = worker
+      task.started = now
+
+  def poll(self, readable):
+    """Handle the messages of the readable workers, lost workers and
+    reconnects; return the finished tasks as [(task, ok, result)]."""
+    self._read([fd for fd in readable if fd in self.filenos()])
+    now = time.time()
+    for worker in self.workers:
+      if worker.sock is not None and now - worker.heard > self.timeout:
+        self._lose(worker, 'silent for %.0f seconds' % (now - worker.heard), now)
+      elif worker.sock is None and now >= worker.retry_at and self.busy():
+        self._connect(worker, now)
+    if any(worker.ready() for worker in self.workers) or not self.pending:
+      self.down_since = None
+    elif self.down_since is None:
+      self.down_since = now
+    elif now - self.down_since > self.timeout:
+      for entry in self.pending:
+        self.finished.append((entry.task, False, 'no worker reachable\n'))
+      self.pending = []
+    self.dispatch()
+    finished, self.finished = self.finished, []
+    return finished
+
+  def close(self):
+    for worker in self.workers:
+      if worker.sock is not None:
+        worker.sock.close()
+        worker.sock = worker.reader = None
@@ -0,0 +1,426 @@
+"""Parser and summaries for Memory Safety Call Counter reports.
+
+The reports come from two places: the instrumenting compiler prints one per
+optimization stage while building, and rtccounter prints the run-time report
+when the benchmark exits.  combine-mscc-reports.py is the command line front
+end of this module.
+"""
+import mmap
+import stat
+import re
+import sys
+import os
+from cStringIO import StringIO
+
+report_prefix = "Memory Safety Call Counter report"
+runtime_report_prefix = "Runtime Memory Safety Call Counter report"
+
+# log2 size histograms of the run-time report (RTCC_HISTOGRAMS=1), in report
+# order; each maps the lower bound of a bucket to its count
+HISTOGRAMS = [('access', 'access_sizes'),
+              ('object', 'object_sizes'),
+              ('stack registration', 'stack_registration_sizes'),
+              ('global registration', 'global_registration_sizes')]
+HISTOGRAM_FIELDS = dict(HISTOGRAMS)
+SUMMARY_FIELDS = ['load_checks', 'store_checks', 'fast_load_checks', 'fast_store_checks',
+                  'fast_load_failure_calls', 'fast_store_failure_calls',
+                  'global_registrations', 'stack_registrations']
+# as get_total_ls_checks and get_total_registrations add them up
+LS_FIELDS = SUMMARY_FIELDS[:6]
+REGISTRATION_FIELDS = SUMMARY_FIELDS[6:]
+
+def bucket_bounds(low):
+  """Return the (low, high) sizes of the histogram bucket starting at low."""
+  return (low, low * 2 - 1 if low else 0)
+
+class Summary:
+  def __init__(self, title = None):
+    self.title = title
+    self.load_checks = 0
+    self.store_checks = 0
+    self.fast_load_checks = 0
+    self.fast_store_checks = 0
+    self.fast_load_failure_calls = 0
+    self.fast_store_failure_calls = 0
+    self.global_registrations = 0
+    self.stack_registrations = 0
+    for _, field in HISTOGRAMS:
+      setattr(self, field, {})
+
+  def get_total_ls_checks(self):
+    return self.load_checks + self.store_checks + self.fast_load_checks \
+         + self.fast_store_checks + self.fast_load_failure_calls \
+         + self.fast_store_failure_calls
+
+  def get_total_registrations(self):
+    return self.global_registrations + self.stack_registrations
+
+  def get_total(self):
+    return self.get_total_ls_checks() + self.get_total_registrations()
+
+  def get_delta(self, other, title = None):
+    delta = Summary(title)
+    delta.load_checks = self.load_checks - other.load_checks
+    delta.store_checks = self.store_checks - other.store_checks
+    delta.fast_load_checks = self.fast_load_checks - other.fast_load_checks
+    delta.fast_store_checks = self.fast_store_checks - other.fast_store_checks
+    delta.fast_load_failure_calls = self.fast_load_failure_calls \
+                                  - other.fast_load_failure_calls
+    delta.fast_store_failure_calls = self.fast_store_failure_calls \
+                                   - other.fast_store_failure_calls
+    delta.global_registrations = self.global_registrations \
+                               - other.global_registrations
+    delta.stack_registrations = self.stack_registrations \
+                              - other.stack_registrations
+    for _, field in HISTOGRAMS:
+      mine, theirs = getattr(self, field), getattr(other, field)
+      setattr(delta, field, dict((low, mine.get(low, 0) - theirs.get(low, 0))
+                                 for low in set(mine) | set(theirs)))
+    return delta
+
+  def add_histogram(self, field, low, amount):
+    histogram = getattr(self, field)
+    histogram[low] = histogram.get(low, 0) + amount
+
+  def print_report(self, reference_total = None, out = None):
+    out = out or sys.stdout
+    out.write(report_prefix if self.title != 'runtime' else runtime_report_prefix)
+    if self.title is not None and self.title != 'runtime':
+      out.write(" (" + self.title + ")")
+
+    total = self.get_total()
+    out.write(": %d calls\n" % total)
+    if not total:
+      return
+
+    reference_total = total if reference_total is None else reference_total
+    generic_checks = self.load_checks + self.store_checks
+    out.write("%d generic load/store checks (%d%%)\n" %
+              (generic_checks, 100 * generic_checks / reference_total if reference_total else 0))
+    if generic_checks:
+      out.write("  %d generic load checks\n" % self.load_checks)
+      out.write("  %d generic store checks\n" % self.store_checks)
+
+    fast_checks = self.fast_load_checks + self.fast_store_checks
+    out.write("%d fast load/store checks (%d%%)\n" %
+              (fast_checks, 100 * fast_checks / reference_total if reference_total else 0))
+    if fast_checks:
+      out.write("  %d fast load checks\n" % self.fast_load_checks)
+      out.write("  %d fast store checks\n" % self.fast_store_checks)
+
+    fast_failure_calls = self.fast_load_failure_calls \
+                       + self.fast_store_failure_calls
+    out.write("%d fast load/store failure calls (%d%%)\n" %
+              (fast_failure_calls, 100 * fast_failure_calls / reference_total if reference_total else 0))
+    if fast_failure_calls:
+      out.write("  %d fast load failure calls\n" %
+                self.fast_load_failure_calls)
+      out.write("  %d fast store failure calls\n" %
+                self.fast_store_failure_calls)
+    
+    registration_calls = self.global_registrations + self.stack_registrations
+    out.write("%d memory registration calls (%d%%)\n" %
+              (registration_calls, 100 * registration_calls / reference_total if reference_total else 0))
+    if registration_calls:
+      out.write("  %d global registration calls\n" %
+                self.global_registrations)
+      out.write("  %d stack registration calls\n" %
+                self.stack_registrations)
+
+    for name, field in HISTOGRAMS:
+      histogram = getattr(self, field)
+      for low in sorted(histogram):
+        count = histogram[low]
+        if not count:
+          continue
+        low, high = bucket_bounds(low)
+        if low == high:
+          out.write("  %d %s sizes of %d bytes\n" % (count, name, low))
+        else:
+          out.write("  %d %s sizes of %d-%d bytes\n" % (count, name, low, high))
+
+    out.write("\n")
+
+class MiniSummary:
+  def __init__(self, code_initial, opt_progress, runtime_initial, runtime_final):
+    self.code_initial = code_initial
+    self.opt_progress = opt_progress
+    self.runtime_initial = runtime_initial
+    self.runtime_final = runtime_final
+    self.keys = sorted(opt_progress.keys())
+
+  def format_number(self, number, max_len):
+    s = str(int(number))
+    res = ''
+    for i in xrange(len(s)):
+      if (len(s) - i) % 3 == 0 and i != 0:
+        res += ','
+      res += s[i]
+    return res.rjust(max_len, ' ')
+
+  def print_report(self, out = None):
+    out = out or sys.stdout
+    # initial checks
+    initial_number = self.code_initial.get_total_ls_checks()
+    last_number = initial_number
+    out.write('%d' % initial_number)
+
+    # optimized by various individual optimizations
+    optimized_total = 0
+    for key in self.keys:
+      optimized_here = last_number - self.opt_progress[key].get_total_ls_checks()
+      optimized_total += optimized_here
+      last_number = self.opt_progress[key].get_total_ls_checks()
+      percent = 0.0 if initial_number == 0 else 100.0 * optimized_here / initial_number
+      out.write(' | %d (%.0f%%)' % (optimized_here, percent))
+
+    # optimized in total
+    optimized_total_percent = 0.0 if initial_number == 0 else 100.0 * optimized_total / initial_number
+    out.write(' | %d (%.0f%%)' % (optimized_total, optimized_total_percent))
+
+    # runtime checks before optimizations
+    runtime_initial = self.runtime_initial.get_total_ls_checks()
+    out.write(' | %d' % runtime_initial)
+
+    # runtime checks avoided
+    runtime_avoided = runtime_initial - self.runtime_final.get_total_ls_checks()
+    runtime_avoided_percent = 0.0 if runtime_initial == 0 else 100.0 * runtime_avoided / runtime_initial
+    out.write(' | %d (%.0f%%)' % (runtime_avoided, runtime_avoided_percent))
+    out.write('\n')
+
+def _counter_fields():
+  """Map the text of a counter line to the Summary attribute it adds to."""
+  fields = {}
+  for kind in ['generic', 'fast']:
+    for op in ['load', 'store']:
+      fields['%s %s checks' % (kind, op)] = \
+          ('%s_checks' if kind == 'generic' else 'fast_%s_checks') % op
+      # failures are counted as fast check failures no matter how they are named
+      fields['%s %s failure calls' % (kind, op)] = 'fast_%s_failure_calls' % op
+      fields['%s %s check failures reported' % (kind, op)] = 'fast_%s_failure_calls' % op
+  fields['global registration calls'] = 'global_registrations'
+  fields['stack registration calls'] = 'stack_registrations'
+  return fields
+
+COUNTER_FIELDS = _counter_fields()
+
+# One pattern finds every line the parser cares about; everything else
+# (compiler output, benchmark output) is skipped inside the regex engine.
+# Starting the pattern with the newline that precedes a line lets the engine
+# jump from line to line with a fast literal search; the first line of a
+# buffer is matched separately.
+LINE_BODY = r'(?:(?P<runtime>Runtime )?' + re.escape(report_prefix) + r'(?P<title>[^\n]*)' \
+            r'|[ \t]*(?P<amount>[0-9]+) (?:(?P<what>' + \
+            '|'.join(re.escape(what) for what in sorted(COUNTER_FIELDS)) + \
+            r')|(?P<histogram>' + \
+            '|'.join(re.escape(name) for name, _ in HISTOGRAMS) + \
+            r') sizes of (?P<low>[0-9]+)(?:-[0-9]+)? bytes)[ \t\r]*$)'
+LINE_PATTERN = re.compile('\n' + LINE_BODY, re.M)
+FIRST_LINE_PATTERN = re.compile(LINE_BODY, re.M)
+# the same with section headers: a line holding a single word
+SECTION_BODY = LINE_BODY[:-1] + r'|(?P<section>[^\s]+)[ \t\r]*$)'
+SECTION_LINE_PATTERN = re.compile('\n' + SECTION_BODY, re.M)
+SECTION_FIRST_LINE_PATTERN = re.compile(SECTION_BODY, re.M)
+TITLE_PATTERN = re.compile(r'^\s*\((initial|final|final-lto|opt_progress_([0-9]+))\): [0-9]+ calls')
+
+CHUNK_SIZE = 4 << 20
+
+class ReportSet:
+  """The summaries of one build and run: per compile stage plus run time."""
+  def __init__(self, name = None):
+    self.name = name
+    self.initial = Summary("initial")
+    self.final = Summary("final")
+    self.final_lto = Summary("final-lto")
+    self.runtime = Summary("runtime")
+    self.opt_progress = {}
+
+  def select_summary(self, title):
+    """Return the summary a compiler report header refers to, or None."""
+    match = TITLE_PATTERN.match(title)
+    if not match:
+      return None
+    name = match.group(1)
+    if name == "initial":
+      return self.initial
+    if name == "final":
+      return self.final
+    if name == "final-lto":
+      return self.final_lto
+    num = int(match.group(2))
+    if num not in self.opt_progress:
+      self.opt_progress[num] = Summary(name)
+    return self.opt_progress[num]
+
+  def print_report(self, out = None):
+    out = out or sys.stdout
+    for num, data in self.opt_progress.iteritems():
+      data.print_report(out = out)
+
+    last = self.final_lto if self.final_lto.get_total() else self.final
+
+    if self.initial.get_total():
+      self.initial.print_report(out = out)
+      self.final.print_report(out = out)
+      if self.final_lto.get_total():
+        self.final_lto.print_report(out = out)
+
+      self.initial.get_delta(last, "optimized away").print_report(self.initial.get_total(), out)
+
+    if self.runtime.get_total():
+      # hack to estimate the number of global registrations
+      self.runtime.global_registrations = last.global_registrations
+
+      self.runtime.print_report(out = out)
+
+class Parser(ReportSet):
+  """Parses a raw log or a cleaned report into summaries.
+
+  With sections=True, a line holding nothing but a single word (such as a
+  benchmark name) starts a new section.  Every section gets its own
+  ReportSet in self.sections, while the parser itself still holds the
+  totals over all sections.
+  """
+  def __init__(self, stream, use_mmap = True, sections = False):
+    ReportSet.__init__(self)
+    self.stream = stream
+    self.use_mmap = use_mmap
+    self.line_pattern = SECTION_LINE_PATTERN if sections else LINE_PATTERN
+    self.first_line_pattern = SECTION_FIRST_LINE_PATTERN if sections else FIRST_LINE_PATTERN
+    self.sections = {}
+    self.section_names = []
+    self.current_section = None
+    self.current_summaries = ()
+    self.parse()
+
+  def _matches(self, buffer):
+    first = self.first_line_pattern.match(buffer)
+    if first is not None:
+      yield first
+    for match in self.line_pattern.finditer(buffer):
+      yield match
+
+  def _start_section(self, name):
+    if name not in self.sections:
+      self.sections[name] = ReportSet(name)
+      self.section_names.append(name)
+    self.current_section = self.sections[name]
+    return ()
+
+  def _select_summaries(self, runtime, title):
+    summaries = []
+    for report_set in [self, self.current_section]:
+      if report_set is None:
+        continue
+      summary = report_set.runtime if runtime else report_set.select_summary(title)
+      if summary is not None:
+        summaries.append(summary)
+    return summaries
+
+  def parse_buffer(self, buffer):
+    """Parse complete lines from a string or memory-mapped buffer."""
+    current_summaries = self.current_summaries
+    fields = COUNTER_FIELDS
+    for match in self._matches(buffer):
+      amount = match.group('amount')
+      if amount is not None:
+        what = match.group('what')
+        if what is not None:
+          field = fields[what]
+          for summary in current_summaries:
+            setattr(summary, field, getattr(summary, field) + int(amount))
+        else:
+          field = HISTOGRAM_FIELDS[match.group('histogram')]
+          for summary in current_summaries:
+            summary.add_histogram(field, int(match.group('low')), int(amount))
+      elif match.lastgroup == 'section':
+        current_summaries = self._start_section(match.group('section'))
+      else:
+        current_summaries = self._select_summaries(match.group('runtime'), match.group('title'))
+    self.current_summaries = current_summaries
+
+  def _map(self):
+    if not self.use_mmap:
+      return None
+    try:
+      if self.stream.tell() != 0:
+        return None
+      st = os.fstat(self.stream.fileno())
+    except (AttributeError, IOError, OSError):
+      return None
+    if not stat.S_ISREG(st.st_mode) or not st.st_size:
+      return None
+    return mmap.mmap(self.stream.fileno(), 0, access=mmap.ACCESS_READ)
+
+  def parse(self):
+    mapped = self._map()
+    if mapped is not None:
+      try:
+        self.parse_buffer(mapped)
+      finally:
+        mapped.close()
+      return
+
+    # every chunk handed to parse_buffer starts at the beginning of a line
+    rest = ''
+    while True:
+      chunk = self.stream.read(CHUNK_SIZE)
+      if not chunk:
+        break
+      chunk = rest + chunk
+      end = chunk.rfind('\n') + 1
+      if end:
+        self.parse_buffer(chunk[:end])
+      rest = chunk[end:]
+    if rest:
+      self.parse_buffer(rest)
+
+def format_report(parser):
+  """Return the cleaned report of a Parser as a string."""
+  out = StringIO()
+  parser.print_report(out)
+  return out.getvalue()
+
+def summary_data(summary):
+  """The counters and histograms of a Summary as a JSON-friendly dict."""
+  data = dict((field, getattr(summary, field)) for field in SUMMARY_FIELDS)
+  for _, field in HISTOGRAMS:
+    data[field] = dict((str(low), count) for low, count in getattr(summary, field).items())
+  return data
+
+def load_summary(data, title = None):
+  """The Summary of summary_data()."""
+  summary = Summary(title)
+  for field in SUMMARY_FIELDS:
+    setattr(summary, field, data[field])
+  for _, field in HISTOGRAMS:
+    setattr(summary, field, dict((int(low), count) for low, count in data[field].items()))
+  return summary
+
+def report_set_data(report_set):
+  """The Summaries of a ReportSet as a JSON-friendly dict, by stage."""
+  return {'initial': summary_data(report_set.initial),
+          'final': summary_data(report_set.final),
+          'final-lto': summary_data(report_set.final_lto),
+          'runtime': summary_data(report_set.runtime),
+          'opt_progress': dict((str(num), summary_data(summary))
+                               for num, summary in report_set.opt_progress.items())}
+
+def load_report_set(data, name = None):
+  """The ReportSet of report_set_data()."""
+  report_set = ReportSet(name)
+  report_set.initial = load_summary(data['initial'], "initial")
+  report_set.final = load_summary(data['final'], "final")
+  report_set.final_lto = load_summary(data['final-lto'], "final-lto")
+  report_set.runtime = load_summary(data['runtime'], "runtime")
+  for num, summary in data['opt_progress'].items():
+    report_set.opt_progress[int(num)] = load_summary(summary, "opt_progress_%s" % num)
+  return report_set
+
+def format_mini_summary(unoptimized, optimized):
+  """Return the one-line comparison of an unoptimized and an optimized run."""
+  summary = MiniSummary(unoptimized.initial, optimized.opt_progress,
+                        unoptimized.runtime, optimized.runtime)
+  out = StringIO()
+  summary.print_report(out)
+  return out.getvalue()
@@ -0,0 +1,152 @@
+"""Validated cache of per-benchmark counter results.
+
+Every entry records the inputs that produced it (sources, compiler, flags,
+run script and data, execute mode) next to the parsed counters of its
+report: the Summaries of harness/reports.py as JSON, so that reuse does not
+depend on the text format of the reports.  A manifest maps the hash of those
+inputs to the entry, so a result is only reused when all of them are
+unchanged, and the cache can be pruned by age and total size.
+"""
+import hashlib
+import fcntl
+import json
+import time
+import os
+
+from harness.buildcache import IDENTITIES_DIR, build_inputs, file_identity, hash_inputs, \
+    write_atomic
+from harness.reports import load_report_set, report_set_data
+
+MANIFEST_NAME = 'manifest.json'
+MAX_AGE_DAYS = 30
+MAX_SIZE_MB = 64
+
+def run_inputs(init_path, identity):
+  """Describe run.sh and the benchmark inputs in data/.
+
+  Input data can be large, so data files are identified by size and mtime.
+  """
+  res = {'run.sh': identity(os.path.join(init_path, 'run.sh')), 'data': None}
+  data_path = os.path.join(init_path, 'data')
+  if os.path.isdir(data_path):
+    h = hashlib.sha1()
+    for root, dirs, files in os.walk(data_path):
+      dirs.sort()
+      for file in sorted(files):
+        path = os.path.join(root, file)
+        st = os.stat(path)
+        h.update('%s:%d:%r\n' % (os.path.relpath(path, data_path), st.st_size, st.st_mtime))
+    res['data'] = h.hexdigest()
+  return res
+
+class ResultCache(object):
+  def __init__(self, path):
+    self.path = path
+    if not os.path.exists(path):
+      try:
+        os.makedirs(path)
+      except OSError:
+        if not os.path.isdir(path):
+          raise
+
+  def file_identity(self, path):
+    return file_identity(path, os.path.join(self.path, IDENTITIES_DIR))
+
+  def inputs(self, spec_path, name, make_args, clang_bin_dir, execute, env=None):
+    init_path = spec_path + '/' + name + '/'
+    inputs = build_inputs(init_path + 'src', make_args, clang_bin_dir, self.file_identity)
+    inputs['execute'] = bool(execute)
+    if execute:
+      inputs['run'] = run_inputs(init_path, self.file_identity)
+      if env:
+        # extra environment of the run, such as RTCC_HISTOGRAMS
+        inputs['run']['env'] = env
+    return inputs
+
+  def _lock(self):
+    lock = open(os.path.join(self.path, 'manifest.lock'), 'w')
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    return lock
+
+  def _load(self):
+    path = os.path.join(self.path, MANIFEST_NAME)
+    if not os.path.exists(path):
+      return {}
+    try:
+      return json.load(open(path))
+    except ValueError:
+      # a corrupt manifest only costs us a rerun
+      return {}
+
+  def _save(self, manifest):
+    write_atomic(os.path.join(self.path, MANIFEST_NAME), json.dumps(manifest, indent=1, sort_keys=True))
+
+  def lookup(self, mode, name, inputs):
+    """Return the cached ReportSet for these inputs, or None.
+
+    The second return value explains a miss when an older entry for the
+    same benchmark and mode exists.
+    """
+    key = hash_inputs(inputs)
+    lock = self._lock()
+    try:
+      manifest = self._load()
+      entry = manifest.get(key)
+      if entry is not None and 'summaries' in entry:
+        entry['used'] = time.time()
+        self._save(manifest)
+        return load_report_set(entry['summaries'], name), None
+
+      latest = None
+      for other in manifest.values():
+        if other['mode'] == mode and other['benchmark'] == name:
+          if latest is None or other['created'] > latest['created']:
+            latest = other
+      if latest is None:
+        return None, None
+      changed = [field for field in sorted(set(inputs) | set(latest['inputs']))
+                 if inputs.get(field) != latest['inputs'].get(field)]
+      return None, '%s changed' % ', '.join(changed)
+    finally:
+      lock.close()
+
+  def store(self, mode, name, inputs, report_set):
+    key = hash_inputs(inputs)
+    summaries = report_set_data(report_set)
+    lock = self._lock()
+    try:
+      manifest = self._load()
+      now = time.time()
+      manifest[key] = {'benchmark': name, 'mode': mode, 'inputs': inputs,
+                       'created': now, 'used': now, 'summaries': summaries,
+                       'size': len(json.dumps(summaries))}
+      self._save(manifest)
+    finally:
+      lock.close()
+    return key
+
+  def prune(self, max_age_days=MAX_AGE_DAYS, max_size_mb=MAX_SIZE_MB):
+    """Drop entries unused for max_age_days, then the least recently used
+    ones until their counters fit into max_size_mb.  Returns the number of
+    removed entries."""
+    lock = self._lock()
+    try:
+      manifest = self._load()
+      limit = time.time() - max_age_days * 24 * 3600
+      removed = [key for key, entry in manifest.items() if entry['used'] < limit]
+      for key in removed:
+        del manifest[key]
+
+      total = sum(entry['size'] for entry in manifest.values())
+      for key, entry in sorted(manifest.items(), key=lambda item: item[1]['used']):
+        if total <= max_size_mb * 1024 * 1024:
+          break
+        total -= entry['size']
+        del manifest[key]
+        removed.append(key)
+
+      if removed:
+        self._save(manifest)
+      return len(removed)
+    finally:
+      lock.close()
@@ -0,0 +1,142 @@
+"""SQLite store of benchmark results for comparisons across compiler builds.
+
+Every invocation of test-spec.py or benchmark-asan-spec.py adds one run per
+benchmark and configuration.  A run records what was measured (the timing
+samples with their rusage and the counters of the parsed reports) and what
+it was measured on (compiler and source hashes, flags and an optional
+free-form label such as the LLVM revision).  query-results.py is the command
+line front end.
+"""
+import sqlite3
+import json
+import time
+
+from harness.buildcache import hash_inputs
+from harness.reports import HISTOGRAMS, SUMMARY_FIELDS
+from harness.rusage import FIELDS
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+  id INTEGER PRIMARY KEY,
+  created REAL NOT NULL,
+  tool TEXT NOT NULL,
+  label TEXT,
+  benchmark TEXT NOT NULL,
+  configuration TEXT NOT NULL,
+  compiler TEXT NOT NULL,
+  sources TEXT NOT NULL,
+  flags TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_benchmark ON runs (benchmark, configuration);
+CREATE INDEX IF NOT EXISTS runs_compiler ON runs (compiler);
+CREATE INDEX IF NOT EXISTS runs_label ON runs (label);
+CREATE TABLE IF NOT EXISTS samples (
+  run_id INTEGER NOT NULL REFERENCES runs (id),
+  seq INTEGER NOT NULL,
+  %s,
+  PRIMARY KEY (run_id, seq)
+);
+CREATE TABLE IF NOT EXISTS counters (
+  run_id INTEGER NOT NULL REFERENCES runs (id),
+  stage TEXT NOT NULL,
+  field TEXT NOT NULL,
+  value INTEGER NOT NULL,
+  PRIMARY KEY (run_id, stage, field)
+);
+''' % ',\n  '.join('%s REAL' % field for field in FIELDS)
+
+SELECTOR_KEYS = ['run', 'label', 'compiler', 'configuration', 'tool', 'benchmark']
+
+def build_identity(inputs):
+  """The compiler, sources and flags of build_inputs() as stored in a run."""
+  return {'compiler': hash_inputs({'compiler': inputs['compiler'], 'files': inputs['files']}),
+          'sources': inputs['sources'],
+          'flags': inputs['flags']}
+
+def summary_counters(report_set):
+  """Yield (stage, field, value) for the non-zero counters of a ReportSet."""
+  stages = [('initial', report_set.initial), ('final', report_set.final),
+            ('final-lto', report_set.final_lto), ('runtime', report_set.runtime)]
+  for num in sorted(report_set.opt_progress):
+    stages.append(('opt_progress_%d' % num, report_set.opt_progress[num]))
+  for stage, summary in stages:
+    for field in SUMMARY_FIELDS:
+      if getattr(summary, field):
+        yield stage, field, getattr(summary, field)
+    for _, field in HISTOGRAMS:
+      for low, count in sorted(getattr(summary, field).items()):
+        if count:
+          yield stage, '%s:%d' % (field, low), count
+
+def parse_selector(text):
+  """Parse 'key=value,key=value' into a dict; raises ValueError."""
+  selector = {}
+  for part in text.split(','):
+    key, sep, value = part.partition('=')
+    if not sep or key not in SELECTOR_KEYS:
+      raise ValueError('invalid selector %r, expected key=value with key in %s' %
+                       (part, ', '.join(SELECTOR_KEYS)))
+    selector[key] = value
+  return selector
+
+class ResultDB(object):
+  def __init__(self, path):
+    # several harness invocations may write at the same time
+    self.db = sqlite3.connect(path, timeout=60)
+    self.db.executescript(SCHEMA)
+
+  def close(self):
+    self.db.close()
+
+  def add_run(self, tool, benchmark, configuration, identity, label=None, samples=(),
+              report_set=None):
+    """Store one run and return its id.  samples are run_measured() records."""
+    cursor = self.db.cursor()
+    cursor.execute('INSERT INTO runs (created, tool, label, benchmark, configuration, compiler, '
+                   'sources, flags) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                   (time.time(), tool, label, benchmark, configuration, identity['compiler'],
+                    identity['sources'], json.dumps(identity['flags'])))
+    run_id = cursor.lastrowid
+    cursor.executemany('INSERT INTO samples (run_id, seq, %s) VALUES (?, ?, %s)' %
+                       (', '.join(FIELDS), ', '.join('?' * len(FIELDS))),
+                       [(run_id, seq) + tuple(record[field] for field in FIELDS)
+                        for seq, record in enumerate(samples)])
+    if report_set is not None:
+      cursor.executemany('INSERT INTO counters (run_id, stage, field, value) VALUES (?, ?, ?, ?)',
+                         [(run_id,) + counter for counter in summary_counters(report_set)])
+    self.db.commit()
+    return run_id
+
+  def runs(self, selector):
+    """Return the runs matching a selector as dicts, oldest first."""
+    where = []
+    values = []
+    for key, value in sorted(selector.items()):
+      if key == 'run':
+        where.append('id = ?')
+        values.append(int(value))
+      elif key == 'compiler':
+        # hashes may be abbreviated
+        where.append('compiler LIKE ?')
+        values.append(value + '%')
+      else:
+        where.append('%s = ?' % key)
+        values.append(value)
+    cursor = self.db.execute('SELECT id, created, tool, label, benchmark, configuration, compiler, '
+                             'sources FROM runs%s ORDER BY created, id' %
+                             (' WHERE ' + ' AND '.join(where) if where else ''), values)
+    keys = ['id', 'created', 'tool', 'label', 'benchmark', 'configuration', 'compiler', 'sources']
+    return [dict(zip(keys, row)) for row in cursor]
+
+  def samples(self, run_ids):
+    """Return the sample records of the given runs."""
+    if not run_ids:
+      return []
+    cursor = self.db.execute('SELECT %s FROM samples WHERE run_id IN (%s) ORDER BY run_id, seq' %
+                             (', '.join(FIELDS), ', '.join('?' * len(run_ids))), list(run_ids))
+    return [dict(zip(FIELDS, row)) for row in cursor]
+
+  def counters(self, run_id):
+    """Return {(stage, field): value} of a run."""
+    cursor = self.db.execute('SELECT stage, field, value FROM counters WHERE run_id = ?', (run_id,))
+    return dict(((stage, field), value) for stage, field, value in cursor)
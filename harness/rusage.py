@@ -0,0 +1,89 @@
+"""Resource accounting for benchmark runs.
+
+The benchmark is started directly (no `time` or intermediate shell) and
+reaped with wait4(), which reports the resources used by the child and all
+of the descendants it waited for, i.e. the whole run.sh process tree.  A
+script without a #! line is run by /bin/sh, as the shell would.
+"""
+import subprocess
+import threading
+import errno
+import time
+import os
+
+FIELDS = ['user', 'sys', 'wall', 'max_rss_kb', 'major_faults', 'minor_faults',
+          'voluntary_switches', 'involuntary_switches']
+
+def start_process(args, **kwargs):
+  """subprocess.Popen(args, **kwargs), running scripts that cannot be
+  exec'd (no #! line) with /bin/sh."""
+  try:
+    return subprocess.Popen(args, **kwargs)
+  except OSError as e:
+    if e.errno != errno.ENOEXEC:
+      raise
+    return subprocess.Popen(['/bin/sh'] + list(args), **kwargs)
+
+def run_measured(args, cwd, stdout=None, stderr=None, env=None, sampler=None):
+  """Run args to completion and return a per-run record (a dict of FIELDS).
+
+  With a MemorySampler (harness/memory.py), the record also holds its
+  summary as 'memory' and its time series as 'memory_series'.
+
+  Raises subprocess.CalledProcessError if the command fails.
+  """
+  dev_null = open(os.devnull, 'w')
+  stop = threading.Event()
+  thread = None
+  try:
+    start = time.time()
+    process = start_process(args, cwd=cwd, env=env,
+                            stdout=stdout if stdout is not None else dev_null,
+                            stderr=stderr if stderr is not None else dev_null)
+    if sampler is not None:
+      # sampling in a thread leaves the wait (and so the wall time) exact
+      thread = threading.Thread(target=_sample, args=(sampler, process.pid, stop))
+      thread.daemon = True
+      thread.start()
+    while True:
+      try:
+        pid, status, usage = os.wait4(process.pid, 0)
+        break
+      except OSError as e:
+        if e.errno != errno.EINTR:
+          raise
+    wall = time.time() - start
+  finally:
+    stop.set()
+    if thread is not None:
+      thread.join()
+    dev_null.close()
+
+  if os.WIFSIGNALED(status):
+    process.returncode = -os.WTERMSIG(status)
+  else:
+    process.returncode = os.WEXITSTATUS(status)
+  if process.returncode:
+    raise subprocess.CalledProcessError(process.returncode, args)
+
+  record = {'user': usage.ru_utime,
+            'sys': usage.ru_stime,
+            'wall': wall,
+            'max_rss_kb': usage.ru_maxrss,
+            'major_faults': usage.ru_majflt,
+            'minor_faults': usage.ru_minflt,
+            'voluntary_switches': usage.ru_nvcsw,
+            'involuntary_switches': usage.ru_nivcsw}
+  if sampler is not None:
+    record['memory'] = sampler.summary()
+    record['memory_series'] = sampler.series
+  return record
+
+def _sample(sampler, pid, stop):
+  while True:
+    sampler.sample(pid, time.time())
+    if stop.wait(sampler.interval):
+      return
+
+def cpu_time(record):
+  return record['user'] + record['sys']
@@ -0,0 +1,129 @@
+"""Reading, merging and symbolizing rtccounter call-site dumps (RTCC_SITES)."""
+import subprocess
+import struct
+import os
+
+MAGIC = 'RTCCSITE'
+VERSION = 1
+HEADER = struct.Struct('=8sIIQQQ')
+RECORD = struct.Struct('=QQQ')
+
+KINDS = ['generic load checks', 'generic store checks', 'fast load checks',
+         'fast store checks', 'fast load check failures', 'fast store check failures',
+         'global registrations', 'stack registrations']
+
+PT_LOAD = 1
+
+class Mapping(object):
+  def __init__(self, start, end, offset, path):
+    self.start = start
+    self.end = end
+    self.offset = offset
+    self.path = path
+
+def parse_maps(text):
+  mappings = []
+  for line in text.splitlines():
+    fields = line.split(None, 5)
+    if len(fields) < 6 or not fields[5].startswith('/'):
+      continue
+    start, end = [int(x, 16) for x in fields[0].split('-')]
+    mappings.append(Mapping(start, end, int(fields[2], 16), fields[5].strip()))
+  return mappings
+
+def read_dump(path):
+  """Return ({(module, file offset, kind): count}, dropped calls) of a dump."""
+  f = open(path, 'rb')
+  try:
+    magic, version, _, entries, dropped, maps_size = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or version != VERSION:
+      raise ValueError('%s is not an rtccounter site dump' % path)
+    mappings = parse_maps(f.read(maps_size))
+    counts = {}
+    data = f.read(entries * RECORD.size)
+  finally:
+    f.close()
+
+  for i in xrange(entries):
+    address, kind, count = RECORD.unpack_from(data, i * RECORD.size)
+    # the return address points after the call; look up the call itself
+    module, offset = '?', address
+    for mapping in mappings:
+      if mapping.start <= address - 1 < mapping.end:
+        module, offset = mapping.path, address - mapping.start + mapping.offset
+        break
+    key = (module, offset, kind)
+    counts[key] = counts.get(key, 0) + count
+  return counts, dropped
+
+def merge(dumps):
+  """Merge the site counts of several dumps."""
+  total = {}
+  dropped = 0
+  for counts, lost in dumps:
+    for key, count in counts.items():
+      total[key] = total.get(key, 0) + count
+    dropped += lost
+  return total, dropped
+
+def _load_segments(path):
+  """Return [(file offset, size, virtual address)] of the PT_LOAD segments."""
+  f = open(path, 'rb')
+  try:
+    ident = f.read(16)
+    if ident[:4] != '\x7fELF':
+      return []
+    is64 = ident[4] == '\x02'
+    endian = '<' if ident[5] == '\x01' else '>'
+    if is64:
+      f.seek(32)
+      phoff, = struct.unpack(endian + 'Q', f.read(8))
+      f.seek(54)
+    else:
+      f.seek(28)
+      phoff, = struct.unpack(endian + 'I', f.read(4))
+      f.seek(42)
+    phentsize, phnum = struct.unpack(endian + 'HH', f.read(4))
+    segments = []
+    for i in xrange(phnum):
+      f.seek(phoff + i * phentsize)
+      if is64:
+        p_type, _, p_offset, p_vaddr, _, p_filesz = struct.unpack(endian + 'IIQQQQ', f.read(40))
+      else:
+        p_type, p_offset, p_vaddr, _, p_filesz = struct.unpack(endian + 'IIIII', f.read(20))
+      if p_type == PT_LOAD:
+        segments.append((p_offset, p_filesz, p_vaddr))
+    return segments
+  finally:
+    f.close()
+
+def symbolize(module, offsets, addr2line='addr2line'):
+  """Map file offsets of call sites in module to 'function at file:line'."""
+  res = {}
+  if not os.path.exists(module):
+    return res
+  segments = _load_segments(module)
+  vaddrs = []
+  for offset in offsets:
+    for p_offset, p_filesz, p_vaddr in segments:
+      if p_offset <= offset - 1 < p_offset + p_filesz:
+        vaddrs.append((offset, offset - 1 - p_offset + p_vaddr))
+        break
+  if not vaddrs:
+    return res
+  try:
+    out = subprocess.check_output([addr2line, '-f', '-C', '-e', module] +
+                                  ['0x%x' % vaddr for _, vaddr in vaddrs])
+  except (OSError, subprocess.CalledProcessError):
+    return res
+  lines = out.splitlines()
+  for i, (offset, _) in enumerate(vaddrs):
+    if 2 * i + 1 < len(lines):
+      res[offset] = '%s at %s' % (lines[2 * i], lines[2 * i + 1])
+  return res
+
+def top_sites(counts, kind, n):
+  """Return the n hottest ((module, offset), count) pairs of one check kind."""
+  sites = [((module, offset), count) for (module, offset, k), count in counts.items() if k == kind]
+  sites.sort(key=lambda site: -site[1])
+  return sites[:n]
@@ -0,0 +1,33 @@
+"""Helpers for locating, building and running SPEC benchmarks."""
+import os
+
+BUILD_PRODUCT_MAGICS = ['\x7fELF', '!<arch>']
+
+def is_build_product(path):
+  """True for objects, archives and executables."""
+  f = open(path, 'rb')
+  head = f.read(8)
+  f.close()
+  for magic in BUILD_PRODUCT_MAGICS:
+    if head.startswith(magic):
+      return True
+  return False
+
+def find_spec_names(path):
+  res = []
+  for entry in os.listdir(path):
+    prefix = path + '/' + entry
+    if not os.path.exists(prefix + '/src'):
+      continue
+    if not os.path.exists(prefix + '/run.sh'):
+      continue
+    res.append(entry)
+  return sorted(res)
+
+def make_command(clang_bin_dir, cflags, cxxflags):
+  args = ['make']
+  args.append('CC=' + clang_bin_dir + '/clang')
+  args.append('CXX=' + clang_bin_dir + '/clang++')
+  args.append('CFLAGS=' + cflags)
+  args.append('CXXFLAGS=' + cxxflags)
+  return args
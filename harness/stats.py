@@ -0,0 +1,88 @@
+"""Small statistics helpers for benchmark timings (no numpy/scipy needed)."""
+import math
+
+# two-sided 95% critical values of Student's t distribution by degrees of freedom
+T_95 = [None, 12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262,
+        2.228, 2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093,
+        2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045,
+        2.042]
+T_95_LARGE = [(40, 2.021), (60, 2.000), (120, 1.980)]
+Z_95 = 1.960
+
+# samples further than this many (scaled) MADs from the median are outliers
+OUTLIER_MADS = 3.0
+
+def mean(values):
+  return float(sum(values)) / len(values)
+
+def median(values):
+  values = sorted(values)
+  mid = len(values) // 2
+  if len(values) % 2:
+    return float(values[mid])
+  return (values[mid - 1] + values[mid]) / 2.0
+
+def stdev(values):
+  """Sample standard deviation."""
+  if len(values) < 2:
+    return 0.0
+  m = mean(values)
+  return math.sqrt(sum((v - m) ** 2 for v in values) / (len(values) - 1))
+
+def t_critical(df):
+  if df < len(T_95):
+    return T_95[df]
+  for limit, value in T_95_LARGE:
+    if df <= limit:
+      return value
+  return Z_95
+
+def confidence_interval(values):
+  """Return the 95% confidence interval of the mean as (low, high)."""
+  m = mean(values)
+  if len(values) < 2:
+    return (m, m)
+  half = t_critical(len(values) - 1) * stdev(values) / math.sqrt(len(values))
+  return (m - half, m + half)
+
+def relative_ci_width(values):
+  """Half-width of the 95% confidence interval relative to the mean."""
+  low, high = confidence_interval(values)
+  m = mean(values)
+  return (high - low) / 2.0 / m if m else 0.0
+
+def reject_outliers(values):
+  """Split values into (kept, outliers) using the median absolute deviation."""
+  if len(values) < 3:
+    return list(values), []
+  m = median(values)
+  # 1.4826 scales the MAD to the standard deviation of a normal distribution
+  mad = 1.4826 * median([abs(v - m) for v in values])
+  if not mad:
+    return list(values), []
+  kept = [v for v in values if abs(v - m) <= OUTLIER_MADS * mad]
+  outliers = [v for v in values if abs(v - m) > OUTLIER_MADS * mad]
+  return kept, outliers
+
+def runs_needed(values, target):
+  """Estimate how many samples bring the relative CI half-width to target."""
+  m = mean(values)
+  if len(values) < 2 or not m:
+    return len(values)
+  s = stdev(values)
+  return int(math.ceil((t_critical(len(values) - 1) * s / (target * m)) ** 2))
+
+def welch_interval(a, b):
+  """Return (difference, low, high): mean(b) - mean(a) and its 95% confidence
+  interval by Welch's t-test.  The bounds are None with fewer than 2 samples
+  on either side."""
+  d = mean(b) - mean(a)
+  if len(a) < 2 or len(b) < 2:
+    return d, None, None
+  va = stdev(a) ** 2 / len(a)
+  vb = stdev(b) ** 2 / len(b)
+  if not va + vb:
+    return d, d, d
+  df = (va + vb) ** 2 / (va ** 2 / (len(a) - 1) + vb ** 2 / (len(b) - 1))
+  half = t_critical(max(1, int(df))) * math.sqrt(va + vb)
+  return d, d - half, d + half
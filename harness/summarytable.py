@@ -0,0 +1,240 @@
+"""Array-backed table of Summary counters, one row per benchmark and
+configuration, one column per stage and counter.
+
+The counters of all rows live in one flat array of 64-bit integers (row
+major), so totals, deltas and percentages are computed column-wise over the
+whole table instead of Summary by Summary: stage_total() gives a column of
+checks per stage, and take(), delta() and percent() pick and combine such
+columns, as mini_summary() does.  The table exports to CSV, JSON and a
+binary format that loads straight into an array:
+
+  8s magic "RTCCTBL\\0", u32 version, u32 reserved
+  u64 rows, u64 columns, u64 length of the names
+  names: the column names, then "benchmark/configuration" of every row,
+         each terminated by a newline
+  rows * columns little-endian int64 counters
+
+Column names are "stage.field", e.g. "runtime.fast_load_checks", the fields
+of a stage in the order of SUMMARY_FIELDS (harness/reports.py); the stages
+are those of ReportSet (opt_progress N as opt_progress_N).  Every stage also
+has a "reported" column, 1 if the stage was in the report: a build reports
+an optimization stage even when all of its counts are 0.
+"""
+import struct
+import array
+import json
+import sys
+
+from harness.reports import LS_FIELDS, SUMMARY_FIELDS
+
+MAGIC = 'RTCCTBL\0'
+VERSION = 1
+HEADER = struct.Struct('<8sIIQQQ')
+
+REPORTED = 'reported'
+# Python 2 has no 'q' arrays, its 'l' is 64 bits on the LP64 systems we use
+INT64 = 'q' if 'q' in getattr(array, 'typecodes', '') else 'l'
+assert array.array(INT64).itemsize == 8
+
+def report_set_stages(report_set):
+  """Return [(stage, Summary)] of a ReportSet."""
+  stages = [('initial', report_set.initial)]
+  for num in sorted(report_set.opt_progress):
+    stages.append(('opt_progress_%d' % num, report_set.opt_progress[num]))
+  stages.extend([('final', report_set.final), ('final-lto', report_set.final_lto),
+                 ('runtime', report_set.runtime)])
+  return stages
+
+class SummaryTable(object):
+  def __init__(self, stages):
+    self.stages = list(stages)
+    self.columns = [(stage, field) for stage in self.stages
+                    for field in SUMMARY_FIELDS + [REPORTED]]
+    self.column_index = dict((column, i) for i, column in enumerate(self.columns))
+    self.rows = []
+    self.row_index = {}
+    self.data = array.array(INT64)
+
+  @classmethod
+  def from_report_sets(cls, entries):
+    """Build a table from [(benchmark, configuration, ReportSet)]."""
+    opt_progress = sorted(set(num for _, _, report_set in entries
+                              for num in report_set.opt_progress))
+    table = cls(['initial'] + ['opt_progress_%d' % num for num in opt_progress] +
+                ['final', 'final-lto', 'runtime'])
+    for benchmark, configuration, report_set in entries:
+      values = {}
+      for stage, summary in report_set_stages(report_set):
+        for field in SUMMARY_FIELDS:
+          values[(stage, field)] = getattr(summary, field)
+        # the opt_progress stages of report_set are those it reported
+        values[(stage, REPORTED)] = int(stage.startswith('opt_progress_') or
+                                        summary.get_total() > 0)
+      table.add_row(benchmark, configuration, values)
+    return table
+
+  def add_row(self, benchmark, configuration, values):
+    """Append a row; values maps (stage, field) to a count, missing ones are 0."""
+    key = (benchmark, configuration)
+    assert key not in self.row_index, 'duplicate row %s/%s' % key
+    self.row_index[key] = len(self.rows)
+    self.rows.append(key)
+    self.data.extend(values.get(column, 0) for column in self.columns)
+
+  def add_sum(self, benchmark, configuration, keys):
+    """Append a row of the column sums of the rows keys ([(benchmark,
+    configuration)]); a stage is reported if any of them reported it."""
+    width = len(self.columns)
+    values = {}
+    for i, column in enumerate(self.columns):
+      counts = [self.data[self.row_index[key] * width + i] for key in keys]
+      values[column] = int(any(counts)) if column[1] == REPORTED else sum(counts)
+    self.add_row(benchmark, configuration, values)
+
+  def row(self, benchmark, configuration):
+    width = len(self.columns)
+    start = self.row_index[(benchmark, configuration)] * width
+    return self.data[start:start + width]
+
+  def column(self, stage, field):
+    """The counter of every row, in row order."""
+    return self.data[self.column_index[(stage, field)]::len(self.columns)]
+
+  def stage_total(self, stage, fields=LS_FIELDS):
+    """The sum of fields in stage for every row (by default the
+    load/store checks, as Summary.get_total_ls_checks)."""
+    if stage not in self.stages:
+      return [0] * len(self.rows)
+    return [sum(values) for values in zip(*[self.column(stage, field) for field in fields])]
+
+  def totals(self):
+    """The column sums over all rows, as a dict like the values of add_row."""
+    width = len(self.columns)
+    return dict((column, sum(self.data[i::width])) for i, column in enumerate(self.columns))
+
+  def select(self, configuration):
+    """The row indexes of a configuration, by benchmark."""
+    return dict((benchmark, i) for i, (benchmark, config) in enumerate(self.rows)
+                if config == configuration)
+
+  def mini_summary(self, unoptimized, optimized):
+    """The MiniSummary columns of every benchmark with rows for both
+    configurations: {benchmark: [initial checks, (optimized, percent) per
+    optimization, (optimized total, percent), run-time checks before
+    optimization, (run-time checks avoided, percent)]}."""
+    unopt_rows = self.select(unoptimized)
+    opt_rows = self.select(optimized)
+    benchmarks = [benchmark for benchmark in unopt_rows if benchmark in opt_rows]
+    u = [unopt_rows[benchmark] for benchmark in benchmarks]
+    o = [opt_rows[benchmark] for benchmark in benchmarks]
+
+    initial = take(self.stage_total('initial'), u)
+    # checks left after every optimization an optimized row went through;
+    # a row that skipped one keeps the count of the one before
+    last = initial
+    optimized_here = []
+    for stage in self.stages:
+      if not stage.startswith('opt_progress_'):
+        continue
+      reported = take(self.column(stage, REPORTED), o)
+      left = [total if present else before for total, present, before in
+              zip(take(self.stage_total(stage), o), reported, last)]
+      here = delta(last, left)
+      optimized_here.append((here, percent(here, initial), reported))
+      last = left
+    optimized_total = delta(initial, last)
+    optimized_percent = percent(optimized_total, initial)
+    runtime_initial = take(self.stage_total('runtime'), u)
+    avoided = delta(runtime_initial, take(self.stage_total('runtime'), o))
+    avoided_percent = percent(avoided, runtime_initial)
+
+    res = {}
+    for i, benchmark in enumerate(benchmarks):
+      columns = [initial[i]]
+      columns.extend((here[i], here_percent[i]) for here, here_percent, reported in optimized_here
+                     if reported[i])
+      columns.append((optimized_total[i], optimized_percent[i]))
+      columns.append(runtime_initial[i])
+      columns.append((avoided[i], avoided_percent[i]))
+      res[benchmark] = columns
+    return res
+
+  def write_csv(self, out):
+    out.write(','.join(['benchmark', 'configuration'] +
+                       ['%s.%s' % column for column in self.columns]) + '\n')
+    width = len(self.columns)
+    for i, (benchmark, configuration) in enumerate(self.rows):
+      out.write(','.join([benchmark, configuration] +
+                         [str(value) for value in self.data[i * width:(i + 1) * width]]) + '\n')
+
+  def write_json(self, out):
+    width = len(self.columns)
+    json.dump({'columns': ['%s.%s' % column for column in self.columns],
+               'rows': [{'benchmark': benchmark, 'configuration': configuration,
+                         'values': self.data[i * width:(i + 1) * width].tolist()}
+                        for i, (benchmark, configuration) in enumerate(self.rows)]},
+              out, indent=1, sort_keys=True)
+    out.write('\n')
+
+  def write_binary(self, out):
+    names = ''.join('%s.%s\n' % column for column in self.columns) + \
+            ''.join('%s/%s\n' % row for row in self.rows)
+    out.write(HEADER.pack(MAGIC, VERSION, 0, len(self.rows), len(self.columns), len(names)))
+    out.write(names)
+    data = self.data
+    if sys.byteorder != 'little':
+      data = array.array(INT64, data)
+      data.byteswap()
+    data.tofile(out)
+
+def read_binary(stream):
+  """Load a table written by SummaryTable.write_binary; raises ValueError."""
+  header = stream.read(HEADER.size)
+  if len(header) != HEADER.size:
+    raise ValueError('truncated summary table')
+  magic, version, _, rows, columns, names_length = HEADER.unpack(header)
+  if magic != MAGIC or version != VERSION:
+    raise ValueError('not a summary table of version %d' % VERSION)
+  names = stream.read(names_length).split('\n')[:-1]
+  if len(names) != columns + rows:
+    raise ValueError('corrupt summary table names')
+  stages = []
+  for name in names[:columns:len(SUMMARY_FIELDS) + 1]:
+    stages.append(name.rsplit('.', 1)[0])
+  table = SummaryTable(stages)
+  if ['%s.%s' % column for column in table.columns] != names[:columns]:
+    raise ValueError('unexpected summary table columns')
+  data = array.array(INT64)
+  try:
+    data.fromfile(stream, rows * columns)
+  except EOFError:
+    raise ValueError('truncated summary table')
+  if sys.byteorder != 'little':
+    data.byteswap()
+  table.data = data
+  for name in names[columns:]:
+    benchmark, configuration = name.split('/', 1)
+    table.row_index[(benchmark, configuration)] = len(table.rows)
+    table.rows.append((benchmark, configuration))
+  return table
+
+def take(column, rows):
+  """The values of column (one per row) of the row indexes rows, in their order."""
+  return [column[i] for i in rows]
+
+def delta(a, b):
+  """a - b for every row of two columns."""
+  return [x - y for x, y in zip(a, b)]
+
+def percent(part, whole):
+  """part as a percentage of whole for every row, 0.0 where whole is 0."""
+  return [0.0 if y == 0 else 100.0 * x / y for x, y in zip(part, whole)]
+
+def format_mini_summary_row(columns):
+  """Format mini_summary() columns like MiniSummary.print_report."""
+  parts = ['%d' % columns[0]]
+  for column in columns[1:-2]:
+    parts.append('%d (%.0f%%)' % column)
+  parts.append('%d' % columns[-2])
+  parts.append('%d (%.0f%%)' % columns[-1])
+  return ' | '.join(parts) + '\n'
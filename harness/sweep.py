@@ -0,0 +1,89 @@
+"""Configuration matrices for test-spec.py --sweep.
+
+A sweep file is JSON:
+
+  {
+    "configurations": [
+      {"name": "unopt", "clang_bin_dir": "/opt/llvm-alloff/bin"},
+      {"name": "opt", "clang_bin_dir": "/opt/llvm/bin"},
+      {"name": "opt-sizes", "clang_bin_dir": "/opt/llvm/bin",
+       "env": {"RTCC_HISTOGRAMS": "1"}},
+      {"name": "asan", "clang_bin_dir": "/opt/llvm/bin",
+       "cflags": "-mllvm -asan-opt=1"}
+    ],
+    "finals": [
+      {"name": "final", "unoptimized": "unopt", "optimized": "opt"},
+      {"name": "final-asan", "unoptimized": "unopt", "optimized": "asan",
+       "table": "asan"}
+    ]
+  }
+
+clang_bin_dir defaults to the CLANG_BIN_DIR argument, cflags are appended to
+the usual flags and env is added to the environment of the runs.  Every
+final names two configurations and produces the generate_final table of
+the pair; table selects its columns (see TABLES in test-spec.py).
+"""
+import json
+import re
+import os
+
+NAME_PATTERN = re.compile(r'^[A-Za-z0-9_.+]+(-[A-Za-z0-9_.+]+)*$')
+
+class Configuration(object):
+  def __init__(self, name, clang_bin_dir, cflags='', env=None):
+    self.name = name
+    self.prefix = name + '-'
+    self.clang_bin_dir = clang_bin_dir
+    self.cflags = cflags
+    self.env = env or {}
+
+  def build_key(self):
+    """Configurations with equal build keys share their builds."""
+    return (os.path.realpath(self.clang_bin_dir), self.cflags)
+
+class Final(object):
+  def __init__(self, name, unoptimized, optimized, table):
+    self.name = name
+    self.unoptimized = unoptimized
+    self.optimized = optimized
+    self.table = table
+
+def load_sweep(path, default_clang_bin_dir, tables):
+  """Return ([Configuration], [Final]) of a sweep file; raises ValueError."""
+  try:
+    sweep = json.load(open(path))
+  except ValueError as e:
+    raise ValueError('%s: %s' % (path, e))
+
+  configurations = []
+  names = set()
+  for entry in sweep.get('configurations', []):
+    name = entry.get('name')
+    if not name or not NAME_PATTERN.match(name):
+      raise ValueError('%s: invalid configuration name %r' % (path, name))
+    if name in names:
+      raise ValueError('%s: duplicate configuration %s' % (path, name))
+    clang_bin_dir = entry.get('clang_bin_dir', default_clang_bin_dir)
+    if not clang_bin_dir:
+      raise ValueError('%s: configuration %s has no clang_bin_dir' % (path, name))
+    names.add(name)
+    configurations.append(Configuration(name, clang_bin_dir, entry.get('cflags', ''),
+                                        dict((str(k), str(v)) for k, v in
+                                             entry.get('env', {}).items())))
+  if not configurations:
+    raise ValueError('%s: no configurations' % path)
+
+  finals = []
+  for entry in sweep.get('finals', []):
+    for key in ['name', 'unoptimized', 'optimized']:
+      if key not in entry:
+        raise ValueError('%s: final without %s' % (path, key))
+    for key in ['unoptimized', 'optimized']:
+      if entry[key] not in names:
+        raise ValueError('%s: final %s names unknown configuration %s' %
+                         (path, entry['name'], entry[key]))
+    table = entry.get('table', 'general')
+    if table not in tables:
+      raise ValueError('%s: final %s has unknown table %s' % (path, entry['name'], table))
+    finals.append(Final(entry['name'], entry['unoptimized'], entry['optimized'], table))
+  return configurations, finals
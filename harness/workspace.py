@@ -0,0 +1,195 @@
+"""Persistent, lockable workspaces for building and running benchmarks.
+
+A workspace mirrors one SPEC benchmark for one build configuration: its
+directories are real, its files are symlinks into SPEC_PATH, and build
+outputs land next to the links, so the SPEC tree itself is never written.
+Workspaces live under a root directory (which may be on tmpfs) and are kept
+between invocations; the link tree is only brought up to date when a
+directory of the benchmark changed.
+
+Builds take the workspace lock exclusively and runs take it shared, so a
+workspace is never rebuilt under a running benchmark, also not by another
+invocation of the harness.  Every run gets a run directory of its own,
+holding links to run.sh, the data files and the workspace's src/, so that
+concurrent runs of one build do not overwrite each other's output files.
+Run directories are reused as well.  Besides run.sh, they link the run
+scripts of reduced inputs (run-SIZE.sh, see harness/reduced.py).
+"""
+import hashlib
+import fcntl
+import json
+import re
+import os
+
+from harness.spec import is_build_product
+
+STAMP_NAME = '.stamp'
+LOCK_NAME = '.lock'
+RUNS_DIR = 'runs'
+
+def _makedirs(path):
+  """os.makedirs that tolerates a concurrent process creating path."""
+  try:
+    os.makedirs(path)
+  except OSError:
+    if not os.path.isdir(path):
+      raise
+
+def workspace_label(name, *build):
+  """A directory name for a build: readable name plus a hash of its identity."""
+  h = hashlib.sha1(json.dumps(build)).hexdigest()[:10]
+  return re.sub(r'[^A-Za-z0-9_.+-]', '_', name) + '-' + h
+
+def _mirror(src, dst):
+  """Make dst a tree of real directories and symlinks to the files of src.
+
+  Regular files in dst are left alone: those are build or run outputs.
+  Links to files that disappeared from src are removed, and build products
+  of an earlier in-tree build in src are not linked, since make would take
+  them for up to date.
+  """
+  _makedirs(dst)
+  wanted = set()
+  for entry in os.listdir(src):
+    path = os.path.join(src, entry)
+    target = os.path.join(dst, entry)
+    if os.path.isdir(path):
+      wanted.add(entry)
+      _mirror(path, target)
+    elif os.path.isfile(path) and not is_build_product(path):
+      wanted.add(entry)
+      if os.path.islink(target) and os.readlink(target) == path:
+        continue
+      if os.path.lexists(target):
+        os.remove(target)
+      os.symlink(path, target)
+  for entry in os.listdir(dst):
+    target = os.path.join(dst, entry)
+    if entry not in wanted and os.path.islink(target):
+      os.remove(target)
+
+def _remove_outputs(path):
+  """Remove everything below path that is not a symlink or a directory."""
+  for root, dirs, files in os.walk(path):
+    for file in files:
+      file_path = os.path.join(root, file)
+      if not os.path.islink(file_path):
+        os.remove(file_path)
+
+def _run_scripts(spec_dir):
+  return [entry for entry in os.listdir(spec_dir)
+          if entry == 'run.sh' or (entry.startswith('run-') and entry.endswith('.sh'))]
+
+def _stamp(spec_dir):
+  """Modification times of the benchmark's directories: they change when
+  files are added or removed, which is all the link tree depends on."""
+  stamp = [['', os.stat(spec_dir).st_mtime]]
+  for folder in ['src', 'data']:
+    for root, dirs, files in os.walk(os.path.join(spec_dir, folder)):
+      dirs.sort()
+      stamp.append([os.path.relpath(root, spec_dir), os.stat(root).st_mtime])
+  return stamp
+
+class Lock(object):
+  def __init__(self, path, exclusive=True, blocking=True):
+    self.file = open(path, 'a')
+    flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+    if not blocking:
+      flags |= fcntl.LOCK_NB
+    try:
+      fcntl.flock(self.file, flags)
+    except:
+      self.file.close()
+      raise
+
+  def release(self):
+    self.file.close()
+
+class RunDir(object):
+  """A run directory leased from a workspace; release() hands it back."""
+  def __init__(self, path, locks):
+    self.path = path
+    self.locks = locks
+
+  def release(self):
+    for lock in reversed(self.locks):
+      lock.release()
+
+class Workspace(object):
+  def __init__(self, root, spec_path, name, label):
+    self.spec_dir = os.path.join(os.path.abspath(spec_path), name)
+    self.path = os.path.join(os.path.abspath(root), name, label)
+    self.src_path = os.path.join(self.path, 'src') + os.sep
+
+  def lock(self, exclusive=True):
+    _makedirs(self.path)
+    return Lock(os.path.join(self.path, LOCK_NAME), exclusive)
+
+  def prepare(self):
+    """Bring the link tree up to date; call with the exclusive lock held."""
+    stamp_path = os.path.join(self.path, STAMP_NAME)
+    stamp = _stamp(self.spec_dir)
+    try:
+      if json.load(open(stamp_path)) == stamp:
+        return
+    except (IOError, ValueError):
+      pass
+    _mirror(os.path.join(self.spec_dir, 'src'), self.src_path)
+    runs_path = os.path.join(self.path, RUNS_DIR)
+    if os.path.isdir(runs_path):
+      for slot in os.listdir(runs_path):
+        if os.path.isdir(os.path.join(runs_path, slot)):
+          self._prepare_run_dir(os.path.join(runs_path, slot))
+    file = open(stamp_path, 'w')
+    json.dump(stamp, file)
+    file.close()
+
+  def clean(self):
+    """Remove the outputs of the previous build, so that make rebuilds (and
+    reports on) everything."""
+    _remove_outputs(self.src_path)
+
+  def _prepare_run_dir(self, path):
+    _makedirs(path)
+    scripts = _run_scripts(self.spec_dir)
+    for entry in _run_scripts(path):
+      if entry not in scripts and os.path.islink(os.path.join(path, entry)):
+        os.remove(os.path.join(path, entry))
+    for entry, target in [(script, os.path.join(self.spec_dir, script)) for script in scripts] + \
+                         [('src', self.src_path.rstrip(os.sep))]:
+      link = os.path.join(path, entry)
+      if not os.path.islink(link) or os.readlink(link) != target:
+        if os.path.lexists(link):
+          os.remove(link)
+        os.symlink(target, link)
+    _mirror(os.path.join(self.spec_dir, 'data'), os.path.join(path, 'data'))
+
+  def acquire_run_dir(self):
+    """Lease a free run directory, creating one if all are busy."""
+    shared = self.lock(exclusive=False)
+    try:
+      runs_path = os.path.join(self.path, RUNS_DIR)
+      _makedirs(runs_path)
+      # the lock of a run directory is taken before the directory is made,
+      # so concurrent runs never set up the same one
+      slot = 0
+      while True:
+        path = os.path.join(runs_path, str(slot))
+        try:
+          lock = Lock(path + LOCK_NAME, blocking=False)
+        except IOError:
+          slot += 1
+          continue
+        break
+      try:
+        if not os.path.isdir(path):
+          self._prepare_run_dir(path)
+        # outputs of the previous run must not be mistaken for this run's
+        _remove_outputs(path)
+      except:
+        lock.release()
+        raise
+      return RunDir(path + os.sep, [shared, lock])
+    except:
+      shared.release()
+      raise
@@ -0,0 +1,155 @@
+import optparse
+import time
+import sys
+
+from harness.reports import LS_FIELDS, REGISTRATION_FIELDS
+from harness.resultdb import ResultDB, parse_selector
+from harness.rusage import cpu_time
+from harness.stats import mean, median, welch_interval
+
+RESULT_DB = 'test-spec-temp/results.db'
+
+USAGE = 'usage: %prog [options] list [SELECTOR]\n' + \
+        '       %prog [options] compare SELECTOR_A SELECTOR_B'
+DESCRIPTION = 'Queries the results that test-spec.py and benchmark-asan-spec.py record. ' + \
+              'A selector is key=value[,key=value...] with the keys run, label, compiler ' + \
+              '(a hash prefix), configuration, tool and benchmark. list shows the matching ' + \
+              'runs, e.g. the history of one benchmark. compare pairs the runs of two ' + \
+              'selectors by benchmark (and by configuration unless both selectors name one), ' + \
+              'pools the timing samples of each side and flags the differences that are ' + \
+              'significant: CPU time by the 95% confidence interval of Welch\'s t-test, ' + \
+              'check counts by any change beyond the threshold. The exit status is 1 when ' + \
+              'B regressed.'
+
+# (name, stage, fields) of the compared check counts
+COUNT_METRICS = [('run-time checks', 'runtime', LS_FIELDS),
+                 ('run-time registrations', 'runtime', REGISTRATION_FIELDS),
+                 ('instrumented checks', 'final', LS_FIELDS)]
+
+def count(counters, stage, fields):
+  return sum(counters.get((stage, field), 0) for field in fields)
+
+def list_runs(db, selector):
+  for run in db.runs(selector):
+    times = [cpu_time(sample) for sample in db.samples([run['id']])]
+    counters = db.counters(run['id'])
+    sys.stdout.write('%5d  %s  %-20s %-12s %-12s %s' %
+                     (run['id'], time.strftime('%Y-%m-%d %H:%M', time.localtime(run['created'])),
+                      run['tool'], run['benchmark'], run['configuration'], run['compiler'][:10]))
+    if run['label']:
+      sys.stdout.write('  %s' % run['label'])
+    if times:
+      sys.stdout.write('  n=%d cpu %.3f' % (len(times), median(times)))
+    if counters:
+      sys.stdout.write('  checks %d' % count(counters, 'runtime', LS_FIELDS))
+    sys.stdout.write('\n')
+
+def change(a, b):
+  return '%+.1f%%' % (100.0 * (b - a) / a) if a else 'n/a'
+
+def compare_timing(db, runs_a, runs_b, threshold):
+  """Write the CPU time line of a pair; return True for a regression."""
+  times_a = [cpu_time(sample) for sample in db.samples([run['id'] for run in runs_a])]
+  times_b = [cpu_time(sample) for sample in db.samples([run['id'] for run in runs_b])]
+  if not times_a or not times_b:
+    return False
+  base = mean(times_a)
+  d, low, high = welch_interval(times_a, times_b)
+  sys.stdout.write('  %-24s %14.3f %14.3f %8s' % ('cpu time', base, mean(times_b), change(base, base + d)))
+  regressed = False
+  if low is None:
+    sys.stdout.write('  (n=%d/%d, too few samples)' % (len(times_a), len(times_b)))
+  else:
+    sys.stdout.write('  (%s .. %s, n=%d/%d)' % (change(base, base + low), change(base, base + high),
+                                               len(times_a), len(times_b)))
+    if low > 0 and 100.0 * d / base >= threshold:
+      sys.stdout.write('  REGRESSION')
+      regressed = True
+    elif high < 0 and -100.0 * d / base >= threshold:
+      sys.stdout.write('  improved')
+  sys.stdout.write('\n')
+  return regressed
+
+def compare_counts(db, runs_a, runs_b, threshold):
+  """Write the check count lines of a pair; return True for a regression.
+
+  Counts do not vary between runs of one build, so the latest runs with
+  counters are compared."""
+  counted_a = [db.counters(run['id']) for run in runs_a]
+  counted_b = [db.counters(run['id']) for run in runs_b]
+  counted_a = [counters for counters in counted_a if counters]
+  counted_b = [counters for counters in counted_b if counters]
+  if not counted_a or not counted_b:
+    return False
+  regressed = False
+  for name, stage, fields in COUNT_METRICS:
+    a = count(counted_a[-1], stage, fields)
+    b = count(counted_b[-1], stage, fields)
+    if not a and not b:
+      continue
+    sys.stdout.write('  %-24s %14d %14d %8s' % (name, a, b, change(a, b)))
+    if b > a and (not a or 100.0 * (b - a) / a > threshold):
+      sys.stdout.write('  REGRESSION')
+      regressed = True
+    elif b < a and 100.0 * (a - b) / a > threshold:
+      sys.stdout.write('  improved')
+    sys.stdout.write('\n')
+  return regressed
+
+def compare_runs(db, selector_a, selector_b, options):
+  runs_a = db.runs(selector_a)
+  runs_b = db.runs(selector_b)
+  by_configuration = 'configuration' not in selector_a or 'configuration' not in selector_b
+  def group(runs):
+    groups = {}
+    for run in runs:
+      key = (run['benchmark'], run['configuration'] if by_configuration else None)
+      groups.setdefault(key, []).append(run)
+    return groups
+  groups_a = group(runs_a)
+  groups_b = group(runs_b)
+  keys = sorted(set(groups_a) & set(groups_b))
+  if not keys:
+    sys.stderr.write('no benchmark has results for both selectors\n')
+    return False
+
+  sys.stdout.write('%-26s %14s %14s\n' % ('', 'A', 'B'))
+  regressed = False
+  for key in keys:
+    a, b = groups_a[key], groups_b[key]
+    if options.latest:
+      a, b = a[-1:], b[-1:]
+    sys.stdout.write(' '.join(part for part in key if part) + '\n')
+    regressed = compare_timing(db, a, b, options.time_threshold) or regressed
+    regressed = compare_counts(db, a, b, options.count_threshold) or regressed
+  for key in sorted(set(groups_a) ^ set(groups_b)):
+    sys.stderr.write('%s only has results for %s\n' %
+                     (' '.join(part for part in key if part), 'A' if key in groups_a else 'B'))
+  return regressed
+
+if __name__ == '__main__':
+  parser = optparse.OptionParser(usage=USAGE, description=DESCRIPTION)
+  parser.add_option("--db", dest="db", default=RESULT_DB,
+                    help="The SQLite database of the results", metavar="PATH")
+  parser.add_option("--latest", action="store_true", dest="latest", default=False,
+                    help="Compare only the latest run of each benchmark instead of all runs")
+  parser.add_option("--time-threshold", dest="time_threshold", type="float", default=1.0,
+                    help="Ignore significant CPU time changes smaller than PERCENT",
+                    metavar="PERCENT")
+  parser.add_option("--count-threshold", dest="count_threshold", type="float", default=0.0,
+                    help="Ignore check count changes up to PERCENT", metavar="PERCENT")
+  (options, args) = parser.parse_args()
+  if not args or args[0] not in ['list', 'compare'] or \
+     len(args) > (2 if args[0] == 'list' else 3) or (args[0] == 'compare' and len(args) < 3):
+    parser.print_help()
+    exit()
+
+  try:
+    selectors = [parse_selector(arg) for arg in args[1:]]
+  except ValueError as e:
+    parser.error(str(e))
+  db = ResultDB(options.db)
+  if args[0] == 'list':
+    list_runs(db, selectors[0] if selectors else {})
+  elif compare_runs(db, selectors[0], selectors[1], options):
+    exit(1)
@@ -0,0 +1,55 @@
+import optparse
+import sys
+
+from harness.sites import KINDS, read_dump, merge, symbolize, top_sites
+
+USAGE = 'usage: %prog [options] DUMP...'
+DESCRIPTION = 'Lists the call sites that execute the most run-time checks. The dumps are ' + \
+              'written by rtccounter when a benchmark runs with RTCC_SITES=path (a %p in ' + \
+              'the path is replaced by the pid), e.g. by test-spec.py --sites DIR.'
+
+if __name__ == '__main__':
+  parser = optparse.OptionParser(usage=USAGE, description=DESCRIPTION)
+  parser.add_option("-n", "--top", dest="top", type="int", default=20,
+                    help="Number of sites listed per kind of check", metavar="N")
+  parser.add_option("-k", "--kind", dest="kinds", action="append", default=None,
+                    help="Only list this kind of check, e.g. 'fast load checks' (repeatable)",
+                    metavar="KIND")
+  parser.add_option("--no-symbolize", action="store_false", dest="symbolize", default=True,
+                    help="Print module offsets instead of running addr2line")
+  (options, args) = parser.parse_args()
+  if not args:
+    parser.print_help()
+    exit()
+
+  counts, dropped = merge([read_dump(path) for path in args])
+  kinds = options.kinds or KINDS
+  for kind in kinds:
+    if kind not in KINDS:
+      parser.error('unknown kind of check: %s' % kind)
+
+  listed = dict((kind, top_sites(counts, KINDS.index(kind), options.top)) for kind in kinds)
+  names = {}
+  if options.symbolize:
+    offsets = {}
+    for sites in listed.values():
+      for (module, offset), _ in sites:
+        offsets.setdefault(module, set()).add(offset)
+    for module, module_offsets in offsets.items():
+      for offset, name in symbolize(module, sorted(module_offsets)).items():
+        names[(module, offset)] = name
+
+  for kind in kinds:
+    sites = listed[kind]
+    if not sites:
+      continue
+    total = sum(count for (_, _, k), count in counts.items() if k == KINDS.index(kind))
+    sys.stdout.write('%s: %d calls from %d sites\n' %
+                     (kind, total, len([k for k in counts if k[2] == KINDS.index(kind)])))
+    for site, count in sites:
+      module, offset = site
+      location = names.get(site, '%s+0x%x' % (module, offset))
+      sys.stdout.write('  %12d %5.1f%%  %s\n' % (count, 100.0 * count / total, location))
+    sys.stdout.write('\n')
+  if dropped:
+    sys.stdout.write('%d calls not attributed (site table full, raise RTCC_SITES_BITS)\n' % dropped)
@@ -1,18 +1,375 @@
+#include <fcntl.h>
+#include <pthread.h>
 #include <stddef.h>
+#include <stdint.h>
 #include <stdio.h>
 #include <stdlib.h>
+#include <string.h>
+#include <sys/mman.h>
+#include <unistd.h>
+
+// Single-threaded benchmarks are not linked with -lpthread; without it
+// these are null and thread exit is simply not tracked. pthread_atfork is
+// not in libc.so either, forks are then tracked through __register_atfork,
+// which glibc's libc.so exports and pthread_atfork wraps.
+#pragma weak pthread_key_create
+#pragma weak pthread_setspecific
+#pragma weak pthread_atfork
+extern "C" int __register_atfork(void (*)(void), void (*)(void), void (*)(void), void *)
+    __attribute__((weak));
 
 namespace {
-  long long LoadChecks, StoreChecks;
-  long long FastLoadChecks, FastStoreChecks;
-  long long FastLoadFailures, FastStoreFailures;
-  long long GlobalRegistrations, StackRegistrations;
-
-  void printSummary(FILE *F) {
-    long long GenericChecks = LoadChecks + StoreChecks;
-    long long FastChecks = FastLoadChecks + FastStoreChecks;
-    long long FastFailureCalls = FastLoadFailures + FastStoreFailures;
-    long long MemoryRegistrations = GlobalRegistrations + StackRegistrations;
+  // Opt-in size histograms (RTCC_HISTOGRAMS=1), bucketed by log2: bucket 0
+  // counts size 0, bucket K counts sizes in [2^(K-1), 2^K).
+  enum Histogram {
+    AccessSizes,            // all load/store checks
+    ObjectSizes,            // fast load/store checks
+    StackRegistrationSizes,
+    GlobalRegistrationSizes,
+    NumHistograms
+  };
+  const unsigned HistogramBuckets = 65;
+  const char *const HistogramNames[NumHistograms] = {
+    "access", "object", "stack registration", "global registration"
+  };
+
+  // Every thread counts into its own block, which sits on its own cache line
+  // so that counting does not bounce lines between cores. Blocks of live
+  // threads are linked into a list; when a thread exits, its counts are
+  // folded into Retired.
+  struct CounterBlock {
+    long long LoadChecks, StoreChecks;
+    long long FastLoadChecks, FastStoreChecks;
+    long long FastLoadFailures, FastStoreFailures;
+    long long GlobalRegistrations, StackRegistrations;
+    long long Sizes[NumHistograms][HistogramBuckets];
+    CounterBlock *Next;
+  } __attribute__((aligned(64)));
+
+  // Opt-in live counters (RTCC_LIVE=path): the blocks are carved out of a
+  // shared mapping of the file instead of thread-local storage, so that
+  // other processes can read them while the benchmark runs and the counts
+  // stay in the file if it dies. Slots are never reused, so the counts of a
+  // file are the sum over all its slots.
+  enum LiveState { LiveRunning, LiveExited, LiveFailed };
+
+  struct LiveHeader {
+    char Magic[8];
+    uint32_t Version;
+    uint32_t HeaderSize;
+    uint32_t SlotSize;
+    uint32_t Slots;
+    volatile uint32_t UsedSlots;
+    volatile uint32_t Unmapped;   // threads that found no free slot
+    int32_t PID;
+    volatile uint32_t State;
+  } __attribute__((aligned(64)));
+
+  const char LiveMagic[8] = {'R', 'T', 'C', 'C', 'L', 'I', 'V', 'E'};
+  const uint32_t LiveVersion = 2;
+  const unsigned DefaultLiveSlots = 64;
+
+  __thread CounterBlock Local;
+  __thread CounterBlock *Current;
+
+  CounterBlock *Blocks;
+  CounterBlock Retired;
+  volatile int Lock;
+  pthread_key_t ExitKey;
+  bool HaveExitKey;
+  bool LiveInitialized;
+  LiveHeader *Live;
+  CounterBlock *LiveSlots;
+
+  void initLive();
+
+  void lock() {
+    while (__sync_lock_test_and_set(&Lock, 1))
+      while (Lock)
+        ;
+  }
+
+  void unlock() {
+    __sync_lock_release(&Lock);
+  }
+
+  void add(CounterBlock &To, const CounterBlock &From) {
+    To.LoadChecks += From.LoadChecks;
+    To.StoreChecks += From.StoreChecks;
+    To.FastLoadChecks += From.FastLoadChecks;
+    To.FastStoreChecks += From.FastStoreChecks;
+    To.FastLoadFailures += From.FastLoadFailures;
+    To.FastStoreFailures += From.FastStoreFailures;
+    To.GlobalRegistrations += From.GlobalRegistrations;
+    To.StackRegistrations += From.StackRegistrations;
+    for (unsigned H = 0; H < NumHistograms; ++H)
+      for (unsigned I = 0; I < HistogramBuckets; ++I)
+        To.Sizes[H][I] += From.Sizes[H][I];
+  }
+
+  void retireBlock(void *Arg) {
+    CounterBlock *B = static_cast<CounterBlock *>(Arg);
+    lock();
+    add(Retired, *B);
+    for (CounterBlock **I = &Blocks; *I; I = &(*I)->Next) {
+      if (*I == B) {
+        *I = B->Next;
+        break;
+      }
+    }
+    unlock();
+  }
+
+  CounterBlock *registerBlock() {
+    CounterBlock *B = &Local;
+    lock();
+    if (!HaveExitKey && pthread_key_create)
+      HaveExitKey = !pthread_key_create(&ExitKey, retireBlock);
+    // checks may run in static constructors before ours
+    if (!LiveInitialized)
+      initLive();
+    if (Live) {
+      if (Live->UsedSlots < Live->Slots)
+        B = &LiveSlots[Live->UsedSlots++];
+      else
+        ++Live->Unmapped;
+    }
+    B->Next = Blocks;
+    Blocks = B;
+    unlock();
+    if (HaveExitKey)
+      pthread_setspecific(ExitKey, B);
+    Current = B;
+    return B;
+  }
+
+  inline CounterBlock &counters() {
+    CounterBlock *B = Current;
+    if (__builtin_expect(!B, 0))
+      B = registerBlock();
+    return *B;
+  }
+
+  bool Histograms;
+
+  void initHistograms() {
+    const char *H = getenv("RTCC_HISTOGRAMS");
+    Histograms = H && *H && strcmp(H, "0");
+  }
+
+  inline void countSize(CounterBlock &B, Histogram H, size_t Size) {
+    if (__builtin_expect(Histograms, 0))
+      ++B.Sizes[H][Size ? 64 - __builtin_clzll(Size) : 0];
+  }
+
+  // Expands %p in an RTCC_* path to the pid.
+  void expandPath(char *Path, size_t Size, const char *Pattern) {
+    const char *PID = strstr(Pattern, "%p");
+    if (PID)
+      snprintf(Path, Size, "%.*s%d%s", int(PID - Pattern), Pattern,
+               int(getpid()), PID + 2);
+    else
+      snprintf(Path, Size, "%s", Pattern);
+  }
+
+  void initLive() {
+    LiveInitialized = true;
+    const char *Pattern = getenv("RTCC_LIVE");
+    if (!Pattern)
+      return;
+    unsigned Slots = DefaultLiveSlots;
+    if (const char *S = getenv("RTCC_LIVE_SLOTS"))
+      Slots = atoi(S);
+    if (Slots < 1 || Slots > 65536)
+      Slots = DefaultLiveSlots;
+    char Path[4096];
+    expandPath(Path, sizeof(Path), Pattern);
+    size_t Size = sizeof(LiveHeader) + Slots * sizeof(CounterBlock);
+    int FD = open(Path, O_RDWR | O_CREAT | O_TRUNC, 0644);
+    if (FD < 0)
+      return;
+    if (ftruncate(FD, Size)) {
+      close(FD);
+      return;
+    }
+    void *Map = mmap(0, Size, PROT_READ | PROT_WRITE, MAP_SHARED, FD, 0);
+    close(FD);
+    if (Map == MAP_FAILED)
+      return;
+    // the file is zero-filled, the header is written last
+    LiveHeader *H = static_cast<LiveHeader *>(Map);
+    H->Version = LiveVersion;
+    H->HeaderSize = sizeof(LiveHeader);
+    H->SlotSize = sizeof(CounterBlock);
+    H->Slots = Slots;
+    H->PID = getpid();
+    H->State = LiveRunning;
+    __sync_synchronize();
+    memcpy(H->Magic, LiveMagic, sizeof(LiveMagic));
+    LiveSlots = reinterpret_cast<CounterBlock *>(H + 1);
+    Live = H;
+  }
+
+  // A process that forks without exec would keep counting into the slots
+  // of its parent's live file, racing with it, and mark the parent exited
+  // at its own exit. The child starts over instead: it drops the parent's
+  // blocks and mapping and opens a file of its own (the path has %p) on its
+  // first check. Only the forking thread survives in the child.
+  void forkedChild() {
+    Lock = 0;
+    if (!Live)
+      return;
+    Blocks = 0;
+    Retired = CounterBlock();
+    Current = 0;
+    if (HaveExitKey)
+      pthread_setspecific(ExitKey, 0);
+    munmap(Live, Live->HeaderSize + size_t(Live->Slots) * Live->SlotSize);
+    Live = 0;
+    LiveSlots = 0;
+    LiveInitialized = false;
+  }
+
+  // The first state change wins: exit(1) in a failed check still runs the
+  // destructor, which must not overwrite LiveFailed.
+  void setLiveState(LiveState State) {
+    if (Live)
+      __sync_bool_compare_and_swap(&Live->State, LiveRunning, State);
+  }
+
+  // Opt-in per-call-site counts (RTCC_SITES=path). Sites are keyed by the
+  // return address of the check call and the check kind, and live in a
+  // fixed-size open-addressing table that is filled with compare-and-swap.
+  enum SiteKind {
+    KindLoad, KindStore, KindFastLoad, KindFastStore,
+    KindFastLoadFailure, KindFastStoreFailure,
+    KindGlobalRegistration, KindStackRegistration
+  };
+
+  struct SiteEntry {
+    uint64_t Key;    // return address << 4 | kind, 0 if unused
+    uint64_t Count;
+  };
+
+  const char SitesMagic[8] = {'R', 'T', 'C', 'C', 'S', 'I', 'T', 'E'};
+  const uint32_t SitesVersion = 1;
+  const unsigned DefaultSiteBits = 16;
+
+  SiteEntry *Sites;
+  uint64_t SiteMask;
+  uint64_t DroppedSites;
+
+  void initSites() {
+    if (!getenv("RTCC_SITES"))
+      return;
+    unsigned Bits = DefaultSiteBits;
+    if (const char *B = getenv("RTCC_SITES_BITS"))
+      Bits = atoi(B);
+    if (Bits < 4 || Bits > 28)
+      Bits = DefaultSiteBits;
+    SiteEntry *Table = static_cast<SiteEntry *>(calloc(1UL << Bits, sizeof(SiteEntry)));
+    if (!Table)
+      return;
+    SiteMask = (1UL << Bits) - 1;
+    Sites = Table;
+  }
+
+  __attribute__((noinline)) void recordSite(SiteKind Kind, void *Address) {
+    uint64_t Key = (uint64_t(uintptr_t(Address)) << 4) | Kind;
+    uint64_t I = (Key * 0x9E3779B97F4A7C15ULL) >> 20;
+    for (uint64_t Probe = 0; Probe <= SiteMask; ++Probe, ++I) {
+      SiteEntry &E = Sites[I & SiteMask];
+      uint64_t Old = E.Key;
+      if (Old == 0)
+        Old = __sync_val_compare_and_swap(&E.Key, 0, Key);
+      if (Old == 0 || Old == Key) {
+        __sync_fetch_and_add(&E.Count, 1);
+        return;
+      }
+    }
+    __sync_fetch_and_add(&DroppedSites, 1);
+  }
+
+  inline void countSite(SiteKind Kind, void *Address) {
+    if (__builtin_expect(Sites != 0, 0))
+      recordSite(Kind, Address);
+  }
+
+  bool writeAll(int FD, const void *Data, size_t Size) {
+    const char *P = static_cast<const char *>(Data);
+    while (Size) {
+      ssize_t N = write(FD, P, Size);
+      if (N <= 0)
+        return false;
+      P += N;
+      Size -= N;
+    }
+    return true;
+  }
+
+  // Dump format (native byte order): magic, version, number of entries,
+  // number of dropped calls, length of the memory map text, the contents of
+  // /proc/self/maps for symbolization, then (address, kind, count) records.
+  void dumpSites() {
+    if (!Sites)
+      return;
+    char Path[4096];
+    expandPath(Path, sizeof(Path), getenv("RTCC_SITES"));
+
+    size_t MapsSize = 0, MapsCapacity = 1 << 16;
+    char *Maps = static_cast<char *>(malloc(MapsCapacity));
+    if (FILE *M = fopen("/proc/self/maps", "r")) {
+      size_t N;
+      while (Maps && (N = fread(Maps + MapsSize, 1, MapsCapacity - MapsSize, M)) > 0) {
+        MapsSize += N;
+        if (MapsSize == MapsCapacity) {
+          // out of memory: symbolize with what was read so far
+          char *Grown = static_cast<char *>(realloc(Maps, MapsCapacity * 2));
+          if (!Grown)
+            break;
+          Maps = Grown;
+          MapsCapacity *= 2;
+        }
+      }
+      fclose(M);
+    }
+    if (!Maps)
+      MapsSize = 0;
+
+    uint64_t Entries = 0;
+    for (uint64_t I = 0; I <= SiteMask; ++I)
+      Entries += Sites[I].Key != 0;
+
+    int FD = open(Path, O_WRONLY | O_CREAT | O_TRUNC, 0644);
+    if (FD < 0) {
+      free(Maps);
+      return;
+    }
+    uint32_t Version = SitesVersion, Reserved = 0;
+    uint64_t Length = MapsSize;
+    bool OK = writeAll(FD, SitesMagic, sizeof(SitesMagic)) &&
+              writeAll(FD, &Version, sizeof(Version)) &&
+              writeAll(FD, &Reserved, sizeof(Reserved)) &&
+              writeAll(FD, &Entries, sizeof(Entries)) &&
+              writeAll(FD, &DroppedSites, sizeof(DroppedSites)) &&
+              writeAll(FD, &Length, sizeof(Length)) &&
+              writeAll(FD, Maps, MapsSize);
+    for (uint64_t I = 0; OK && I <= SiteMask; ++I) {
+      if (!Sites[I].Key)
+        continue;
+      uint64_t Record[3] = {Sites[I].Key >> 4, Sites[I].Key & 15, Sites[I].Count};
+      OK = writeAll(FD, Record, sizeof(Record));
+    }
+    close(FD);
+    free(Maps);
+  }
+
+  void printSummary(FILE *F, const CounterBlock &C) {
+    long long GenericChecks = C.LoadChecks + C.StoreChecks;
+    long long FastChecks = C.FastLoadChecks + C.FastStoreChecks;
+    long long FastFailureCalls = C.FastLoadFailures + C.FastStoreFailures;
+    long long MemoryRegistrations = C.GlobalRegistrations
+                                  + C.StackRegistrations;
     long long Sum = GenericChecks + FastChecks + FastFailureCalls
                   + MemoryRegistrations;
 
@@ -24,88 +381,150 @@ namespace {
     fprintf(F, "%lld generic load/store checks called (%d%%)\n",
             GenericChecks, int(100 * GenericChecks / Sum));
     if (GenericChecks) {
-      fprintf(F, "  %lld generic load checks\n", LoadChecks);
-      fprintf(F, "  %lld generic store checks\n", StoreChecks);
+      fprintf(F, "  %lld generic load checks\n", C.LoadChecks);
+      fprintf(F, "  %lld generic store checks\n", C.StoreChecks);
     }
 
     fprintf(F, "%lld fast load/store checks called (%d%%)\n",
             FastChecks, int(100 * FastChecks / Sum));
     if (FastChecks) {
-      fprintf(F, "  %lld fast load checks\n", FastLoadChecks);
-      fprintf(F, "  %lld fast store checks\n", FastStoreChecks);
+      fprintf(F, "  %lld fast load checks\n", C.FastLoadChecks);
+      fprintf(F, "  %lld fast store checks\n", C.FastStoreChecks);
     }
 
     fprintf(F, "%lld fast check failures reported (%d%%)\n",
             FastFailureCalls, int(100 * FastChecks / Sum));
     if (FastFailureCalls) {
       fprintf(F, "  %lld fast load check failures reported\n",
-              FastLoadFailures);
+              C.FastLoadFailures);
       fprintf(F, "  %lld fast store check failures reported\n",
-              FastStoreFailures);
+              C.FastStoreFailures);
     }
 
     fprintf(F, "%lld memory registration calls (%d%%)\n",
             MemoryRegistrations, int(100 * MemoryRegistrations / Sum));
     if (MemoryRegistrations) {
       fprintf(F, "  %lld global registration calls\n",
-              GlobalRegistrations);
+              C.GlobalRegistrations);
       fprintf(F, "  %lld stack registration calls\n",
-              StackRegistrations);
+              C.StackRegistrations);
+    }
+
+    for (unsigned H = 0; H < NumHistograms; ++H) {
+      for (unsigned I = 0; I < HistogramBuckets; ++I) {
+        if (!C.Sizes[H][I])
+          continue;
+        unsigned long long Low = I ? 1ULL << (I - 1) : 0;
+        unsigned long long High = I ? Low * 2 - 1 : 0;
+        if (Low == High)
+          fprintf(F, "  %lld %s sizes of %llu bytes\n", C.Sizes[H][I],
+                  HistogramNames[H], Low);
+        else
+          fprintf(F, "  %lld %s sizes of %llu-%llu bytes\n", C.Sizes[H][I],
+                  HistogramNames[H], Low, High);
+      }
     }
 
     fprintf(F, "\n");
   }
 
   void printReport() {
+    // threads that are still running are included with their counts so far
+    CounterBlock Total = CounterBlock();
+    lock();
+    add(Total, Retired);
+    for (CounterBlock *B = Blocks; B; B = B->Next)
+      add(Total, *B);
+    unlock();
+
     if (const char *path = getenv("RTCC_PATH")) {
       FILE *F = fopen(path, "w");
-      printSummary(F);
+      printSummary(F, Total);
       fclose(F);
     } else {
-      printSummary(stderr);
+      printSummary(stderr, Total);
     }
   }
 
   struct RuntimeCheckCounter {
+    RuntimeCheckCounter() {
+      lock();
+      if (!LiveInitialized)
+        initLive();
+      unlock();
+      if (pthread_atfork)
+        pthread_atfork(0, 0, forkedChild);
+      else if (__register_atfork)
+        __register_atfork(0, 0, forkedChild, 0);
+      initSites();
+      initHistograms();
+    }
+
     ~RuntimeCheckCounter() {
       printReport();
+      dumpSites();
+      setLiveState(LiveExited);
     }
   } X;
 }
 
 extern "C" {
   void __loadcheck(void*ptr, size_t size) {
-    ++LoadChecks;
+    CounterBlock &B = counters();
+    ++B.LoadChecks;
+    countSize(B, AccessSizes, size);
+    countSite(KindLoad, __builtin_return_address(0));
   }
 
   void __storecheck(void *ptr, size_t size) {
-    ++StoreChecks;
+    CounterBlock &B = counters();
+    ++B.StoreChecks;
+    countSize(B, AccessSizes, size);
+    countSite(KindStore, __builtin_return_address(0));
   }
 
   void __fastloadcheck(void *ptr, size_t size, void *obj, size_t obj_size) {
-    ++FastLoadChecks;
+    CounterBlock &B = counters();
+    ++B.FastLoadChecks;
+    countSize(B, AccessSizes, size);
+    countSize(B, ObjectSizes, obj_size);
+    countSite(KindFastLoad, __builtin_return_address(0));
   }
 
   void __faststorecheck(void *ptr, size_t size, void *obj, size_t obj_size) {
-    ++FastStoreChecks;
+    CounterBlock &B = counters();
+    ++B.FastStoreChecks;
+    countSize(B, AccessSizes, size);
+    countSize(B, ObjectSizes, obj_size);
+    countSite(KindFastStore, __builtin_return_address(0));
   }
 
   void __fail_fastloadcheck(void *ptr, size_t size, void *obj, size_t obj_size) {
-    ++FastLoadFailures;
+    ++counters().FastLoadFailures;
+    countSite(KindFastLoadFailure, __builtin_return_address(0));
+    setLiveState(LiveFailed);
     exit(1);
   }
 
   void __fail_faststorecheck(void *ptr, size_t size, void *obj, size_t obj_size) {
-    ++FastStoreFailures;
+    ++counters().FastStoreFailures;
+    countSite(KindFastStoreFailure, __builtin_return_address(0));
+    setLiveState(LiveFailed);
     exit(1);
   }
 
   void __pool_register_global(void *ptr, size_t size) {
-    ++GlobalRegistrations;
+    CounterBlock &B = counters();
+    ++B.GlobalRegistrations;
+    countSize(B, GlobalRegistrationSizes, size);
+    countSite(KindGlobalRegistration, __builtin_return_address(0));
   }
 
   void __pool_register_stack(void *ptr, size_t size) {
-    ++StackRegistrations;
+    CounterBlock &B = counters();
+    ++B.StackRegistrations;
+    countSize(B, StackRegistrationSizes, size);
+    countSite(KindStackRegistration, __builtin_return_address(0));
   }
 
   void __pool_unregister_stack(void *ptr) {
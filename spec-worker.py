@@ -0,0 +1,58 @@
+import optparse
+import signal
+import sys
+import os
+
+from harness.executor import available_cpus
+from harness.remote import WorkerContext, WorkerServer, parse_address, PORT
+
+PROCESSORS = available_cpus()
+TEMP_DIR = os.getcwd() + '/test-spec-temp'
+BUILD_CACHE_DIR = TEMP_DIR + '/build-cache'
+WORKSPACE_DIR = TEMP_DIR + '/workspaces'
+
+USAGE = 'usage: %prog [options] SPEC_PATH'
+DESCRIPTION = 'Worker daemon for test-spec.py and benchmark-asan-spec.py --workers: ' + \
+              'builds and runs the benchmarks of SPEC_PATH for its coordinators and ' + \
+              'sends back the results (see harness/remote.py).  It runs any make ' + \
+              'command it is sent, so only listen on trusted networks.'
+
+if __name__ == '__main__':
+  parser = optparse.OptionParser(usage=USAGE, description=DESCRIPTION)
+  parser.add_option("-l", "--listen", dest="listen", default='localhost:%d' % PORT,
+                    help="Address to listen on, e.g. :%d for all interfaces" % PORT,
+                    metavar="HOST:PORT")
+  parser.add_option("-j", "--jobs", dest="jobs", type="int", default=PROCESSORS,
+                    help="Number of tasks run at once", metavar="JOBS")
+  parser.add_option("--name", dest="name", default=None,
+                    help="Name of this worker in the coordinator's messages", metavar="NAME")
+  parser.add_option("--map", dest="maps", action="append", default=[],
+                    help="Replace the coordinator's path prefix FROM by TO in the tasks, e.g. " +
+                         "for its compiler and librtccounter.a (repeatable)",
+                    metavar="FROM=TO")
+  parser.add_option("--build-cache", dest="build_cache", default=BUILD_CACHE_DIR,
+                    help="Directory of cached builds", metavar="DIR")
+  parser.add_option("--workspaces", dest="workspaces", default=WORKSPACE_DIR,
+                    help="Directory of the build and run workspaces, e.g. on tmpfs", metavar="DIR")
+  (options, args) = parser.parse_args()
+  if len(args) < 1:
+    parser.print_help()
+    exit()
+
+  maps = []
+  for text in options.maps:
+    if '=' not in text:
+      parser.error('--map expects FROM=TO, not %s' % text)
+    maps.append(tuple(text.split('=', 1)))
+  try:
+    address = parse_address(options.listen, '')
+  except ValueError as e:
+    parser.error(str(e))
+
+  context = WorkerContext(os.path.abspath(args[0]), options.workspaces, options.build_cache, maps)
+  # a terminated worker takes its jobs with it
+  signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+  try:
+    WorkerServer(context, address, options.jobs, options.name).serve()
+  except KeyboardInterrupt:
+    sys.stderr.write('\n')
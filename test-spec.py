@@ -1,27 +1,56 @@
-import multiprocessing
 import subprocess
 import optparse
-import time
+import tempfile
+import shutil
+import json
 import sys
 import os
+from cStringIO import StringIO
+
+from harness.buildcache import BuildCache, snapshot, write_atomic
+from harness.durations import DurationIndex
+from harness.executor import TaskGraph, available_cpus
+from harness.jobserver import Jobserver
+from harness.live import run_sampled, add_summaries, rates, stable_since
+from harness.progress import Progress
+from harness.reduced import InputScales, REF, decide, reduced_sizes, runtime_counts, \
+                            scaled_summary, script_name
+from harness.remote import WorkerPool, parse_address, RETRIES
+from harness.reports import Parser, format_report
+from harness.resultcache import ResultCache, MAX_AGE_DAYS, MAX_SIZE_MB
+from harness.resultdb import ResultDB, build_identity
+from harness.rusage import run_measured
+from harness.spec import find_spec_names, make_command
+from harness.summarytable import SummaryTable, format_mini_summary_row
+from harness.sweep import Configuration, load_sweep
+from harness.workspace import Workspace, workspace_label
 
 CFLAGS = '-O2 -std=gnu89 -fmemory-access-instrumentation'
 CFLAGS += ' ' + os.getcwd() + '/rtccounter/librtccounter.a'
 CXXFLAGS = CFLAGS
-PYTHON = sys.executable
-COMBINE_MSCC_PATH = 'combine-mscc-reports.py'
-PROCESSORS = multiprocessing.cpu_count()
+PROCESSORS = available_cpus()
 TEMP_DIR = os.getcwd() + '/test-spec-temp'
+BUILD_CACHE_DIR = TEMP_DIR + '/build-cache'
+RESULT_CACHE_DIR = TEMP_DIR + '/result-cache'
+WORKSPACE_DIR = TEMP_DIR + '/workspaces'
+RESULT_DB = TEMP_DIR + '/results.db'
+DURATION_INDEX = TEMP_DIR + '/durations.json'
+LIVE_FINAL = TEMP_DIR + '/live-final.txt'
+INPUT_SCALES = TEMP_DIR + '/input-scales.json'
 
-# General benchmarking (Mode AllOff or AllNewOn)
-OPTIMIZATIONS = ['opt1', 'opt2', 'opt3']
-LAST_HEADERS = ['num optimized total', 'run-time checks before opt', 'run-time checks avoided']
-
-# Comparison with ASan (Mode ASanOnly or ASanComparison)
-#OPTIMIZATIONS = ['opt0', 'opt2', 'opt1', 'opt3']
-#LAST_HEADERS = ['num optimized total', 'run-time checks with ASan', 'extra run-time checks avoided']
+# Columns of the final table: the optimizations in opt_progress order and the
+# last headers, by --table or the "table" of a final in a sweep file
+TABLES = {
+  # General benchmarking (Mode AllOff or AllNewOn)
+  'general': (['opt1', 'opt2', 'opt3'],
+              ['num optimized total', 'run-time checks before opt', 'run-time checks avoided']),
+  # Comparison with ASan (Mode ASanOnly or ASanComparison)
+  'asan': (['opt0', 'opt2', 'opt1', 'opt3'],
+           ['num optimized total', 'run-time checks with ASan', 'extra run-time checks avoided']),
+}
 
-USAGE = 'usage: %prog [options] SPEC_PATH CLANG_BIN_DIR'
+USAGE = 'usage: %prog [options] SPEC_PATH CLANG_BIN_DIR\n' + \
+        '       %prog [options] --sweep FILE SPEC_PATH [CLANG_BIN_DIR]'
 DESCRIPTION = 'The easy way to get both compile-time and run-time statistics is as follows:\n' + \
               '* Build rtccounter (included in this repository)\n' + \
               '* Build LLVM/Clang as usual\n' + \
@@ -31,102 +60,299 @@ DESCRIPTION = 'The easy way to get both compile-time and run-time statistics is
               '* Set the Mode variable to AllOff.\n' + \
               '* Rebuild the modified LLVM/Clang\n' + \
               '* Run this script with -f\n' + \
-              '* Revert any changes in BackendUtil.cpp\n'
-
-class WorkerProcess(multiprocessing.Process):
-  def __init__(self, name, Q, execute, prefix, use_old, spec_path, clang_bin_dir):
-    super(WorkerProcess, self).__init__()
-    self.name = name
-    self.execute = execute
-    self.Q = Q
-    self.prefix = prefix
-    self.use_old = use_old
-    self.spec_path = spec_path
-    self.clang_bin_dir = clang_bin_dir
-
-  def run(self):
-    name = self.name
-    init_path = self.spec_path + '/' + name + '/'
-    src_path = init_path + 'src/'
-    out_path = self.prefix + name + '-raw.txt'
-    clean_path = self.prefix + name + '.txt'
-    if os.path.exists(clean_path) and self.use_old:
-      sys.stderr.write('found old %s\n' % name)
-      self.Q.put_nowait(open(clean_path).read())
-      return
+              '* Revert any changes in BackendUtil.cpp\n' + \
+              '\n' + \
+              'With one LLVM/Clang build per Mode, --sweep FILE does all of this in one\n' + \
+              'run: every benchmark is built and run under every configuration of FILE\n' + \
+              'and the final tables of FILE are generated (see harness/sweep.py).\n' + \
+              '\n' + \
+              'With -f or the finals of a sweep, the final tables are kept up to date in\n' + \
+              'test-spec-temp/live-final.txt while the benchmarks run.\n' + \
+              '\n' + \
+              'With --reduced test,train, benchmarks with run-test.sh and run-train.sh\n' + \
+              'scripts are run on those inputs and their run-time counts extrapolated to\n' + \
+              'the reference inputs; uncalibrated or unstable ones get a full run.\n'
 
-    sys.stderr.write('start %s\n' % name)
+def build_command(clang_bin_dir, cflags):
+  if not cflags:
+    return make_command(clang_bin_dir, CFLAGS, CXXFLAGS)
+  return make_command(clang_bin_dir, CFLAGS + ' ' + cflags, CXXFLAGS + ' ' + cflags)
 
-    try:
-      clang_bin = self.clang_bin_dir + '/clang'
-      args = ['make']
-      args.append('CC=' + self.clang_bin_dir + '/clang')
-      args.append('CXX=' + self.clang_bin_dir + '/clang++')
-      args.append('CFLAGS=' + CFLAGS)
-      args.append('CXXFLAGS=' + CXXFLAGS)
-      subprocess.check_call(args, stderr=subprocess.STDOUT, stdout=open(out_path, 'w'), cwd=src_path)
-      if self.execute:
-        subprocess.check_call([init_path + 'run.sh'], stderr=open(out_path, 'a'), stdout=subprocess.PIPE, shell=True, cwd=init_path)
-
-      subprocess.check_call([PYTHON, COMBINE_MSCC_PATH], stdin = open(out_path), stdout=open(clean_path, 'w'))
-      self.Q.put_nowait(open(clean_path).read())
-      os.remove(out_path)
-    except:
-      self.Q.put_nowait('')
-      sys.stderr.write('fail %s\n' % name)
-      raise
-    sys.stderr.write('end %s\n' % name)
-
-def generate_final(names, unopt_prefix, opt_prefix, both_prefix):
-  info = [[]]
-  for i in xrange(len(names)):
-    unopt_path = TEMP_DIR + '/' + unopt_prefix + names[i] + '.txt'
-    opt_path = TEMP_DIR + '/' + opt_prefix + names[i] + '.txt'
-    both_path = TEMP_DIR + '/' + both_prefix + names[i] + '.txt'
-    if not os.path.exists(unopt_path) or not os.path.exists(opt_path):
-      # at least one is missing
-      if not os.path.exists(unopt_path):
-        sys.stderr.write('Unoptimized %s results missing (%s)\n' % (names[i], unopt_path))
-      if not os.path.exists(opt_path):
-        sys.stderr.write('Optimized %s results missing (%s)\n' % (names[i], opt_path))
-      continue
+def compile_benchmark(name, out_path, workspace, clang_bin_dir, cflags, cache_dir):
+  src_path = workspace.src_path
+  args = build_command(clang_bin_dir, cflags)
+  lock = workspace.lock()
+  try:
+    workspace.prepare()
+    workspace.clean()
+    cache = BuildCache(cache_dir) if cache_dir else None
+    if cache:
+      key = cache.key(src_path, args, clang_bin_dir)
+      log = cache.restore(key, src_path)
+      if log is not None:
+        file = open(out_path, 'w')
+        file.write(log)
+        file.close()
+        return out_path
+      before = snapshot(src_path)
+    subprocess.check_call(args, stderr=subprocess.STDOUT, stdout=open(out_path, 'w'), cwd=src_path)
+    if cache:
+      cache.store(key, src_path, before, out_path)
+  finally:
+    lock.release()
+  return out_path
+
+def run_benchmark(label, workspace, run_env, sites_dir, live_interval, out_path, build_log):
+  # builds may be shared by several configurations, so they log to files of their own
+  shutil.copyfile(build_log, out_path)
+  rusage_path = out_path[:-len('-raw.txt')] + '-rusage.json'
+  if os.path.exists(rusage_path):
+    os.remove(rusage_path)
+  env = dict(os.environ, **run_env) if run_env else None
+  if sites_dir:
+    # rtccounter replaces %p by the pid, so every process gets its own dump
+    env = dict(env or os.environ, RTCC_SITES=os.path.abspath(sites_dir) + '/' + label + '-%p.sites')
+  run_dir = workspace.acquire_run_dir()
+  try:
+    init_path = run_dir.path
+    if live_interval:
+      return run_benchmark_live(label, init_path, env, live_interval, out_path)
+    record = run_measured([init_path + 'run.sh'], init_path, stderr=open(out_path, 'a'), env=env)
+  finally:
+    run_dir.release()
+  file = open(rusage_path, 'w')
+  json.dump(record, file, indent=1, sort_keys=True)
+  file.close()
+  return out_path
+
+def run_benchmark_reduced(label, name, config_name, workspace, run_env, sizes, tolerance, out_path,
+                          build_log):
+  """Count on the reduced inputs and extrapolate to the reference inputs, or
+  fall back to a full run, which calibrates later extrapolations (see
+  harness/reduced.py).  A failing reduced input also gets a full run.  The
+  decision is kept in -reduced.json."""
+  reduced_path = out_path[:-len('-raw.txt')] + '-reduced.json'
+  rusage_path = out_path[:-len('-raw.txt')] + '-rusage.json'
+  if os.path.exists(rusage_path):
+    os.remove(rusage_path)
+  env = dict(os.environ, **run_env) if run_env else None
+  available = reduced_sizes(workspace.spec_dir, sizes)
+  summaries = {}
+  counts = {}
+  failed = None
+  run_dir = workspace.acquire_run_dir()
+  try:
+    for size in available:
+      log = tempfile.TemporaryFile()
+      try:
+        run_measured([run_dir.path + script_name(size)], run_dir.path, stderr=log, env=env)
+      except subprocess.CalledProcessError as e:
+        failed = 'the %s input failed with status %d' % (size, e.returncode)
+        break
+      finally:
+        log.seek(0)
+        report = log.read()
+        log.close()
+      summaries[size] = Parser(StringIO(report)).runtime
+      counts[size] = runtime_counts(summaries[size])
+  finally:
+    run_dir.release()
+
+  scales = InputScales(INPUT_SCALES)
+  if failed:
+    estimate, error, reason = None, None, failed
+  else:
+    estimate, error, reason = decide(counts, available, scales.lookup(name, config_name, available),
+                                     tolerance)
+  info = {'inputs': available, 'counts': counts, 'error': error}
+  if estimate is not None:
+    # the report of the build plus the extrapolated run-time report
+    shutil.copyfile(build_log, out_path)
+    log = open(out_path, 'a')
+    scaled_summary(summaries[available[-1]], estimate).print_report(out = log)
+    log.close()
+    info.update(extrapolated_from=available[-1], estimate=estimate)
+  else:
+    run_benchmark(label, workspace, run_env, None, None, out_path, build_log)
+    if len(available) >= 2 and not failed:
+      counts[REF] = runtime_counts(Parser(open(out_path)).runtime)
+      scales.record(name, config_name, counts)
+    info['full_run'] = reason
+  file = open(reduced_path, 'w')
+  json.dump(info, file, indent=1, sort_keys=True)
+  file.close()
+  return out_path
+
+def run_benchmark_live(name, init_path, env, live_interval, out_path):
+  """Run with live counters, keeping a time series of the check counts.
 
-    subprocess.check_call([PYTHON, COMBINE_MSCC_PATH, unopt_path, opt_path], stdout=open(both_path, 'w'))
-    info.append([names[i]] + open(both_path).read().strip().split(' | '))
+  Processes that die without reaching the rtccounter destructor leave their
+  counts in the live files only; those are appended to the raw log.  A
+  failing run is then still reported from the counts it got to."""
+  live_dir = out_path[:-len('-raw.txt')] + '-live'
+  log = open(out_path, 'a')
+  status, series, files = run_sampled([init_path + 'run.sh'], init_path, live_dir, live_interval,
+                                      env=env, stderr=log, stdout=open(os.devnull, 'w'))
+  lost = [summary for state, _, _, summary in files if state == 'running']
+  if lost:
+    add_summaries(lost).print_report(out = log)
+  log.close()
+  file = open(live_dir + '.json', 'w')
+  json.dump({'series': series, 'rates': rates(series), 'stable_since': stable_since(series),
+             'processes': dict((str(pid), state) for state, pid, _, _ in files),
+             'unmapped_threads': sum(unmapped for _, _, unmapped, _ in files)},
+            file, indent=1, sort_keys=True)
+  file.close()
+  if status:
+    if not files:
+      raise subprocess.CalledProcessError(status, init_path + 'run.sh')
+    sys.stderr.write('%s exited with status %d, using its partial counts\n' % (name, status))
+  return out_path
+
+def parse_report(clean_path, cache_dir, mode, name, inputs, remove_raw, out_path):
+  parser = Parser(open(out_path))
+  report = format_report(parser)
+  file = open(clean_path, 'w')
+  file.write(report)
+  file.close()
+  if remove_raw:
+    os.remove(out_path)
+  ResultCache(cache_dir).store(mode, name, inputs, parser)
+  return report
+
+def parse_remote_report(clean_path, cache_dir, mode, name, inputs, out_path, result):
+  """parse_report for the record of a count task run by a worker."""
+  file = open(out_path, 'w')
+  file.write(result['build_log'])
+  file.write(result.get('log', ''))
+  file.close()
+  if 'rusage' in result:
+    file = open(out_path[:-len('-raw.txt')] + '-rusage.json', 'w')
+    json.dump(result['rusage'], file, indent=1, sort_keys=True)
+    file.close()
+  return parse_report(clean_path, cache_dir, mode, name, inputs, True, out_path)
+
+def generate_final(names, unopt_prefix, opt_prefix, both_prefix, table = 'general', out = None):
+  out = out or sys.stdout
+  # one pass over each all-raw file yields every benchmark and the total
+  passes = []
+  for prefix, kind in [(unopt_prefix, 'Unoptimized'), (opt_prefix, 'Optimized')]:
+    all_raw_path = TEMP_DIR + '/' + prefix + 'all-raw.txt'
+    if not os.path.exists(all_raw_path):
+      sys.stderr.write('%s results missing (%s)\n' % (kind, all_raw_path))
+      parser = None
+    else:
+      parser = Parser(open(all_raw_path), sections=True)
+    passes.append((parser, kind, all_raw_path))
+
+  # the mini summaries of all benchmarks are computed at once on a table
+  # with an unoptimized and an optimized row per benchmark
+  entries = []
+  for name in names + ['all']:
+    for parser, kind, all_raw_path in passes:
+      if parser is None:
+        continue
+      if name == 'all':
+        entries.append((name, kind, parser))
+      elif name in parser.sections:
+        entries.append((name, kind, parser.sections[name]))
+      else:
+        sys.stderr.write('%s %s results missing (%s)\n' % (kind, name, all_raw_path))
+  mini_summaries = SummaryTable.from_report_sets(entries).mini_summary('Unoptimized', 'Optimized')
+
+  rows = []
+  for name in names + ['all']:
+    if name not in mini_summaries:
+      continue
+    both = format_mini_summary_row(mini_summaries[name])
+    file = open(TEMP_DIR + '/' + both_prefix + name + '.txt', 'w')
+    file.write(both)
+    file.close()
+    rows.append([name] + both.strip().split(' | '))
+  write_final_table(rows, table, out)
 
+def write_final_table(rows, table, out, warn=True):
+  """Write the rows ([bench, columns of a mini summary]) under the header of table."""
+  optimizations, last_headers = TABLES[table]
   header = ['bench', 'num loads/stores']
-  for opt in OPTIMIZATIONS:
+  for opt in optimizations:
     header.append('num optimized by ' + opt)
-  header.extend(LAST_HEADERS)
-  info[0] = header
+  header.extend(last_headers)
+  info = [header] + rows
+  for line in info[1:]:
+    if warn and len(line) != len(header):
+      sys.stderr.write('%s has %d optimization stages, the %s table expects %d\n' %
+                       (line[0], len(line) - len(last_headers) - 2, table, len(optimizations)))
 
   lengths = []
-  for i in xrange(len(info[0])):
+  for i in xrange(max(len(line) for line in info)):
     longest = 0
     for j in xrange(len(info)):
-      longest = max(longest, len(info[j][i]))
+      if i < len(info[j]):
+        longest = max(longest, len(info[j][i]))
     lengths.append(longest)
 
   for line in info:
     for i in xrange(len(line)):
       field = line[i].ljust(lengths[i], ' ')
       if i == 0:
-        sys.stdout.write(field)
+        out.write(field)
       elif i == len(line) - 1:
-        sys.stdout.write(' | %s\n' % field.strip())
+        out.write(' | %s\n' % field.strip())
       else:
-        sys.stdout.write(' | %s' % field)
+        out.write(' | %s' % field)
 
-def find_spec_names(path):
-  res = []
-  for entry in os.listdir(path):
-    prefix = path + '/' + entry
-    if not os.path.exists(prefix + '/src'):
-      continue
-    if not os.path.exists(prefix + '/run.sh'):
-      continue
-    res.append(entry)
-  return sorted(res)
+class LiveFinals(object):
+  """The final tables of a run, updated whenever a benchmark's report arrives.
+
+  The tables are rewritten to path after every update, so the results of a
+  long sweep can be read (and bad configurations aborted) while it runs.
+  Every final shows the benchmarks reported under both of its
+  configurations, those that failed under either, and an "all" row over the
+  benchmarks with both reports."""
+  def __init__(self, path, names, finals):
+    self.path = path
+    self.names = names
+    # [(title, unoptimized, optimized, table)]
+    self.finals = finals
+    self.reports = {}
+    self.failed = set()
+
+  def add(self, name, configuration, report):
+    self.reports[(name, configuration)] = Parser(StringIO(report))
+
+  def fail(self, name, configuration):
+    self.failed.add((name, configuration))
+
+  def write(self, status=None):
+    out = StringIO()
+    if status:
+      out.write(status + '\n\n')
+    for title, unoptimized, optimized, table in self.finals:
+      entries = [(name, config, self.reports[(name, config)]) for name in self.names
+                 for config in [unoptimized, optimized] if (name, config) in self.reports]
+      summaries = SummaryTable.from_report_sets(entries)
+      complete = [name for name in self.names if (name, unoptimized) in self.reports and
+                  (name, optimized) in self.reports]
+      for config in [unoptimized, optimized]:
+        summaries.add_sum('all', config, [(name, config) for name in complete])
+      mini_summaries = summaries.mini_summary(unoptimized, optimized)
+      rows = []
+      failed = 0
+      for name in self.names:
+        if (name, unoptimized) in self.failed or (name, optimized) in self.failed:
+          rows.append([name, 'fail'])
+          failed += 1
+        elif name in mini_summaries:
+          rows.append([name] + format_mini_summary_row(mini_summaries[name]).strip().split(' | '))
+      if complete:
+        rows.append(['all'] + format_mini_summary_row(mini_summaries['all']).strip().split(' | '))
+      out.write('%s: %s vs. %s (%d of %d benchmarks%s)\n' %
+                (title, unoptimized, optimized, len(complete), len(self.names),
+                 ', %d failed' % failed if failed else ''))
+      write_final_table(rows, table, out, warn=False)
+      out.write('\n')
+    write_atomic(self.path, out.getvalue())
 
 class MyOptionParser(optparse.OptionParser):
   def format_description(self, formatter):
@@ -137,21 +363,86 @@ if __name__ == '__main__':
   parser.add_option("-O", "--opt", action="store_true", dest="opt", default=False,
                     help="Using optimizing build")
   parser.add_option("-r", "--reuse", action="store_true", dest="use_old", default=False,
-                    help="Reuse old result files")
+                    help="Reuse cached results whose inputs are unchanged")
   parser.add_option("-c", "--no-execute", action="store_false", dest="execute", default=True,
                     help="Just compile without executing")
   parser.add_option("-f", "--final", action="store_true", dest="final", default=False,
                     help="Generate final output")
   parser.add_option("-v", "--verbose", action="store_true", dest="verbose", default=False,
                     help="Verbose output")
+  parser.add_option("-j", "--jobs", dest="jobs", type="int", default=PROCESSORS,
+                    help="Number of cores used by tasks and their make jobs together", metavar="JOBS")
+  parser.add_option("--no-jobserver", action="store_false", dest="jobserver", default=True,
+                    help="Run make serially instead of sharing the cores with it")
+  parser.add_option("--build-cache", dest="build_cache", default=BUILD_CACHE_DIR,
+                    help="Directory of cached builds", metavar="DIR")
+  parser.add_option("--no-build-cache", action="store_const", const=None, dest="build_cache",
+                    help="Always rebuild the benchmarks")
+  parser.add_option("--result-cache", dest="result_cache", default=RESULT_CACHE_DIR,
+                    help="Directory of cached results", metavar="DIR")
+  parser.add_option("--cache-max-age", dest="cache_max_age", type="float", default=MAX_AGE_DAYS,
+                    help="Drop cached results unused for DAYS", metavar="DAYS")
+  parser.add_option("--cache-max-size", dest="cache_max_size", type="float", default=MAX_SIZE_MB,
+                    help="Limit cached results to MB megabytes", metavar="MB")
+  parser.add_option("--sites", dest="sites", default=None,
+                    help="Record per-call-site check counts of the runs in DIR (see rtcc-sites.py)",
+                    metavar="DIR")
+  parser.add_option("--live", dest="live", type="float", default=None,
+                    help="Sample the run-time counters every SECONDS while the benchmarks run",
+                    metavar="SECONDS")
+  parser.add_option("--table", dest="table", default='general', choices=sorted(TABLES),
+                    help="Columns of the final table: %s" % ', '.join(sorted(TABLES)),
+                    metavar="TABLE")
+  parser.add_option("--workspaces", dest="workspaces", default=WORKSPACE_DIR,
+                    help="Directory of the build and run workspaces, e.g. on tmpfs", metavar="DIR")
+  parser.add_option("--sweep", dest="sweep", default=None,
+                    help="Build and run under every configuration of FILE and generate its finals",
+                    metavar="FILE")
+  parser.add_option("--db", dest="db", default=RESULT_DB,
+                    help="Add the results to the SQLite database PATH (see query-results.py)",
+                    metavar="PATH")
+  parser.add_option("--no-db", action="store_const", const=None, dest="db",
+                    help="Do not record the results")
+  parser.add_option("--label", dest="label", default=None,
+                    help="Label of the results in the database, e.g. the LLVM revision")
+  parser.add_option("--reduced", dest="reduced", default=None,
+                    help="Count on the reduced inputs SIZES of the benchmarks' run-SIZE.sh, " +
+                         "e.g. test,train (smallest first), and extrapolate to the reference " +
+                         "inputs (see harness/reduced.py)", metavar="SIZES")
+  parser.add_option("--reduced-tolerance", dest="reduced_tolerance", type="float", default=2.0,
+                    help="Run the reference inputs when the extrapolations from the reduced " +
+                         "inputs differ by more than PERCENT", metavar="PERCENT")
+  parser.add_option("--workers", dest="workers", action="append", default=[],
+                    help="Build and run on the spec-worker.py daemons at HOST:PORT,... " +
+                         "(repeatable); only parsing is done here", metavar="ADDRESSES")
+  parser.add_option("--retries", dest="retries", type="int", default=RETRIES,
+                    help="Times a task lost with its worker is sent to another one",
+                    metavar="TIMES")
   (options, args) = parser.parse_args()
-  if len(args) < 2:
+  if len(args) < (1 if options.sweep else 2):
     parser.print_help()
     exit()
+  try:
+    addresses = [parse_address(address) for addresses in options.workers
+                 for address in addresses.split(',') if address]
+  except ValueError as e:
+    parser.error(str(e))
+  if addresses and (options.sites or options.live):
+    parser.error('--sites and --live need local runs, not --workers')
+  reduced = options.reduced.split(',') if options.reduced and options.execute else None
+  if reduced and (addresses or options.sites or options.live):
+    parser.error('--reduced does not work with --workers, --sites or --live')
 
-  prefix = 'opt-' if options.opt else 'unopt-'
   spec_path = args[0]
-  clang_bin_dir = args[1]
+  clang_bin_dir = args[1] if len(args) > 1 else None
+  if options.sweep:
+    try:
+      configurations, finals = load_sweep(options.sweep, clang_bin_dir, TABLES)
+    except (ValueError, IOError) as e:
+      parser.error(str(e))
+  else:
+    configurations = [Configuration('opt' if options.opt else 'unopt', clang_bin_dir)]
+    finals = []
 
   names = find_spec_names(spec_path)
   #names = ['401.bzip2', '429.mcf', '433.milc', '456.hmmer', '458.sjeng', '462.libquantum', '470.lbm']
@@ -163,42 +454,237 @@ if __name__ == '__main__':
   sys.stderr.write('%s the following:\n' % action)
   for name in names:
     sys.stderr.write('%s\n' % name)
+  if options.sweep:
+    sys.stderr.write('under %s\n' % ', '.join(config.name for config in configurations))
   sys.stderr.write('\n')
 
   if not os.path.exists(TEMP_DIR):
     os.makedirs(TEMP_DIR)
+  if options.sites and not os.path.exists(options.sites):
+    os.makedirs(options.sites)
+
+  result_cache = ResultCache(options.result_cache)
+  jobserver = Jobserver(options.jobs) if options.jobserver else None
+  pool = None
+  if addresses:
+    pool = WorkerPool(addresses, options.retries)
+    if not pool.connect():
+      parser.error('no worker reachable')
+  progress = Progress()
+  graph = TaskGraph(jobserver, progress, pool)
+  live = None
+  if finals or options.final:
+    live = LiveFinals(LIVE_FINAL, names, [(final.name, final.unoptimized, final.optimized,
+                                          final.table) for final in finals] or
+                                         [('final', 'unopt', 'opt', options.table)])
+    # the other pass of -f comes from an earlier invocation
+    for _, unoptimized, optimized, _ in live.finals:
+      for config_name in [unoptimized, optimized]:
+        if config_name in [config.name for config in configurations]:
+          continue
+        for name in names:
+          clean_path = TEMP_DIR + '/' + config_name + '-' + name + '.txt'
+          if os.path.exists(clean_path):
+            live.add(name, config_name, open(clean_path).read())
+  parse_keys = {}
+  # the longest benchmarks start first, by the durations of earlier runs
+  durations = DurationIndex(DURATION_INDEX)
+  task_kinds = {}
+  reduced_runs = {}
+  # every benchmark is built once per distinct build of the configurations,
+  # in a workspace of its own, so the builds can proceed concurrently
+  builds = {}
+  build_logs = []
+  identities = {}
+  for config in configurations:
+    prefix = config.prefix
+    make_args = build_command(config.clang_bin_dir, config.cflags)
+    for name in names:
+      out_path = TEMP_DIR + '/' + prefix + name + '-raw.txt'
+      clean_path = TEMP_DIR + '/' + prefix + name + '.txt'
+      inputs = result_cache.inputs(spec_path, name, make_args, config.clang_bin_dir,
+                                   options.execute, config.env)
+      if reduced:
+        # extrapolated results must not pass for full ones
+        inputs['reduced'] = {'inputs': reduced, 'tolerance': options.reduced_tolerance}
+      identities[(config.name, name)] = build_identity(inputs)
+      if options.use_old:
+        report_set, reason = result_cache.lookup(prefix, name, inputs)
+        if report_set is not None:
+          sys.stderr.write('found old %s%s\n' % (prefix, name))
+          report = format_report(report_set)
+          file = open(clean_path, 'w')
+          file.write(report)
+          file.close()
+          if live:
+            live.add(name, config.name, report)
+          continue
+        if reason is not None:
+          sys.stderr.write('stale %s%s (%s)\n' % (prefix, name, reason))
+
+      build = (name,) + config.build_key()
+      task = name + ':' if not options.sweep else '%s:%s-' % (name, config.name)
+      parse_keys[task + 'parse'] = (name, config.name)
+      if pool:
+        # the worker builds (if it has not yet) and runs; the builds of a
+        # benchmark shared by several configurations stay on one worker
+        label = workspace_label(config.name, *config.build_key())
+        job = {'kind': 'count', 'execute': options.execute, 'env': config.env,
+               'build': {'benchmark': name, 'label': builds.setdefault(build, label),
+                         'make_args': make_args, 'clang_bin_dir': config.clang_bin_dir,
+                         'inputs': dict((key, inputs[key])
+                                        for key in ['sources', 'compiler', 'files'])}}
+        cost = durations.cost(name, config.name, 'compile') + \
+               durations.cost(name, config.name, 'run')
+        graph.add_remote(task + 'count', job, cost=cost, affinity=builds[build])
+        graph.add(task + 'parse', parse_remote_report,
+                  (clean_path, options.result_cache, prefix, name, inputs, out_path),
+                  deps=[task + 'count'], cost=durations.cost(name, config.name, 'parse'))
+        continue
+
+      if build not in builds:
+        workspace = Workspace(options.workspaces, spec_path, name,
+                              workspace_label(config.name, *config.build_key()))
+        build_log = TEMP_DIR + '/' + prefix + name + '-build.txt'
+        build_logs.append(build_log)
+        compile_key = name + ':compile' if not options.sweep else \
+                      '%s:compile-%s' % (name, config.name)
+        graph.add(compile_key, compile_benchmark,
+                  (name, build_log, workspace, config.clang_bin_dir, config.cflags,
+                   options.build_cache), cost=durations.cost(name, config.name, 'compile'))
+        task_kinds[compile_key] = (name, config.name, 'compile')
+        builds[build] = (workspace, compile_key)
+      workspace, compile_key = builds[build]
+
+      last = compile_key
+      if reduced:
+        last = graph.add(task + 'run', run_benchmark_reduced,
+                         (prefix + name, name, config.name, workspace, config.env, reduced,
+                          options.reduced_tolerance / 100.0, out_path),
+                         deps=[last], cost=durations.cost(name, config.name, 'reduced-run'))
+        task_kinds[last] = (name, config.name, 'reduced-run')
+        reduced_runs[last] = (name, config.name, out_path[:-len('-raw.txt')] + '-reduced.json')
+      elif options.execute:
+        last = graph.add(task + 'run', run_benchmark,
+                         (prefix + name, workspace, config.env, options.sites, options.live,
+                          out_path), deps=[last], cost=durations.cost(name, config.name, 'run'))
+        task_kinds[last] = (name, config.name, 'run')
+      # without a run, parse reads the build log, which may be shared
+      graph.add(task + 'parse', parse_report,
+                (clean_path, options.result_cache, prefix, name, inputs, options.execute),
+                deps=[last], cost=durations.cost(name, config.name, 'parse'))
+      task_kinds[task + 'parse'] = (name, config.name, 'parse')
 
-  handles = []
-  Q = multiprocessing.Queue()
-  for i in xrange(len(names)):
-    p = WorkerProcess(names[i], Q, options.execute, TEMP_DIR + '/' + prefix, options.use_old, spec_path, clang_bin_dir)
-    handles.append(p)
-
-  pos = 0
-  while pos < len(names):
-    working = pos - Q.qsize()
-    if working < PROCESSORS:
-      handles[pos].start()
-      pos += 1
+  def on_done(key, ok, result):
+    if live is None:
+      return
+    if key in parse_keys and ok:
+      live.add(*(parse_keys[key] + (result,)))
+    elif not ok:
+      for parse_key in parse_keys:
+        if parse_key in graph.failed:
+          live.fail(*parse_keys[parse_key])
+    live.write(progress.line(graph, options.jobs))
+
+  if live:
+    live.write(progress.line(graph, options.jobs))
+  results = graph.run(options.jobs, on_done)
+  if live:
+    live.write(progress.line(graph, options.jobs))
+  if pool:
+    pool.close()
+  result_cache.prune(options.cache_max_age, options.cache_max_size)
+  # durations on the workers' machines would skew the local estimates
+  for key, kind in task_kinds.items():
+    if key in results:
+      durations.record(*(kind + (graph.durations[key],)))
+  durations.save()
+  for key in sorted(reduced_runs):
+    if key not in results:
+      continue
+    name, configuration, reduced_path = reduced_runs[key]
+    info = json.load(open(reduced_path))
+    if 'full_run' in info:
+      how = 'full run (%s)' % info['full_run']
     else:
-      time.sleep(0.01)
+      how = 'extrapolated from %s, error %.1f%%' % (info['extrapolated_from'], 100 * info['error'])
+    sys.stderr.write('%s (%s): %s\n' % (name, configuration, how))
+  for build_log in build_logs:
+    if os.path.exists(build_log):
+      os.remove(build_log)
 
-  summary = ''
-  for i in xrange(len(handles)):
-    summary += handles[i].name + "\n" + Q.get()
+  if options.db:
+    # reused results were recorded by the invocation that produced them
+    db = ResultDB(options.db)
+    for config in configurations:
+      task = '' if not options.sweep else config.name + '-'
+      for name in names:
+        report = results.get('%s:%sparse' % (name, task))
+        if report is None:
+          continue
+        samples = []
+        rusage_path = TEMP_DIR + '/' + config.prefix + name + '-rusage.json'
+        if options.execute and os.path.exists(rusage_path):
+          samples.append(json.load(open(rusage_path)))
+          os.remove(rusage_path)
+        db.add_run('test-spec', name, config.name, identities[(config.name, name)],
+                   options.label, samples, Parser(StringIO(report)))
+    db.close()
 
-  all_raw_path = TEMP_DIR + '/' + prefix + 'all-raw.txt'
-  file = open(all_raw_path, 'w')
-  file.write(summary)
-  file.close()
+  table_entries = []
+  for config in configurations:
+    prefix = config.prefix
+    task = '' if not options.sweep else config.name + '-'
 
-  clean_out = subprocess.check_output([PYTHON, COMBINE_MSCC_PATH], stdin = open(all_raw_path))
-  file = open(TEMP_DIR + '/' + prefix + 'all.txt', 'w')
-  file.write(clean_out)
-  file.close()
+    # every benchmark with results becomes a section headed by its name
+    summary = ''
+    for name in names:
+      key = '%s:%sparse' % (name, task)
+      if key in graph.tasks:
+        report = results.get(key)
+      else:
+        report = open(TEMP_DIR + '/' + prefix + name + '.txt').read()
+      if report is not None:
+        summary += name + "\n" + report
+
+    all_raw_path = TEMP_DIR + '/' + prefix + 'all-raw.txt'
+    file = open(all_raw_path, 'w')
+    file.write(summary)
+    file.close()
+
+    parser = Parser(StringIO(summary), sections=True)
+    clean_out = format_report(parser)
+    table_entries.extend((name, config.name, parser.sections[name])
+                         for name in parser.section_names)
+    file = open(TEMP_DIR + '/' + prefix + 'all.txt', 'w')
+    file.write(clean_out)
+    file.close()
+
+    if options.verbose:
+      if options.sweep:
+        sys.stdout.write('%s:\n' % config.name)
+      sys.stdout.write(clean_out)
+
+  # the counters of every benchmark and configuration, for dashboards
+  table = SummaryTable.from_report_sets(table_entries)
+  for extension, write in [('csv', table.write_csv), ('json', table.write_json),
+                           ('tbl', table.write_binary)]:
+    file = open(TEMP_DIR + '/summary.' + extension, 'wb')
+    write(file)
+    file.close()
 
-  if options.verbose:
-    sys.stdout.write(clean_out)
+  if options.final and not options.sweep:
+    generate_final(names, 'unopt-', 'opt-', 'final-', options.table)
 
-  if options.final:
-    generate_final(names + ['all'], 'unopt-', 'opt-', 'final-')
+  # the tables of all finals, also kept in sweep-final.txt
+  combined = StringIO()
+  for final in finals:
+    combined.write('%s: %s vs. %s\n' % (final.name, final.unoptimized, final.optimized))
+    generate_final(names, final.unoptimized + '-', final.optimized + '-', final.name + '-',
+                   final.table, combined)
+    combined.write('\n')
+  if finals:
+    file = open(TEMP_DIR + '/sweep-final.txt', 'w')
+    file.write(combined.getvalue())
+    file.close()
+    sys.stdout.write(combined.getvalue())